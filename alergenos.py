@@ -0,0 +1,147 @@
+"""
+Normalización de alergias y restricciones alimentarias.
+
+El texto libre que llega del modelo ("maní", "cacahuate", "sin gluten", "no come
+mariscos ni pulpo") se traduce a códigos canónicos con un autómata Aho-Corasick
+construido una sola vez a partir del diccionario de sinónimos: una pasada por el
+texto encuentra todas las coincidencias a la vez.
+"""
+import re
+import unicodedata
+from collections import deque
+from typing import Dict, Iterable, List, Set
+
+# Código canónico -> sinónimos (sin tildes ni mayúsculas; se normalizan igual que el texto).
+ALERGENOS: Dict[str, List[str]] = {
+    "mani": ["mani", "cacahuate", "cacahuete", "peanut"],
+    "frutos_secos": [
+        "frutos secos", "fruto seco", "nuez", "almendra", "avellana", "pecana",
+        "castana", "castana de brasil", "pistacho", "maranon", "anacardo", "macadamia", "pinones"
+    ],
+    "crustaceos": [
+        "crustaceo", "camaron", "langostino", "langosta", "cangrejo", "jaiba", "gamba", "cigala"
+    ],
+    "moluscos": [
+        "molusco", "pulpo", "calamar", "concha", "conchas negras", "almeja", "mejillon",
+        "choro", "ostra", "ostion", "caracol", "pota"
+    ],
+    "mariscos": ["marisco", "mariscos", "frutos del mar", "fruto del mar"],
+    "pescado": ["pescado", "pez", "atun", "salmon", "anchoa", "bonito", "lenguado", "corvina", "trucha"],
+    # "harina" sola no: la de arroz, maíz o yuca no tiene gluten ("harina de trigo" ya cae por "trigo")
+    "gluten": ["gluten", "trigo", "cebada", "centeno", "avena", "celiaco", "celiaca", "celiaquia"],
+    "lacteos": ["lacteo", "lactosa", "leche", "queso", "mantequilla", "crema de leche", "yogur", "yogurt", "nata"],
+    "huevo": ["huevo", "clara de huevo", "yema"],
+    "soya": ["soya", "soja", "tofu", "sillao"],
+    "sesamo": ["sesamo", "ajonjoli", "tahini"],
+    "mostaza": ["mostaza"],
+    "apio": ["apio"],
+    "sulfitos": ["sulfito", "sulfitos", "dioxido de azufre"],
+    "altramuces": ["altramuz", "tarwi", "chocho"],
+    "cacao": ["cacao", "chocolate"],
+}
+
+RESTRICCIONES: Dict[str, List[str]] = {
+    "vegano": ["vegano", "vegana", "vegan", "plant based", "dieta vegetal"],
+    "vegetariano": ["vegetariano", "vegetariana", "ovolactovegetariano", "no come carne", "sin carne"],
+    "pescetariano": ["pescetariano", "pescetariana", "pescatariano"],
+    # Solo frases de exclusión: "cerdo" o "chancho" a secas también los escribe quien sí los quiere
+    "sin_cerdo": ["sin cerdo", "no cerdo", "no come cerdo", "sin chancho", "no chancho", "no come chancho"],
+    "halal": ["halal"],
+    "kosher": ["kosher", "kasher"],
+    "sin_alcohol": ["sin alcohol", "no alcohol", "no bebe", "abstemio", "abstemia"],
+    "embarazo": ["embarazo", "embarazada", "gestante"],
+    "diabetes": ["diabetes", "diabetico", "diabetica", "sin azucar"],
+}
+
+SINONIMOS: Dict[str, List[str]] = {**ALERGENOS, **RESTRICCIONES}
+
+_NO_ALFANUMERICO = re.compile(r"[^a-z0-9]+")
+
+def normalizar_texto(texto: str) -> str:
+    """Minúsculas, sin tildes y con un solo espacio entre palabras (y en los bordes)."""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " " + _NO_ALFANUMERICO.sub(" ", texto).strip() + " "
+
+def con_plurales(patron: str) -> Set[str]:
+    """
+    El patrón (ya normalizado) y sus plurales simples, formados sobre la última palabra:
+    "almendras", "camarones", y z -> ces ("pez" -> "peces", "nuez" -> "nueces").
+    """
+    formas = {patron, patron + "s", patron + "es"}
+    if patron.endswith("z"):
+        formas.add(patron[:-1] + "ces")
+    return formas
+
+class MatcherAhoCorasick:
+    """
+    Autómata Aho-Corasick sobre palabras completas: cada patrón se busca como
+    " patron " dentro del texto normalizado, así "pez" no coincide dentro de "pezuña".
+    """
+
+    def __init__(self, sinonimos: Dict[str, Iterable[str]]):
+        self._transiciones: List[Dict[str, int]] = [{}]
+        self._fallo: List[int] = [0]
+        self._salidas: List[Set[str]] = [set()]
+
+        for codigo, variantes in sinonimos.items():
+            for variante in variantes:
+                base = normalizar_texto(variante).strip()
+                if not base:
+                    continue
+                # Plurales simples ("almendras", "camarones", "peces") sin tener que listarlos.
+                for patron in con_plurales(base):
+                    self._agregar(f" {patron} ", codigo)
+        self._construir_fallos()
+
+    def _agregar(self, patron: str, codigo: str):
+        estado = 0
+        for caracter in patron:
+            siguiente = self._transiciones[estado].get(caracter)
+            if siguiente is None:
+                siguiente = len(self._transiciones)
+                self._transiciones[estado][caracter] = siguiente
+                self._transiciones.append({})
+                self._fallo.append(0)
+                self._salidas.append(set())
+            estado = siguiente
+        self._salidas[estado].add(codigo)
+
+    def _construir_fallos(self):
+        cola = deque(self._transiciones[0].values())
+        while cola:
+            estado = cola.popleft()
+            for caracter, siguiente in self._transiciones[estado].items():
+                cola.append(siguiente)
+                fallo = self._fallo[estado]
+                while fallo and caracter not in self._transiciones[fallo]:
+                    fallo = self._fallo[fallo]
+                destino = self._transiciones[fallo].get(caracter, 0)
+                self._fallo[siguiente] = destino if destino != siguiente else 0
+                self._salidas[siguiente] |= self._salidas[self._fallo[siguiente]]
+
+    def buscar_normalizado(self, texto: str) -> Set[str]:
+        """Como `buscar`, para texto que ya pasó por normalizar_texto."""
+        encontrados: Set[str] = set()
+        transiciones, fallo, salidas = self._transiciones, self._fallo, self._salidas
+        estado = 0
+        for caracter in texto:
+            while estado and caracter not in transiciones[estado]:
+                estado = fallo[estado]
+            estado = transiciones[estado].get(caracter, 0)
+            if salidas[estado]:
+                encontrados |= salidas[estado]
+        return encontrados
+
+    def buscar(self, texto: str) -> Set[str]:
+        """Códigos canónicos presentes en el texto, en una sola pasada."""
+        if not texto:
+            return set()
+        return self.buscar_normalizado(normalizar_texto(texto))
+
+# Autómata compartido, construido una vez al importar el módulo.
+matcher = MatcherAhoCorasick(SINONIMOS)
+
+def codigos_alergenos(texto: str) -> Set[str]:
+    """Atajo: códigos canónicos (alérgenos y restricciones) mencionados en un texto libre."""
+    return matcher.buscar(texto)
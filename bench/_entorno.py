@@ -0,0 +1,83 @@
+"""
+Entorno común de los benchmarks.
+
+Igual que las pruebas, los benchmarks usan por defecto una base SQLite temporal
+(nunca la de .env): las variables se fijan antes de importar `database`. Para
+medir contra otro motor se pasa su URL en BENCH_DATABASE_URL, p. ej.
+
+    BENCH_DATABASE_URL="mssql+aioodbc://..." python -m bench.round_trips_reserva
+
+¡Ojo! `preparar_bd` borra y vuelve a crear las tablas de esa base.
+"""
+import os
+import tempfile
+
+_DIRECTORIO = tempfile.mkdtemp(prefix="crm_bench_")
+os.environ["DATABASE_URL"] = os.environ.get(
+    "BENCH_DATABASE_URL", f"sqlite+aiosqlite:///{os.path.join(_DIRECTORIO, 'bench.db')}"
+)
+os.environ.pop("READ_DATABASE_URL", None)
+os.environ.setdefault("GOOGLE_API_KEY", "bench")
+os.environ["RECOMENDADOR_MODELOS_DIR"] = os.path.join(_DIRECTORIO, "modelos")
+
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+import database
+import models
+
+EXPERIENCIAS = [
+    {"Id": 1, "Codigo": "DEG", "Nombre": "Menú Degustación", "DuracionMinutos": 180, "Precio": 890},
+    {"Id": 2, "Codigo": "INM", "Nombre": "Inmersión Central", "DuracionMinutos": 360, "Precio": 1800},
+    {"Id": 3, "Codigo": "THB", "Nombre": "Theobromas Lab", "DuracionMinutos": 120, "Precio": 250},
+]
+
+async def preparar_bd(usuarios: int = 1):
+    """Esquema vacío con las tres experiencias y `usuarios` usuarios (Ids 1..n)."""
+    async with database.engine.begin() as conn:
+        await conn.run_sync(database.Base.metadata.drop_all)
+        await conn.run_sync(database.Base.metadata.create_all)
+    async with database.AsyncSessionFactory() as db:
+        db.add_all(models.Experiencia(**e) for e in EXPERIENCIAS)
+        db.add_all(
+            models.Usuario(Id=i, Nombre=f"Cliente {i}", Email=f"cliente{i}@example.com")
+            for i in range(1, usuarios + 1)
+        )
+        await db.commit()
+
+class ContadorIdaYVuelta:
+    """
+    Cuenta los viajes a la BD del motor principal: cada sentencia enviada y cada COMMIT.
+    Con `latencia_ms` simula la red entre la app y la BD (una pausa por viaje).
+    """
+    def __init__(self, latencia_ms: float = 0.0):
+        self.latencia = latencia_ms / 1000
+        self.viajes = []
+        self._activo = False
+        motor = database.engine.sync_engine
+        event.listen(motor, "before_cursor_execute", self._sentencia)
+        event.listen(motor, "commit", self._commit)
+
+    def _sentencia(self, _conn, _cursor, sql, *_):
+        if self._activo:
+            self.viajes.append(" ".join(sql.split()[:3]))
+            self._esperar()
+
+    def _commit(self, _conn):
+        if self._activo:
+            self.viajes.append("COMMIT")
+            self._esperar()
+
+    def _esperar(self):
+        if self.latencia:
+            time.sleep(self.latencia)
+
+    @contextmanager
+    def medir(self):
+        self.viajes, self._activo = [], True
+        try:
+            yield self
+        finally:
+            self._activo = False
@@ -0,0 +1,88 @@
+"""
+Costo de construir y compilar las consultas frecuentes en cada llamada (user-029).
+
+Ejecuta las consultas de get_user_context, la preferencia de handle_guardar_perfil y
+el catálogo de get_all_experiences desde `--concurrencia` tareas a la vez, de tres formas:
+
+- precompilada: las sentencias de módulo de services.py con bindparam (lo actual);
+- construida en cada llamada: el select(...) se arma en cada ejecución, como antes;
+  SQLAlchemy aún reutiliza el SQL compilado, pero paga armar el objeto y su cache key;
+- sin caché de compilación: lo mismo, además compilando el SQL cada vez
+  (lo que ocurre cuando la caché de compilación se llena o se desactiva).
+
+El sobrecosto por llamada es la diferencia de tiempo frente a la precompilada.
+
+    python -m bench.compilacion_concurrente [--concurrencia 32] [--llamadas 100]
+"""
+import argparse
+import asyncio
+import time
+
+from bench._entorno import preparar_bd
+
+import database
+import models
+import services
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+USUARIOS = 50
+
+def _consultas_construidas(user_id: int) -> list:
+    return [
+        (
+            select(models.Usuario)
+            .options(joinedload(models.Usuario.preferencias), joinedload(models.Usuario.reservas))
+            .where(models.Usuario.Id == user_id),
+            None
+        ),
+        (select(models.Preferencia).where(models.Preferencia.UsuarioId == user_id), None),
+        (select(models.Experiencia), None),
+    ]
+
+def _consultas_precompiladas(user_id: int) -> list:
+    return [
+        (services._SELECT_CONTEXTO_USUARIO, {"user_id": user_id}),
+        (services._SELECT_PREFERENCIA_USUARIO, {"user_id": user_id}),
+        (services._SELECT_CATALOGO, None),
+    ]
+
+VARIANTES = [
+    ("precompilada", _consultas_precompiladas, {}),
+    ("construida en cada llamada", _consultas_construidas, {}),
+    ("sin caché de compilación", _consultas_construidas, {"compiled_cache": None}),
+]
+
+async def _trabajador(indice: int, llamadas: int, consultas, opciones: dict):
+    async with database.AsyncSessionFactory() as db:
+        for i in range(llamadas):
+            for stmt, parametros in consultas(1 + (indice + i) % USUARIOS):
+                result = await db.execute(stmt, parametros, execution_options=opciones)
+                result.unique().scalars().all()
+
+async def main(concurrencia: int, llamadas: int, rondas: int):
+    await preparar_bd(usuarios=USUARIOS)
+    total = concurrencia * llamadas
+    print(f"Motor: {database.DIALECTO}, {concurrencia} tareas x {llamadas} llamadas (3 consultas por llamada), mejor de {rondas}\n")
+    print(f"{'variante':<30}{'llamadas/s':>12}{'µs/llamada':>12}{'sobrecosto µs':>15}")
+    base = None
+    for nombre, consultas, opciones in VARIANTES:
+        # Calentamiento: conexiones del pool y primera compilación
+        await asyncio.gather(*(_trabajador(t, 2, consultas, opciones) for t in range(concurrencia)))
+        mejor = float("inf")
+        for _ in range(rondas):
+            inicio = time.perf_counter()
+            await asyncio.gather(*(_trabajador(t, llamadas, consultas, opciones) for t in range(concurrencia)))
+            mejor = min(mejor, time.perf_counter() - inicio)
+        por_llamada = mejor * 1e6 / total
+        base = por_llamada if base is None else base
+        print(f"{nombre:<30}{total / mejor:>12.0f}{por_llamada:>12.1f}{por_llamada - base:>15.1f}")
+    await database.engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrencia", type=int, default=32)
+    parser.add_argument("--llamadas", type=int, default=100)
+    parser.add_argument("--rondas", type=int, default=3)
+    opciones = parser.parse_args()
+    asyncio.run(main(opciones.concurrencia, opciones.llamadas, opciones.rondas))
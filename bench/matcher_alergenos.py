@@ -0,0 +1,78 @@
+"""
+Rendimiento del matcher de alérgenos y restricciones (user-033).
+
+Genera textos cortos parecidos a los que escribe el modelo ("alérgica al maní y a
+los camarones, sin gluten") y mide textos/s de:
+
+- codigos_alergenos: normalización + autómata Aho-Corasick (una pasada por texto);
+- solo el autómata, sobre texto ya normalizado;
+- la alternativa ingenua: una búsqueda de " sinónimo " por cada patrón del diccionario.
+
+    python -m bench.matcher_alergenos [--textos 50000] [--semilla 7]
+
+No usa la BD.
+"""
+import argparse
+import random
+import time
+
+from alergenos import SINONIMOS, codigos_alergenos, con_plurales, matcher, normalizar_texto
+
+RELLENO = [
+    "alérgica al", "no puede comer", "evitar", "por favor", "nada de", "intolerante a la",
+    "mesa para dos", "cumpleaños", "prefiere", "y", "ni", "también", "la niña", "sin",
+]
+
+def generar_textos(cantidad: int, semilla: int) -> list:
+    azar = random.Random(semilla)
+    sinonimos = [s for variantes in SINONIMOS.values() for s in variantes]
+    textos = []
+    for _ in range(cantidad):
+        palabras = [azar.choice(RELLENO) for _ in range(azar.randint(2, 6))]
+        for _ in range(azar.randint(0, 3)):
+            palabras.insert(azar.randrange(len(palabras) + 1), azar.choice(sinonimos))
+        textos.append(" ".join(palabras).capitalize())
+    return textos
+
+def _ingenuo(texto: str, patrones: list) -> set:
+    normalizado = normalizar_texto(texto)
+    return {codigo for patron, codigo in patrones if patron in normalizado}
+
+def _medir(nombre: str, funcion, textos: list, rondas: int) -> float:
+    mejor = float("inf")
+    for _ in range(rondas):
+        inicio = time.perf_counter()
+        for texto in textos:
+            funcion(texto)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    por_segundo = len(textos) / mejor
+    print(f"{nombre:<44}{por_segundo:>12,.0f}{mejor * 1e6 / len(textos):>12.2f}")
+    return por_segundo
+
+def main(cantidad: int, semilla: int, rondas: int):
+    textos = generar_textos(cantidad, semilla)
+    normalizados = [normalizar_texto(t) for t in textos]
+    patrones = [
+        (f" {p} ", codigo)
+        for codigo, variantes in SINONIMOS.items()
+        for v in variantes
+        for p in con_plurales(normalizar_texto(v).strip())
+    ]
+    largo_medio = sum(len(t) for t in textos) / len(textos)
+    print(f"{len(textos)} textos (largo medio {largo_medio:.0f} caracteres), {len(patrones)} patrones, mejor de {rondas}\n")
+    print(f"{'camino':<44}{'textos/s':>12}{'µs/texto':>12}")
+    _medir("codigos_alergenos (normalizar + autómata)", codigos_alergenos, textos, rondas)
+    _medir("solo el autómata (texto ya normalizado)", matcher.buscar_normalizado, normalizados, rondas)
+    _medir("ingenuo: un `in` por patrón", lambda t: _ingenuo(t, patrones), textos, rondas)
+
+    # Los dos caminos deben dar los mismos códigos
+    distintos = sum(codigos_alergenos(t) != _ingenuo(t, patrones) for t in textos)
+    print(f"\nTextos con resultados distintos entre autómata e ingenuo: {distintos}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--textos", type=int, default=50000)
+    parser.add_argument("--semilla", type=int, default=7)
+    parser.add_argument("--rondas", type=int, default=3)
+    opciones = parser.parse_args()
+    main(opciones.textos, opciones.semilla, opciones.rondas)
@@ -0,0 +1,106 @@
+"""
+Viajes a la BD por reserva creada (user-026).
+
+Compara el camino original de crear_reserva (SELECT de la experiencia, INSERT,
+COMMIT y el SELECT de db.refresh para leer el Id) con el actual (validación
+contra el catálogo en memoria e INSERT ... OUTPUT INSERTED.Id / RETURNING +
+COMMIT). También mide handle_crear_reserva completo, que hoy además guarda los
+alérgenos normalizados y suma el resumen OcupacionDiaria en la misma transacción.
+
+    python -m bench.round_trips_reserva [--reservas 200] [--latencia-ms 1]
+
+Con --latencia-ms cada viaje espera ese tiempo, como la red entre la app y la BD.
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from bench._entorno import ContadorIdaYVuelta, preparar_bd
+
+import database
+import models
+from services import DBService, _INSERT_RESERVA
+from sqlalchemy import select
+
+INICIO = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+def _args(i: int) -> dict:
+    return {
+        "experiencia_id": 1 + i % 3,
+        "fecha_hora": (INICIO + timedelta(minutes=15 * i)).isoformat(),
+        "num_comensales": 2,
+        "nombre_reserva": f"Reserva {i}",
+        "restricciones_adicionales": "sin maní" if i % 2 else None
+    }
+
+def _valores(args: dict) -> dict:
+    return {
+        "UsuarioId": 1,
+        "NombreReserva": args["nombre_reserva"],
+        "NumComensales": args["num_comensales"],
+        "ExperienciaId": args["experiencia_id"],
+        "FechaHora": datetime.fromisoformat(args["fecha_hora"]),
+        "Restricciones": args["restricciones_adicionales"],
+        "Estado": "pendiente"
+    }
+
+async def reserva_original(db, servicio, args) -> int:
+    """El cuerpo de handle_crear_reserva antes del cambio."""
+    result = await db.execute(select(models.Experiencia).where(models.Experiencia.Id == args["experiencia_id"]))
+    assert result.scalars().first() is not None
+    reserva = models.Reserva(**_valores(args))
+    db.add(reserva)
+    await db.commit()
+    await db.refresh(reserva)
+    return reserva.Id
+
+async def reserva_returning(db, servicio, args) -> int:
+    """Solo la parte que cambió: catálogo en memoria + INSERT ... RETURNING + COMMIT."""
+    assert await servicio.get_experiencia(db, args["experiencia_id"]) is not None
+    reserva_id = (await db.execute(_INSERT_RESERVA, _valores(args))).scalar_one()
+    await db.commit()
+    return reserva_id
+
+async def reserva_completa(db, servicio, args) -> int:
+    """handle_crear_reserva tal como está hoy (sin session_id)."""
+    respuesta = await servicio.handle_crear_reserva(db, 1, args)
+    assert respuesta["status"] == "exito", respuesta
+    return respuesta["reserva_id"]
+
+CAMINOS = [
+    ("original: SELECT + INSERT + COMMIT + refresh", reserva_original),
+    ("INSERT ... RETURNING + COMMIT", reserva_returning),
+    ("handle_crear_reserva completo", reserva_completa),
+]
+
+async def main(reservas: int, latencia_ms: float):
+    contador = ContadorIdaYVuelta(latencia_ms)
+    print(f"Motor: {database.DIALECTO}, {reservas} reservas por camino, latencia simulada {latencia_ms} ms\n")
+    print(f"{'camino':<48}{'viajes/reserva':>16}{'ms/reserva':>12}")
+    for nombre, camino in CAMINOS:
+        await preparar_bd()
+        servicio = DBService()
+        async with database.AsyncSessionFactory() as db:
+            # Catálogo caliente, como tras el primer get_all_experiences de la sesión
+            await servicio.get_all_experiences(db)
+            with contador.medir():
+                # Fuera de la medición: la primera compilación de cada sentencia
+                await camino(db, servicio, _args(0))
+            viajes = 0
+            inicio = time.perf_counter()
+            for i in range(1, reservas + 1):
+                with contador.medir():
+                    await camino(db, servicio, _args(i))
+                viajes += len(contador.viajes)
+            transcurrido = time.perf_counter() - inicio
+        print(f"{nombre:<48}{viajes / reservas:>16.1f}{transcurrido * 1000 / reservas:>12.2f}")
+        print(f"{'':<4}{' | '.join(contador.viajes)}")
+    await database.engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reservas", type=int, default=200)
+    parser.add_argument("--latencia-ms", type=float, default=1.0)
+    opciones = parser.parse_args()
+    asyncio.run(main(opciones.reservas, opciones.latencia_ms))
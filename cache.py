@@ -0,0 +1,67 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+class CacheLRU:
+    """
+    Caché en memoria acotada por número de entradas (se expulsa la menos usada),
+    con caducidad opcional y contadores de aciertos/fallos.
+    """
+
+    def __init__(self, max_entradas: int = 1000, ttl_segundos: Optional[float] = None):
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+        self._datos: OrderedDict = OrderedDict()  # clave -> (expira_en, valor)
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+
+    def get(self, clave: Hashable, default: Any = None) -> Any:
+        entrada = self._datos.get(clave)
+        if entrada is None:
+            self.fallos += 1
+            return default
+        expira_en, valor = entrada
+        if expira_en is not None and expira_en < time.monotonic():
+            del self._datos[clave]
+            self.fallos += 1
+            return default
+        self._datos.move_to_end(clave)
+        self.aciertos += 1
+        return valor
+
+    def peek(self, clave: Hashable, default: Any = None) -> Any:
+        """Como get, pero sin contar en las métricas ni cambiar el orden LRU."""
+        entrada = self._datos.get(clave)
+        if entrada is None or (entrada[0] is not None and entrada[0] < time.monotonic()):
+            return default
+        return entrada[1]
+
+    def set(self, clave: Hashable, valor: Any):
+        expira_en = time.monotonic() + self.ttl_segundos if self.ttl_segundos else None
+        self._datos[clave] = (expira_en, valor)
+        self._datos.move_to_end(clave)
+        while len(self._datos) > self.max_entradas:
+            self._datos.popitem(last=False)
+            self.expulsiones += 1
+
+    def invalidar(self, clave: Hashable):
+        self._datos.pop(clave, None)
+
+    def invalidar_donde(self, predicado: Callable[[Hashable, Any], bool]):
+        """Descarta las entradas cuyo (clave, valor) cumple el predicado. Recorre toda la caché."""
+        for clave in [c for c, (_, valor) in self._datos.items() if predicado(c, valor)]:
+            del self._datos[clave]
+
+    def limpiar(self):
+        self._datos.clear()
+
+    def metricas(self) -> dict:
+        consultas = self.aciertos + self.fallos
+        return {
+            "entradas": len(self._datos),
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "expulsiones": self.expulsiones,
+            "tasa_aciertos": round(self.aciertos / consultas, 4) if consultas else 0.0
+        }
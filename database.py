@@ -1,19 +1,106 @@
 import os
+import time
+from typing import Dict, Optional
 from pydantic_settings import BaseSettings
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 
 class Settings(BaseSettings):
     DATABASE_URL: str
+    # Réplica de solo lectura (opcional). Si no se define, se lee del primario.
+    READ_DATABASE_URL: Optional[str] = None
+    # Tras una escritura, las lecturas de ese usuario van al primario durante
+    # este tiempo, para no leer datos viejos por el retraso de replicación.
+    READ_AFTER_WRITE_SEGUNDOS: float = 10.0
+    # Crear las tablas que falten al arrancar (útil con SQLite/PostgreSQL en local o CI).
+    # En SQL Server el esquema se aplica con los scripts de migraciones/.
+    CREAR_TABLAS: bool = False
     GOOGLE_API_KEY: str
 
+    # Escritura diferida de RecomendacionesLog
+    LOG_RECOMENDACIONES_LOTE: int = 100
+    LOG_RECOMENDACIONES_INTERVALO_SEGUNDOS: float = 2.0
+    LOG_RECOMENDACIONES_MAX_PENDIENTES: int = 10000
+
+    # Caché del contexto de usuario (el TTL cubre cambios hechos fuera de este servicio)
+    CONTEXTO_CACHE_MAX_USUARIOS: int = 5000
+    CONTEXTO_CACHE_TTL_SEGUNDOS: float = 900.0
+
+    # Caché del reporte de alérgenos para cocina (por fecha y experiencia)
+    REPORTE_COCINA_CACHE_TTL_SEGUNDOS: float = 600.0
+
+    # Motor de disponibilidad: cada cuánto se reconstruye el índice de ocupación desde Reservas
+    DISPONIBILIDAD_RECARGA_MINUTOS: float = 10.0
+
+    # Hora del día (0-23) a la que el servidor marca como completadas las reservas de días
+    # anteriores; None para no programarlo (p. ej. si se lanza con cron: python jobs.py completar-reservas)
+    COMPLETAR_RESERVAS_HORA: Optional[int] = 3
+
+    # Promotor de la lista de espera: además de reaccionar a cada cupo liberado,
+    # revisa todos los turnos con solicitudes cada tantos segundos
+    LISTA_ESPERA_BARRIDO_SEGUNDOS: float = 300.0
+
+    # Claves de idempotencia de crear_reserva recordadas en memoria (la BD las guarda siempre)
+    IDEMPOTENCIA_CACHE_MAX_CLAVES: int = 10000
+    IDEMPOTENCIA_CACHE_TTL_SEGUNDOS: float = 3600.0
+
+    # Pesos entrenados del recomendador (python jobs.py entrenar-recomendador). El servidor
+    # mira el puntero del directorio cada tantos segundos y carga la versión nueva sin reiniciar.
+    RECOMENDADOR_MODELOS_DIR: str = "modelos"
+    RECOMENDADOR_RECARGA_SEGUNDOS: float = 30.0
+
+    # Respuestas de recomendar_experiencia ya calculados por (rasgos, historial, versión de la matriz)
+    RECOMENDACION_CACHE_MAX_ENTRADAS: int = 5000
+
+    # Índice de clientes similares: cada cuánto se releen los usuarios con cambios
+    SIMILARES_INTERVALO_SEGUNDOS: float = 5.0
+
+    # Cabecera Server-Timing con los tiempos por etapa de cada petición e histogramas en /metricas
+    SERVER_TIMING_HABILITADO: bool = True
+
+    # Sincronización masiva con el CRM (filas por transacción)
+    CRM_LOTE_SINCRONIZACION: int = 1000
+
     class Config:
         env_file = ".env"
 
 settings = Settings()
 
+def _opciones_motor(url: str) -> dict:
+    """Opciones del motor según el driver indicado en la URL
+       (mssql+aioodbc, postgresql+asyncpg o sqlite+aiosqlite)."""
+    if make_url(url).get_backend_name() == "mssql":
+        # Los INSERT en lote ya se agrupan en un solo VALUES múltiple (insertmanyvalues).
+        return {}
+    # Los modelos usan el esquema 'dbo' de SQL Server; en los demás motores
+    # las tablas viven en el esquema por defecto.
+    return {"execution_options": {"schema_translate_map": {"dbo": None}}}
+
+# Motor de la BD principal: "mssql", "postgresql" o "sqlite"
+DIALECTO = make_url(settings.DATABASE_URL).get_backend_name()
+
 # Configurar el motor asíncrono de SQLAlchemy
-engine = create_async_engine(settings.DATABASE_URL)
+engine = create_async_engine(settings.DATABASE_URL, **_opciones_motor(settings.DATABASE_URL))
+
+# Motor de lectura (réplica). Sin réplica configurada, es el mismo motor.
+read_engine = (
+    create_async_engine(settings.READ_DATABASE_URL, **_opciones_motor(settings.READ_DATABASE_URL))
+    if settings.READ_DATABASE_URL else engine
+)
+
+def _activar_claves_foraneas(motor):
+    """SQLite solo aplica las FOREIGN KEY (y sus ON DELETE) si se activan en cada conexión."""
+    @event.listens_for(motor.sync_engine, "connect")
+    def _pragma_foreign_keys(conexion_dbapi, _registro):
+        cursor = conexion_dbapi.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+for _motor in ((engine,) if read_engine is engine else (engine, read_engine)):
+    if _motor.dialect.name == "sqlite":
+        _activar_claves_foraneas(_motor)
 
 # Base para los modelos declarativos
 class Base(DeclarativeBase):
@@ -26,7 +113,97 @@ AsyncSessionFactory = sessionmaker(
     expire_on_commit=False
 )
 
+# Fábrica de sesiones de solo lectura (réplica)
+AsyncReadSessionFactory = sessionmaker(
+    bind=read_engine,
+    class_=AsyncSession,
+    expire_on_commit=False
+) if read_engine is not engine else AsyncSessionFactory
+
+class EnrutadorLecturas:
+    """
+    Decide si una lectura va a la réplica o al primario.
+    Si el usuario escribió hace poco (menos de `ventana_segundos`), su lectura
+    va al primario para que vea sus propios cambios (read-your-writes).
+    """
+    MAX_USUARIOS_RECIENTES = 10000
+
+    def __init__(
+        self,
+        ventana_segundos: float,
+        primario: sessionmaker = AsyncSessionFactory,
+        replica: sessionmaker = AsyncReadSessionFactory
+    ):
+        self.ventana_segundos = ventana_segundos
+        self._primario = primario
+        self._replica = replica
+        self._ultimas_escrituras: Dict[int, float] = {}
+
+    def registrar_escritura(self, user_id: Optional[int]):
+        if not user_id:
+            return
+        ahora = time.monotonic()
+        if len(self._ultimas_escrituras) >= self.MAX_USUARIOS_RECIENTES:
+            # Limpiar las entradas que ya salieron de la ventana
+            limite = ahora - self.ventana_segundos
+            self._ultimas_escrituras = {
+                uid: t for uid, t in self._ultimas_escrituras.items() if t > limite
+            }
+        self._ultimas_escrituras[user_id] = ahora
+
+    def debe_leer_del_primario(self, user_id: Optional[int]) -> bool:
+        ultima = self._ultimas_escrituras.get(user_id) if user_id else None
+        return ultima is not None and time.monotonic() - ultima < self.ventana_segundos
+
+    def session_factory(self, user_id: Optional[int] = None) -> sessionmaker:
+        """Fábrica de sesiones a usar para las lecturas de este usuario."""
+        if self.debe_leer_del_primario(user_id):
+            return self._primario
+        return self._replica
+
+enrutador_lecturas = EnrutadorLecturas(settings.READ_AFTER_WRITE_SEGUNDOS)
+
+def soporta_returning() -> bool:
+    """Si el motor admite INSERT ... RETURNING / OUTPUT INSERTED."""
+    return engine.dialect.insert_returning
+
+def soporta_update_returning() -> bool:
+    """Si el motor admite UPDATE ... RETURNING / OUTPUT INSERTED."""
+    return engine.dialect.update_returning
+
+def construir_upsert(modelo, claves: list, columnas_actualizar: list, sumar: bool = False, incrementar: tuple = ()):
+    """
+    Devuelve un INSERT ... ON CONFLICT DO UPDATE para PostgreSQL y SQLite,
+    o None si el motor no tiene upsert nativo (SQL Server) y hay que
+    resolverlo con SELECT + UPDATE/INSERT.
+    Con sumar=True las columnas se incrementan (col = col + nuevo) en vez de reemplazarse.
+    Las columnas de `incrementar` (contadores de versión) pasan a col + 1 si la fila ya existía.
+    """
+    if DIALECTO == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif DIALECTO == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+    stmt = dialect_insert(modelo)
+    actualizar = {
+        col: getattr(modelo, col) + getattr(stmt.excluded, col) if sumar else getattr(stmt.excluded, col)
+        for col in columnas_actualizar
+    }
+    actualizar.update({col: getattr(modelo, col) + 1 for col in incrementar})
+    return stmt.on_conflict_do_update(index_elements=claves, set_=actualizar)
+
+async def crear_tablas():
+    """Crea las tablas que falten (no toca las existentes)."""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
 # Dependencia de FastAPI para obtener la sesión de BD
 async def get_db_session():
     async with AsyncSessionFactory() as session:
+        yield session
+
+# Dependencia de FastAPI para consultas de solo lectura (reportes, catálogos)
+async def get_read_db_session():
+    async with AsyncReadSessionFactory() as session:
         yield session
\ No newline at end of file
@@ -0,0 +1,288 @@
+"""
+Motor de capacidad y disponibilidad de las experiencias.
+
+Cada experiencia puede tener franjas de atención (HorariosExperiencia) con una
+capacidad en comensales simultáneos. La ocupación se lleva en memoria en turnos
+de 15 minutos por (experiencia, día): una reserva ocupa todos los turnos que
+cubre su duración (Experiencia.DuracionMinutos). El índice se reconstruye desde
+Reservas al arrancar (y cada DISPONIBILIDAD_RECARGA_MINUTOS) y se actualiza de
+forma incremental con cada reserva admitida o liberada.
+
+La admisión es atómica dentro del proceso: la comprobación de cupo y el INSERT
+se hacen con el candado del (experiencia, día) tomado. Admisiones y cambios de
+estado no se solapan con una recarga: cada cambio se aplica o al índice viejo antes
+de leer Reservas, o al nuevo después, nunca a los dos. Con varios procesos
+(workers) cada uno tendría su propio índice, así que el servicio se despliega
+con un único worker.
+"""
+import asyncio
+import traceback
+from contextlib import asynccontextmanager
+from datetime import date, datetime, time, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from database import AsyncSessionFactory, settings
+
+MINUTOS_TURNO = 15
+TURNOS_POR_DIA = 24 * 60 // MINUTOS_TURNO
+DURACION_POR_DEFECTO_MINUTOS = 120
+
+class SinCupoError(Exception):
+    """La reserva no cabe: fuera de horario o sin capacidad en alguno de sus turnos."""
+
+    def __init__(self, motivo: str, mensaje: str):
+        super().__init__(mensaje)
+        self.motivo = motivo
+
+def _turno(momento: time) -> int:
+    return (momento.hour * 60 + momento.minute) // MINUTOS_TURNO
+
+class MotorDisponibilidad:
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession] = AsyncSessionFactory,
+        recarga_minutos: float = settings.DISPONIBILIDAD_RECARGA_MINUTOS
+    ):
+        self._session_factory = session_factory
+        self._recarga_segundos = recarga_minutos * 60
+        # experiencia_id -> [(dia_semana | None, apertura, cierre, capacidad)]
+        self._horarios: Dict[int, List[Tuple[Optional[int], time, time, int]]] = {}
+        self._duraciones: Dict[int, int] = {}
+        # (experiencia_id, día) -> comensales por turno de 15 minutos
+        self._ocupacion: Dict[Tuple[int, date], List[int]] = {}
+        self._candados: Dict[Tuple[int, date], asyncio.Lock] = {}
+        # Mientras se reconstruye el índice no se admiten reservas ni se aplican transiciones
+        self._abierto = asyncio.Event()
+        self._abierto.set()
+        self._admisiones_en_curso = 0
+        self._sin_admisiones = asyncio.Event()
+        self._sin_admisiones.set()
+        self._tarea: Optional[asyncio.Task] = None
+        self._cerrando = asyncio.Event()
+        self.cargado_en: Optional[datetime] = None
+
+    # --- Carga del índice ---
+
+    async def cargar(self):
+        """Reconstruye horarios, duraciones y ocupación desde la BD (reservas de hoy en adelante)."""
+        self._abierto.clear()
+        try:
+            await self._sin_admisiones.wait()
+            async with self._session_factory() as db:
+                result = await db.execute(
+                    select(models.Experiencia.Id, models.Experiencia.DuracionMinutos)
+                )
+                duraciones = {exp_id: minutos for exp_id, minutos in result.all() if minutos}
+
+                result = await db.execute(
+                    select(
+                        models.HorarioExperiencia.ExperienciaId, models.HorarioExperiencia.DiaSemana,
+                        models.HorarioExperiencia.HoraApertura, models.HorarioExperiencia.HoraCierre,
+                        models.HorarioExperiencia.CapacidadComensales
+                    )
+                )
+                horarios: Dict[int, list] = {}
+                for exp_id, dia, apertura, cierre, capacidad in result.all():
+                    horarios.setdefault(exp_id, []).append((dia, apertura, cierre, capacidad))
+
+                hoy = datetime.combine(date.today(), time.min)
+                result = await db.execute(
+                    select(models.Reserva.ExperienciaId, models.Reserva.FechaHora, models.Reserva.NumComensales)
+                    .where(
+                        models.Reserva.FechaHora >= hoy,
+                        models.Reserva.Estado.in_(models.ESTADOS_QUE_OCUPAN)
+                    )
+                )
+                reservas = result.all()
+
+            self._duraciones = duraciones
+            self._horarios = horarios
+            self._ocupacion = {}
+            self._candados = {}
+            for exp_id, fecha_hora, comensales in reservas:
+                self._sumar(exp_id, fecha_hora, comensales or 0)
+            self.cargado_en = datetime.now()
+        finally:
+            self._abierto.set()
+
+    def iniciar(self):
+        """Lanza la recarga periódica del índice (llamar dentro del event loop, tras `cargar`)."""
+        if self._tarea is None and self._recarga_segundos > 0:
+            self._tarea = asyncio.create_task(self._bucle_recarga())
+
+    async def _bucle_recarga(self):
+        while not self._cerrando.is_set():
+            try:
+                await asyncio.wait_for(self._cerrando.wait(), timeout=self._recarga_segundos)
+            except asyncio.TimeoutError:
+                pass
+            if self._cerrando.is_set():
+                break
+            try:
+                await self.cargar()
+            except Exception:
+                # Se conserva el índice anterior; se reintenta en la próxima vuelta
+                traceback.print_exc()
+
+    async def detener(self):
+        self._cerrando.set()
+        if self._tarea is not None:
+            await self._tarea
+            self._tarea = None
+
+    # --- Turnos y ocupación ---
+
+    def duracion_minutos(self, experiencia_id: int) -> int:
+        return self._duraciones.get(experiencia_id, DURACION_POR_DEFECTO_MINUTOS)
+
+    def _turnos(self, experiencia_id: int, inicio: datetime) -> Tuple[int, int]:
+        """Rango [primero, último) de turnos del día que ocupa una reserva (se corta a medianoche)."""
+        fin = inicio + timedelta(minutes=self.duracion_minutos(experiencia_id))
+        primero = _turno(inicio.time())
+        ultimo = TURNOS_POR_DIA if fin.date() > inicio.date() else -(-(fin.hour * 60 + fin.minute) // MINUTOS_TURNO)
+        return primero, max(ultimo, primero + 1)
+
+    def _sumar(self, experiencia_id: int, inicio: datetime, comensales: int):
+        primero, ultimo = self._turnos(experiencia_id, inicio)
+        dia = self._ocupacion.setdefault((experiencia_id, inicio.date()), [0] * TURNOS_POR_DIA)
+        for i in range(primero, ultimo):
+            dia[i] += comensales
+
+    def _franja(self, experiencia_id: int, inicio: datetime) -> Optional[Tuple[time, time, int]]:
+        """Franja que contiene la reserva completa (inicio y fin), o None."""
+        fin = inicio + timedelta(minutes=self.duracion_minutos(experiencia_id))
+        for dia, apertura, cierre, capacidad in self._horarios.get(experiencia_id, ()):
+            if dia is not None and dia != inicio.weekday():
+                continue
+            if apertura <= inicio.time() and fin <= datetime.combine(inicio.date(), cierre):
+                return apertura, cierre, capacidad
+        return None
+
+    def cupo_libre(self, experiencia_id: int, inicio: datetime) -> Optional[int]:
+        """Comensales que aún caben en la reserva que empieza en `inicio`.
+           None = la experiencia no tiene franjas configuradas (sin límite)."""
+        if experiencia_id not in self._horarios:
+            return None
+        franja = self._franja(experiencia_id, inicio)
+        if franja is None:
+            return 0
+        primero, ultimo = self._turnos(experiencia_id, inicio)
+        dia = self._ocupacion.get((experiencia_id, inicio.date()))
+        ocupados = max(dia[primero:ultimo]) if dia else 0
+        return max(franja[2] - ocupados, 0)
+
+    def comprobar(self, experiencia_id: int, inicio: datetime, comensales: int):
+        """Lanza SinCupoError si la reserva no cabe."""
+        if experiencia_id not in self._horarios:
+            return
+        if self._franja(experiencia_id, inicio) is None:
+            raise SinCupoError(
+                "fuera_de_horario",
+                f"La experiencia no atiende a las {inicio:%H:%M} del {inicio:%d/%m/%Y} "
+                f"(duración {self.duracion_minutos(experiencia_id)} min)."
+            )
+        libre = self.cupo_libre(experiencia_id, inicio)
+        if comensales > libre:
+            raise SinCupoError(
+                "sin_cupo",
+                f"No hay cupo para {comensales} comensales el {inicio:%d/%m/%Y} a las {inicio:%H:%M} "
+                f"(quedan {libre})."
+            )
+
+    def proximos_turnos(
+        self, experiencia_id: int, comensales: int, desde: datetime, hasta: datetime, limite: int
+    ) -> Optional[List[Tuple[datetime, int]]]:
+        """
+        Primeros `limite` inicios de reserva entre `desde` y `hasta` donde caben
+        `comensales`, como [(inicio, cupo_libre)]. Solo recorre el índice en memoria.
+        None = la experiencia no tiene franjas configuradas (cualquier hora sirve).
+        """
+        horarios = self._horarios.get(experiencia_id)
+        if horarios is None:
+            return None
+        duracion = timedelta(minutes=self.duracion_minutos(experiencia_id))
+        paso = timedelta(minutes=MINUTOS_TURNO)
+        encontrados: List[Tuple[datetime, int]] = []
+        dia = desde.date()
+        while dia <= hasta.date() and len(encontrados) < limite:
+            inicios = set()
+            for dia_semana, apertura, cierre, _ in horarios:
+                if dia_semana is not None and dia_semana != dia.weekday():
+                    continue
+                inicio = datetime.combine(dia, apertura)
+                while inicio + duracion <= datetime.combine(dia, cierre):
+                    if desde <= inicio <= hasta:
+                        inicios.add(inicio)
+                    inicio += paso
+            for inicio in sorted(inicios):
+                libre = self.cupo_libre(experiencia_id, inicio)
+                if libre >= comensales:
+                    encontrados.append((inicio, libre))
+                    if len(encontrados) >= limite:
+                        break
+            dia += timedelta(days=1)
+        return encontrados
+
+    # --- Admisión ---
+
+    @asynccontextmanager
+    async def _en_curso(self):
+        """Espera a que no haya recarga y cuenta la operación: `cargar` espera a que terminen."""
+        while not self._abierto.is_set():
+            await self._abierto.wait()
+        self._admisiones_en_curso += 1
+        self._sin_admisiones.clear()
+        try:
+            yield
+        finally:
+            self._admisiones_en_curso -= 1
+            if not self._admisiones_en_curso:
+                self._sin_admisiones.set()
+
+    @asynccontextmanager
+    async def admitir(self, experiencia_id: int, inicio: datetime, comensales: int):
+        """
+        Reserva el cupo en memoria mientras se ejecuta el bloque (el INSERT y su commit).
+        Si el bloque falla, el cupo se devuelve. Lanza SinCupoError si no cabe.
+        """
+        async with self._en_curso():
+            clave = (experiencia_id, inicio.date())
+            candado = self._candados.setdefault(clave, asyncio.Lock())
+            async with candado:
+                self.comprobar(experiencia_id, inicio, comensales)
+                self._sumar(experiencia_id, inicio, comensales)
+                try:
+                    yield
+                except BaseException:
+                    self._sumar(experiencia_id, inicio, -comensales)
+                    raise
+
+    @asynccontextmanager
+    async def transicion(self):
+        """
+        Envuelve el commit de un cambio de estado y sus `liberar`. Una recarga no lee
+        Reservas mientras hay una transición en curso, ni la transición empieza durante
+        una recarga: si no, una cancelación confirmada justo antes de la lectura saldría
+        ya del índice nuevo y `liberar` la descontaría otra vez.
+        """
+        async with self._en_curso():
+            yield
+
+    def liberar(self, experiencia_id: int, inicio: datetime, comensales: int):
+        """Devuelve el cupo de una reserva que deja de ocupar (cancelación, no-show...).
+           Llamar dentro de `transicion`, tras el commit."""
+        if (experiencia_id, inicio.date()) in self._ocupacion:
+            self._sumar(experiencia_id, inicio, -comensales)
+
+    def metricas(self) -> dict:
+        return {
+            "experiencias_con_horario": len(self._horarios),
+            "dias_indexados": len(self._ocupacion),
+            "admisiones_en_curso": self._admisiones_en_curso,
+            "cargado_en": self.cargado_en.isoformat() if self.cargado_en else None
+        }
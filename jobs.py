@@ -0,0 +1,597 @@
+"""
+Trabajos por lotes del CRM. Se ejecutan fuera del servidor web:
+
+    python jobs.py backfill-etiquetas [--lote 500]
+    python jobs.py normalizar-alergenos [--lote 1000]
+    python jobs.py completar-reservas [--lote 1000]
+    python jobs.py reconciliar-ocupacion [--desde AAAA-MM-DD] [--hasta AAAA-MM-DD] [--corregir]
+    python jobs.py entrenar-recomendador [--dias 14] [--forzar]
+    python jobs.py replay-recomendador [--dias 14] [--limite N] [--base] [--desde AAAA-MM-DDTHH:MM]
+"""
+import argparse
+import asyncio
+import json
+import time
+import traceback
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, Optional
+
+import numpy as np
+from sqlalchemy import delete, insert, select, update
+
+import models
+from database import AsyncSessionFactory, engine, settings
+from recomendador import Recomendador, entrenar_pesos, evaluar_pesos, guardar_artefacto, rasgos_de_entrada
+from services import (
+    DBService, etiquetas_de_perfil, alergenos_de_reserva, transicionar_reservas, turno_ocupacion
+)
+
+async def backfill_etiquetas_perfil(tamano_lote: int = 500) -> dict:
+    """
+    Rellena PerfilEtiquetas a partir de Preferencias.DatosJson.
+    Recorre Preferencias por Id (keyset) y procesa cada lote en una transacción:
+    borra las etiquetas de esos usuarios e inserta las nuevas con un executemany.
+    """
+    ultimo_id = 0
+    procesados = etiquetas = invalidos = 0
+    inicio = time.perf_counter()
+
+    while True:
+        async with AsyncSessionFactory() as db:
+            result = await db.execute(
+                select(models.Preferencia.Id, models.Preferencia.UsuarioId, models.Preferencia.DatosJson)
+                .where(models.Preferencia.Id > ultimo_id)
+                .order_by(models.Preferencia.Id)
+                .limit(tamano_lote)
+            )
+            filas = result.all()
+            if not filas:
+                break
+            ultimo_id = filas[-1].Id
+
+            nuevas = []
+            for fila in filas:
+                try:
+                    perfil = json.loads(fila.DatosJson) if fila.DatosJson else {}
+                except ValueError:
+                    invalidos += 1
+                    continue
+                if isinstance(perfil, dict):
+                    nuevas.extend(etiquetas_de_perfil(fila.UsuarioId, perfil))
+                else:
+                    invalidos += 1
+
+            await db.execute(
+                delete(models.PerfilEtiqueta)
+                .where(models.PerfilEtiqueta.UsuarioId.in_([f.UsuarioId for f in filas]))
+                .execution_options(synchronize_session=False)
+            )
+            if nuevas:
+                await db.execute(insert(models.PerfilEtiqueta), nuevas)
+            await db.commit()
+
+            procesados += len(filas)
+            etiquetas += len(nuevas)
+            print(f"  {procesados} perfiles procesados (último Id {ultimo_id})")
+
+    return {
+        "perfiles": procesados,
+        "etiquetas": etiquetas,
+        "perfiles_invalidos": invalidos,
+        "segundos": round(time.perf_counter() - inicio, 2)
+    }
+
+async def normalizar_alergenos_reservas(tamano_lote: int = 1000) -> dict:
+    """
+    Recalcula ReservaAlergenos desde el texto libre de Reservas.Restricciones.
+    Mismo esquema que el backfill de perfiles: keyset por Id y una transacción por lote.
+    """
+    ultimo_id = 0
+    procesadas = codigos = 0
+    segundos_matcher = 0.0
+    inicio = time.perf_counter()
+
+    while True:
+        async with AsyncSessionFactory() as db:
+            result = await db.execute(
+                select(models.Reserva.Id, models.Reserva.Restricciones)
+                .where(models.Reserva.Id > ultimo_id)
+                .order_by(models.Reserva.Id)
+                .limit(tamano_lote)
+            )
+            filas = result.all()
+            if not filas:
+                break
+            ultimo_id = filas[-1].Id
+
+            t0 = time.perf_counter()
+            nuevas = [fila for r in filas for fila in alergenos_de_reserva(r.Id, r.Restricciones)]
+            segundos_matcher += time.perf_counter() - t0
+
+            await db.execute(
+                delete(models.ReservaAlergeno)
+                .where(models.ReservaAlergeno.ReservaId.in_([r.Id for r in filas]))
+                .execution_options(synchronize_session=False)
+            )
+            if nuevas:
+                await db.execute(insert(models.ReservaAlergeno), nuevas)
+            await db.commit()
+
+            procesadas += len(filas)
+            codigos += len(nuevas)
+            print(f"  {procesadas} reservas procesadas (último Id {ultimo_id})")
+
+    total = time.perf_counter() - inicio
+    return {
+        "reservas": procesadas,
+        "codigos": codigos,
+        "segundos": round(total, 2),
+        "reservas_por_segundo": round(procesadas / total, 1) if total else 0.0,
+        "textos_por_segundo_matcher": round(procesadas / segundos_matcher, 1) if segundos_matcher else 0.0
+    }
+
+async def completar_reservas_pasadas(
+    tamano_lote: int = 1000,
+    hasta: Optional[datetime] = None,
+    db_service: Optional[DBService] = None
+) -> dict:
+    """
+    Marca como 'completada' toda reserva pendiente o confirmada anterior a `hasta`
+    (por defecto, el inicio de hoy). Keyset por Id y un UPDATE en bloque por lote.
+    Con db_service (ejecución dentro del servidor) invalida además las cachés de los
+    usuarios afectados; desde la línea de comandos las cubre el TTL de la caché.
+    """
+    hasta = hasta or datetime.combine(date.today(), datetime.min.time())
+    origen = models.TRANSICIONES_RESERVA["completar"][0]
+    ultimo_id = 0
+    completadas = 0
+    inicio = time.perf_counter()
+
+    while True:
+        async with AsyncSessionFactory() as db:
+            result = await db.execute(
+                select(models.Reserva.Id)
+                .where(
+                    models.Reserva.Id > ultimo_id,
+                    models.Reserva.FechaHora < hasta,
+                    models.Reserva.Estado.in_(origen)
+                )
+                .order_by(models.Reserva.Id)
+                .limit(tamano_lote)
+            )
+            ids = result.scalars().all()
+            if not ids:
+                break
+            ultimo_id = ids[-1]
+
+            filas = await transicionar_reservas(db, "completar", ids)
+            await db.commit()
+
+        if db_service is not None:
+            db_service.despues_de_transicion("completar", filas)
+        completadas += len(filas)
+        print(f"  {completadas} reservas completadas (último Id {ultimo_id})")
+
+    return {
+        "reservas_completadas": completadas,
+        "hasta": hasta.isoformat(),
+        "segundos": round(time.perf_counter() - inicio, 2)
+    }
+
+async def reconciliar_ocupacion_diaria(
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    corregir: bool = False,
+    tamano_lote: int = 5000
+) -> dict:
+    """
+    Verifica OcupacionDiaria contra Reservas en [desde, hasta) (todo, si no se indica).
+    Recorre Reservas por Id (keyset), agrega en memoria por turno y compara con el
+    resumen. Con corregir=True reescribe los turnos distintos en una transacción
+    (también sirve para poblar el resumen la primera vez). Conviene corregir fuera
+    de horas de servicio: una reserva creada durante la corrección podría pisarse.
+    """
+    condiciones = [models.Reserva.Estado.in_(models.ESTADOS_QUE_OCUPAN)]
+    if desde is not None:
+        condiciones.append(models.Reserva.FechaHora >= datetime.combine(desde, datetime.min.time()))
+    if hasta is not None:
+        condiciones.append(models.Reserva.FechaHora < datetime.combine(hasta, datetime.min.time()))
+
+    inicio = time.perf_counter()
+    esperado = {}
+    ultimo_id = 0
+    async with AsyncSessionFactory() as db:
+        while True:
+            result = await db.execute(
+                select(models.Reserva.Id, models.Reserva.FechaHora, models.Reserva.ExperienciaId, models.Reserva.NumComensales)
+                .where(models.Reserva.Id > ultimo_id, *condiciones)
+                .order_by(models.Reserva.Id)
+                .limit(tamano_lote)
+            )
+            filas = result.all()
+            if not filas:
+                break
+            ultimo_id = filas[-1].Id
+            for fila in filas:
+                totales = esperado.setdefault((*turno_ocupacion(fila.FechaHora), fila.ExperienciaId), [0, 0])
+                totales[0] += fila.NumComensales or 0
+                totales[1] += 1
+
+        tabla = models.OcupacionDiaria
+        condiciones_resumen = []
+        if desde is not None:
+            condiciones_resumen.append(tabla.Fecha >= desde)
+        if hasta is not None:
+            condiciones_resumen.append(tabla.Fecha < hasta)
+        result = await db.execute(
+            select(tabla.Fecha, tabla.HoraTurno, tabla.ExperienciaId, tabla.Comensales, tabla.Reservas)
+            .where(*condiciones_resumen)
+        )
+        actual = {(f.Fecha, f.HoraTurno, f.ExperienciaId): [f.Comensales, f.Reservas] for f in result}
+
+        diferencias = [
+            (clave, actual.get(clave), esperado.get(clave, [0, 0]))
+            for clave in esperado.keys() | actual.keys()
+            if actual.get(clave, [0, 0]) != esperado.get(clave, [0, 0])
+        ]
+
+        if corregir and diferencias:
+            def fila_resumen(clave, totales):
+                fecha, hora, experiencia_id = clave
+                return {"Fecha": fecha, "HoraTurno": hora, "ExperienciaId": experiencia_id,
+                        "Comensales": totales[0], "Reservas": totales[1]}
+
+            faltantes = [fila_resumen(c, e) for c, a, e in diferencias if a is None]
+            distintas = [fila_resumen(c, e) for c, a, e in diferencias if a is not None and e != [0, 0]]
+            sobrantes = [c for c, a, e in diferencias if a is not None and e == [0, 0]]
+            if faltantes:
+                await db.execute(insert(tabla), faltantes)
+            if distintas:
+                # UPDATE en bloque por clave primaria
+                await db.execute(update(tabla), distintas)
+            for fecha, hora, experiencia_id in sobrantes:
+                await db.execute(
+                    delete(tabla)
+                    .where(tabla.Fecha == fecha, tabla.HoraTurno == hora, tabla.ExperienciaId == experiencia_id)
+                    .execution_options(synchronize_session=False)
+                )
+            await db.commit()
+
+    return {
+        "turnos": len(esperado.keys() | actual.keys()),
+        "diferencias": len(diferencias),
+        "corregidas": len(diferencias) if corregir else 0,
+        "ejemplos": [
+            {
+                "fecha": fecha.isoformat(), "hora": hora.strftime("%H:%M"), "experiencia_id": experiencia_id,
+                "resumen": a, "reservas": e
+            }
+            for (fecha, hora, experiencia_id), a, e in sorted(diferencias, key=lambda d: d[0])[:20]
+        ],
+        "segundos": round(time.perf_counter() - inicio, 2)
+    }
+
+async def _recomendaciones_con_conversion(
+    db, dias_conversion: int, tamano_lote: int, limite: Optional[int] = None, desde: Optional[datetime] = None
+) -> AsyncIterator[list]:
+    """
+    Recorre RecomendacionesLog por Id (keyset) y produce lotes de (log, perfil, conversión),
+    donde la conversión es la primera reserva no cancelada del usuario en los
+    `dias_conversion` días siguientes (None si no reservó). Reservas y perfiles de
+    cada lote se traen con una consulta por tabla. El perfil es el actual del usuario.
+    Con `desde`, solo las recomendaciones registradas a partir de ese momento.
+    """
+    ventana = timedelta(days=dias_conversion)
+    log = models.RecomendacionesLog
+    ultimo_id = 0
+    leidos = 0
+    while limite is None or leidos < limite:
+        result = await db.execute(
+            select(
+                log.Id, log.UsuarioId, log.MotivoVisita, log.Acompanantes, log.EstiloCocina,
+                log.NumComensales, log.ExperienciaRecomendadaId, log.CreadoEn
+            )
+            .where(log.Id > ultimo_id, log.UsuarioId.is_not(None), *((log.CreadoEn >= desde,) if desde else ()))
+            .order_by(log.Id)
+            .limit(tamano_lote if limite is None else min(tamano_lote, limite - leidos))
+        )
+        lote = result.all()
+        if not lote:
+            return
+        ultimo_id = lote[-1].Id
+        leidos += len(lote)
+        usuarios = list({f.UsuarioId for f in lote})
+
+        result = await db.execute(
+            select(models.Reserva.UsuarioId, models.Reserva.ExperienciaId, models.Reserva.CreadoEn)
+            .where(
+                models.Reserva.UsuarioId.in_(usuarios),
+                models.Reserva.CreadoEn >= min(f.CreadoEn for f in lote),
+                models.Reserva.CreadoEn <= max(f.CreadoEn for f in lote) + ventana,
+                models.Reserva.Estado != "cancelada"
+            )
+            .order_by(models.Reserva.CreadoEn, models.Reserva.Id)
+        )
+        reservas = {}
+        for r in result:
+            reservas.setdefault(r.UsuarioId, []).append(r)
+
+        result = await db.execute(
+            select(models.Preferencia.UsuarioId, models.Preferencia.DatosJson)
+            .where(models.Preferencia.UsuarioId.in_(usuarios))
+        )
+        perfiles = {}
+        for usuario_id, datos in result:
+            try:
+                perfiles[usuario_id] = json.loads(datos) if datos else None
+            except ValueError:
+                perfiles[usuario_id] = None
+
+        yield [
+            (
+                f,
+                perfiles.get(f.UsuarioId),
+                next(
+                    (r for r in reservas.get(f.UsuarioId, ()) if f.CreadoEn <= r.CreadoEn <= f.CreadoEn + ventana),
+                    None
+                )
+            )
+            for f in lote
+        ]
+
+def rasgos_de_log(f, perfil: Optional[dict]) -> list:
+    """
+    Rasgos de una fila de RecomendacionesLog, con lo que se sabía al recomendar.
+    El tamaño del grupo sale del log (si el usuario lo dio), nunca de la reserva
+    posterior: esa reserva es la etiqueta y usarla como rasgo la filtraría.
+    """
+    return rasgos_de_entrada(f.MotivoVisita, f.Acompanantes, f.EstiloCocina, f.NumComensales, perfil)
+
+async def entrenar_recomendador(
+    dias_conversion: int = 14,
+    tamano_lote: int = 1000,
+    regularizacion: float = 0.05,
+    iteraciones: int = 300,
+    minimo_muestras: int = 50,
+    forzar: bool = False,
+    directorio: str = settings.RECOMENDADOR_MODELOS_DIR
+) -> dict:
+    """
+    Ajusta los pesos del recomendador con las conversiones reales: cada registro de
+    RecomendacionesLog se etiqueta con la primera reserva (no cancelada) que hizo el
+    usuario en los `dias_conversion` días siguientes.
+    El último 20% (lo más reciente) se reserva para validar; el artefacto solo se
+    publica si mejora a PESOS_BASE en validación (o con forzar=True).
+    """
+    inicio = time.perf_counter()
+
+    async with AsyncSessionFactory() as db:
+        result = await db.execute(select(models.Experiencia))
+        base = Recomendador()
+        base.construir(result.scalars().all())
+        experiencia_ids, pesos_base = base.matriz()
+        posicion = {int(e): i for i, e in enumerate(experiencia_ids)}
+
+        filas_x, filas_y = [], []
+        logs = 0
+        async for lote in _recomendaciones_con_conversion(db, dias_conversion, tamano_lote):
+            logs += len(lote)
+            for f, perfil, conversion in lote:
+                if conversion is None or conversion.ExperienciaId not in posicion:
+                    continue
+                filas_x.append(base.vectorizar(rasgos_de_log(f, perfil)))
+                filas_y.append(posicion[conversion.ExperienciaId])
+            print(f"  {logs} recomendaciones leídas, {len(filas_y)} con conversión (último Id {lote[-1][0].Id})")
+
+    resultado = {"recomendaciones": logs, "muestras": len(filas_y), "publicado": False, "version": None}
+    if len(filas_y) < minimo_muestras:
+        resultado["motivo"] = f"Se necesitan al menos {minimo_muestras} conversiones para entrenar."
+        resultado["segundos"] = round(time.perf_counter() - inicio, 2)
+        return resultado
+
+    x = np.stack(filas_x)
+    y = np.array(filas_y, dtype=np.int64)
+    corte = int(len(y) * 0.8)
+    pesos = entrenar_pesos(x[:corte], y[:corte], pesos_base, regularizacion, iteraciones)
+    metricas = {
+        "base": evaluar_pesos(pesos_base, x[corte:], y[corte:]),
+        "entrenado": evaluar_pesos(pesos, x[corte:], y[corte:])
+    }
+    resultado["validacion"] = metricas
+
+    mejora = (metricas["entrenado"]["log_loss"] or 0) <= (metricas["base"]["log_loss"] or 0)
+    if mejora or forzar:
+        resultado["version"] = guardar_artefacto(directorio, pesos, experiencia_ids.tolist(), {
+            "entrenado_en": datetime.now().isoformat(timespec="seconds"),
+            "muestras": len(y),
+            "muestras_validacion": len(y) - corte,
+            "dias_conversion": dias_conversion,
+            "regularizacion": regularizacion,
+            "validacion": metricas
+        })
+        resultado["publicado"] = True
+    else:
+        resultado["motivo"] = "Los pesos entrenados no mejoran a PESOS_BASE en validación (usa --forzar para publicarlos)."
+    resultado["segundos"] = round(time.perf_counter() - inicio, 2)
+    return resultado
+
+async def replay_recomendador(
+    dias_conversion: int = 14,
+    tamano_lote: int = 1000,
+    limite: Optional[int] = None,
+    solo_base: bool = False,
+    directorio: str = settings.RECOMENDADOR_MODELOS_DIR,
+    desde: Optional[datetime] = None
+) -> dict:
+    """
+    Reproduce las entradas de RecomendacionesLog contra el motor actual (pesos
+    publicados en `directorio`, o solo PESOS_BASE) sin tocar la BD, para evaluar
+    un cambio antes de desplegarlo. Contra una copia de la BD basta con apuntar
+    DATABASE_URL al snapshot.
+    Con pesos entrenados, por defecto solo se reproducen las recomendaciones
+    posteriores a su `entrenado_en`: las anteriores sirvieron para ajustarlos (o
+    para elegirlos en validación) y el acierto saldría inflado. Para comparar con
+    PESOS_BASE, pasar el mismo `desde` con solo_base=True.
+    Mide latencia por recomendación (rasgos + ranking), rendimiento en bloque (una
+    matriz de entradas por lote) y acierto contra la reserva que hizo el usuario,
+    comparado con lo que se recomendó en producción. Solo se usan los datos que
+    guarda el log: el tamaño del grupo si se registró, sin historial.
+    """
+    inicio = time.perf_counter()
+    async with AsyncSessionFactory() as db:
+        result = await db.execute(select(models.Experiencia))
+        motor = Recomendador(directorio_modelos=None if solo_base else directorio)
+        motor.construir(result.scalars().all())
+        if desde is None and motor.version_modelo is not None:
+            desde = datetime.fromisoformat(motor.metricas()["entrenado_en"])
+
+        latencias = []
+        entradas = []
+        total = coincide_produccion = con_conversion = 0
+        aciertos = {"motor_top1": 0, "motor_top3": 0, "produccion": 0}
+        async for lote in _recomendaciones_con_conversion(db, dias_conversion, tamano_lote, limite, desde):
+            for f, perfil, conversion in lote:
+                t0 = time.perf_counter_ns()
+                rasgos = rasgos_de_log(f, perfil)
+                texto = " ".join(t for t in (f.MotivoVisita, f.Acompanantes, f.EstiloCocina) if t)
+                ranking = motor.recomendar(rasgos, texto=texto)
+                latencias.append(time.perf_counter_ns() - t0)
+                entradas.append((rasgos, texto))
+
+                total += 1
+                propuestas = [r["experiencia_id"] for r in ranking]
+                if propuestas and propuestas[0] == f.ExperienciaRecomendadaId:
+                    coincide_produccion += 1
+                if conversion is not None:
+                    con_conversion += 1
+                    aciertos["motor_top1"] += bool(propuestas) and propuestas[0] == conversion.ExperienciaId
+                    aciertos["motor_top3"] += conversion.ExperienciaId in propuestas[:3]
+                    aciertos["produccion"] += f.ExperienciaRecomendadaId == conversion.ExperienciaId
+
+    resultado = {
+        "recomendaciones": total,
+        "con_conversion": con_conversion,
+        "version_modelo": motor.version_modelo,
+        "desde": desde.isoformat(timespec="seconds") if desde else None,
+        "segundos": round(time.perf_counter() - inicio, 2)
+    }
+    if not total:
+        return resultado
+
+    segundos_motor = sum(latencias) / 1e9
+    latencias_us = np.array(latencias) / 1e3
+    # En bloque: todas las entradas como una matriz, como haría un re-ranking masivo
+    t0 = time.perf_counter()
+    x = np.stack([motor.vectorizar(r) for r, _ in entradas])
+    textos = [motor.similitudes_texto(t) for _, t in entradas]
+    np.argmax(motor.puntuar(x, similitud_texto=np.stack(textos)), axis=1)
+    segundos_bloque = time.perf_counter() - t0
+
+    resultado.update({
+        "items_por_segundo": round(total / segundos_motor, 1) if segundos_motor else 0.0,
+        "items_por_segundo_en_bloque": round(total / segundos_bloque, 1) if segundos_bloque else 0.0,
+        "latencia_us": {
+            "p50": round(float(np.percentile(latencias_us, 50)), 1),
+            "p95": round(float(np.percentile(latencias_us, 95)), 1),
+            "p99": round(float(np.percentile(latencias_us, 99)), 1),
+            "max": round(float(latencias_us.max()), 1)
+        },
+        "coincide_con_produccion": round(coincide_produccion / total, 4),
+        "acierto": {
+            clave: round(n / con_conversion, 4) if con_conversion else None
+            for clave, n in aciertos.items()
+        }
+    })
+    return resultado
+
+async def programar_completar_reservas(db_service: DBService, hora: int, cerrando: asyncio.Event):
+    """Bucle para el servidor: ejecuta completar_reservas_pasadas cada día a la `hora` indicada
+       hasta que se active `cerrando`."""
+    while not cerrando.is_set():
+        ahora = datetime.now()
+        proxima = ahora.replace(hour=hora, minute=0, second=0, microsecond=0)
+        if proxima <= ahora:
+            proxima += timedelta(days=1)
+        try:
+            await asyncio.wait_for(cerrando.wait(), timeout=(proxima - ahora).total_seconds())
+        except asyncio.TimeoutError:
+            pass
+        if cerrando.is_set():
+            break
+        try:
+            print(await completar_reservas_pasadas(db_service=db_service))
+        except Exception:
+            # Se reintenta al día siguiente; las reservas pendientes siguen ahí
+            traceback.print_exc()
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Trabajos por lotes del CRM Sensorial")
+    sub = parser.add_subparsers(dest="trabajo", required=True)
+
+    p_backfill = sub.add_parser("backfill-etiquetas", help="Rellena PerfilEtiquetas desde Preferencias.DatosJson")
+    p_backfill.add_argument("--lote", type=int, default=500)
+
+    p_alergenos = sub.add_parser(
+        "normalizar-alergenos",
+        help="Recalcula los códigos de alérgenos de perfiles (PerfilEtiquetas) y reservas (ReservaAlergenos)"
+    )
+    p_alergenos.add_argument("--lote", type=int, default=1000)
+
+    p_completar = sub.add_parser(
+        "completar-reservas",
+        help="Marca como completadas las reservas pendientes/confirmadas de días anteriores"
+    )
+    p_completar.add_argument("--lote", type=int, default=1000)
+
+    p_reconciliar = sub.add_parser(
+        "reconciliar-ocupacion",
+        help="Verifica (y con --corregir, rehace) OcupacionDiaria contra Reservas"
+    )
+    p_reconciliar.add_argument("--desde", type=date.fromisoformat, default=None)
+    p_reconciliar.add_argument("--hasta", type=date.fromisoformat, default=None)
+    p_reconciliar.add_argument("--corregir", action="store_true")
+
+    p_entrenar = sub.add_parser(
+        "entrenar-recomendador",
+        help="Ajusta los pesos del recomendador con RecomendacionesLog y las reservas posteriores"
+    )
+    p_entrenar.add_argument("--dias", type=int, default=14, help="Días tras la recomendación que cuentan como conversión")
+    p_entrenar.add_argument("--lote", type=int, default=1000)
+    p_entrenar.add_argument("--forzar", action="store_true", help="Publicar aunque no mejore en validación")
+
+    p_replay = sub.add_parser(
+        "replay-recomendador",
+        help="Reproduce RecomendacionesLog contra el motor y mide rendimiento y acierto"
+    )
+    p_replay.add_argument("--dias", type=int, default=14, help="Días tras la recomendación que cuentan como conversión")
+    p_replay.add_argument("--lote", type=int, default=1000)
+    p_replay.add_argument("--limite", type=int, default=None, help="Máximo de recomendaciones a reproducir")
+    p_replay.add_argument("--base", action="store_true", help="Usar solo PESOS_BASE, sin los pesos entrenados")
+    p_replay.add_argument(
+        "--desde", type=datetime.fromisoformat, default=None,
+        help="Solo recomendaciones desde esta fecha (por defecto, desde que se entrenó el modelo publicado)"
+    )
+
+    args = parser.parse_args()
+    try:
+        if args.trabajo == "backfill-etiquetas":
+            print(await backfill_etiquetas_perfil(args.lote))
+        elif args.trabajo == "normalizar-alergenos":
+            print(await backfill_etiquetas_perfil(args.lote))
+            print(await normalizar_alergenos_reservas(args.lote))
+        elif args.trabajo == "completar-reservas":
+            print(await completar_reservas_pasadas(args.lote))
+        elif args.trabajo == "reconciliar-ocupacion":
+            print(await reconciliar_ocupacion_diaria(args.desde, args.hasta, args.corregir))
+        elif args.trabajo == "entrenar-recomendador":
+            print(await entrenar_recomendador(args.dias, args.lote, forzar=args.forzar))
+        elif args.trabajo == "replay-recomendador":
+            print(json.dumps(
+                await replay_recomendador(args.dias, args.lote, args.limite, solo_base=args.base, desde=args.desde),
+                indent=2, ensure_ascii=False
+            ))
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,188 @@
+"""
+Promoción asíncrona de la lista de espera.
+
+Cuando se libera cupo en un turno (cancelación, no-show), DBService avisa al
+promotor con (experiencia, día). Un único worker en segundo plano recorre las
+solicitudes 'esperando' de ese día (por horario y, en cada horario, por Prioridad
+y orden de llegada) y convierte en Reserva las que caben. Cada promoción se
+admite con el mismo candado por turno que las reservas del chat, y se confirma
+con un UPDATE condicional (Estado = 'esperando'): si otra petición ya atendió o
+canceló la solicitud, no se crea la reserva y el cupo se devuelve.
+"""
+import asyncio
+import traceback
+from datetime import date, datetime, timedelta
+from typing import Callable, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from database import AsyncSessionFactory, enrutador_lecturas, settings
+from disponibilidad import SinCupoError
+from services import DBService, insertar_reserva
+
+# Candidatos de un día, en el orden en que se atienden: el mismo de IX_ListaEspera_Turno,
+# así el índice entrega las filas ya ordenadas (sin SORT) y el LIMIT corta temprano.
+_SELECT_CANDIDATOS = (
+    select(models.ListaEspera)
+    .where(
+        models.ListaEspera.ExperienciaId == bindparam("experiencia_id"),
+        models.ListaEspera.Estado == 'esperando',
+        models.ListaEspera.FechaHora >= bindparam("desde"),
+        models.ListaEspera.FechaHora < bindparam("hasta")
+    )
+    .order_by(models.ListaEspera.FechaHora, models.ListaEspera.Prioridad.desc(), models.ListaEspera.Id)
+    .limit(200)
+)
+
+_SELECT_TURNOS_EN_ESPERA = (
+    select(models.ListaEspera.ExperienciaId, models.ListaEspera.FechaHora)
+    .where(models.ListaEspera.Estado == 'esperando', models.ListaEspera.FechaHora > bindparam("ahora"))
+    .distinct()
+)
+
+# Solo promueve si la solicitud sigue esperando: protege de dobles promociones
+_PROMOVER = (
+    update(models.ListaEspera)
+    .where(models.ListaEspera.Id == bindparam("espera_id"), models.ListaEspera.Estado == 'esperando')
+    .values(Estado='promovida', ReservaId=bindparam("reserva_id"), ActualizadoEn=func.now())
+    .execution_options(synchronize_session=False)
+)
+
+_EXPIRAR = (
+    update(models.ListaEspera)
+    .where(models.ListaEspera.Estado == 'esperando', models.ListaEspera.FechaHora <= bindparam("ahora"))
+    .values(Estado='expirada', ActualizadoEn=func.now())
+    .execution_options(synchronize_session=False)
+)
+
+class _SolicitudYaAtendida(Exception):
+    """La solicitud dejó de estar 'esperando' entre la lectura y la promoción."""
+
+class PromotorListaEspera:
+
+    def __init__(
+        self,
+        db_service: DBService,
+        session_factory: Callable[[], AsyncSession] = AsyncSessionFactory,
+        barrido_segundos: float = settings.LISTA_ESPERA_BARRIDO_SEGUNDOS
+    ):
+        self._db_service = db_service
+        self._session_factory = session_factory
+        self._barrido_segundos = barrido_segundos
+        self._pendientes: Set[Tuple[int, date]] = set()
+        self._evento = asyncio.Event()
+        self._cerrando = False
+        self._tarea: Optional[asyncio.Task] = None
+        self.promovidas = 0
+        self.conflictos = 0
+        self.errores = 0
+        db_service.suscribir_cupo_liberado(self.notificar)
+
+    def notificar(self, experiencia_id: int, dia: date):
+        """Se llama (sin await) cuando se libera cupo en un turno; el trabajo se hace en el worker."""
+        self._pendientes.add((experiencia_id, dia))
+        self._evento.set()
+
+    def iniciar(self):
+        """Lanza el worker (llamar dentro del event loop, p. ej. en el lifespan)."""
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._bucle())
+
+    async def _bucle(self):
+        await self._barrer()
+        while not self._cerrando:
+            try:
+                await asyncio.wait_for(self._evento.wait(), timeout=self._barrido_segundos)
+            except asyncio.TimeoutError:
+                # Barrido periódico: cubre cupo liberado por otras vías (recarga del índice, horarios)
+                await self._barrer()
+            self._evento.clear()
+            while self._pendientes and not self._cerrando:
+                experiencia_id, dia = self._pendientes.pop()
+                try:
+                    await self.promover(experiencia_id, dia)
+                except Exception:
+                    self.errores += 1
+                    traceback.print_exc()
+
+    async def _barrer(self):
+        """Expira las solicitudes vencidas y encola todos los turnos con solicitudes vivas."""
+        try:
+            ahora = datetime.now()
+            async with self._session_factory() as db:
+                await db.execute(_EXPIRAR, {"ahora": ahora})
+                await db.commit()
+                result = await db.execute(_SELECT_TURNOS_EN_ESPERA, {"ahora": ahora})
+                for experiencia_id, fecha_hora in result.all():
+                    self._pendientes.add((experiencia_id, fecha_hora.date()))
+        except Exception:
+            self.errores += 1
+            traceback.print_exc()
+
+    async def promover(self, experiencia_id: int, dia: date) -> int:
+        """Promueve las solicitudes del turno que quepan. Devuelve cuántas se promovieron."""
+        disponibilidad = self._db_service.disponibilidad
+        inicio_dia = datetime.combine(dia, datetime.min.time())
+        async with self._session_factory() as db:
+            result = await db.execute(_SELECT_CANDIDATOS, {
+                "experiencia_id": experiencia_id,
+                "desde": max(inicio_dia, datetime.now()),
+                "hasta": inicio_dia + timedelta(days=1)
+            })
+            candidatos = result.scalars().all()
+
+        promovidas = 0
+        for espera in candidatos:
+            # Filtro previo sin candado; la comprobación que vale es la de admitir()
+            libre = disponibilidad.cupo_libre(experiencia_id, espera.FechaHora)
+            if libre is not None and libre < espera.NumComensales:
+                continue
+            valores_reserva = {
+                "UsuarioId": espera.UsuarioId,
+                "NombreReserva": espera.NombreReserva,
+                "NumComensales": espera.NumComensales,
+                "ExperienciaId": experiencia_id,
+                "FechaHora": espera.FechaHora,
+                "Restricciones": espera.Restricciones,
+                "Estado": 'pendiente'
+            }
+            try:
+                async with self._session_factory() as db:
+                    async with disponibilidad.admitir(experiencia_id, espera.FechaHora, espera.NumComensales):
+                        reserva_id = await insertar_reserva(db, valores_reserva)
+                        result = await db.execute(_PROMOVER, {"espera_id": espera.Id, "reserva_id": reserva_id})
+                        if result.rowcount != 1:
+                            raise _SolicitudYaAtendida()
+                        await db.commit()
+            except SinCupoError:
+                continue
+            except _SolicitudYaAtendida:
+                # Sin commit: la sesión descarta la reserva al cerrarse y admitir() devolvió el cupo
+                self.conflictos += 1
+                continue
+
+            promovidas += 1
+            enrutador_lecturas.registrar_escritura(espera.UsuarioId)
+            self._db_service.invalidar_contexto_usuario(espera.UsuarioId)
+            self._db_service.invalidar_reporte_cocina(espera.FechaHora, experiencia_id)
+
+        self.promovidas += promovidas
+        return promovidas
+
+    async def detener(self):
+        """Termina el worker tras la promoción en curso (sin cancelarlo a mitad de una transacción)."""
+        self._cerrando = True
+        self._evento.set()
+        if self._tarea is not None:
+            await self._tarea
+            self._tarea = None
+
+    def metricas(self) -> dict:
+        return {
+            "turnos_pendientes": len(self._pendientes),
+            "promovidas": self.promovidas,
+            "conflictos": self.conflictos,
+            "errores": self.errores
+        }
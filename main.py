@@ -1,18 +1,55 @@
+import asyncio
+import csv
+import io
 import json
 import traceback
-from fastapi import FastAPI, Depends, HTTPException, Request
-from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
-from database import get_db_session
+from database import get_db_session, get_read_db_session, enrutador_lecturas, crear_tablas, settings, AsyncReadSessionFactory
 import schemas
+import jobs
+import lista_espera
 import services
+import sincronizacion_crm
+import timing
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Arranque: esquema (solo si se pide) y tareas de fondo
+    if settings.CREAR_TABLAS:
+        await crear_tablas()
+    await db_service.disponibilidad.cargar()
+    db_service.disponibilidad.iniciar()
+    await db_service.clientes_similares.cargar()
+    db_service.clientes_similares.iniciar()
+    recomendaciones_log_writer.iniciar()
+    promotor_lista_espera.iniciar()
+    cerrando = asyncio.Event()
+    tarea_completar = None
+    if settings.COMPLETAR_RESERVAS_HORA is not None:
+        tarea_completar = asyncio.create_task(
+            jobs.programar_completar_reservas(db_service, settings.COMPLETAR_RESERVAS_HORA, cerrando)
+        )
+    yield
+    # Apagado: escribir lo pendiente antes de salir
+    cerrando.set()
+    if tarea_completar is not None:
+        await tarea_completar
+    await promotor_lista_espera.detener()
+    await recomendaciones_log_writer.detener()
+    await db_service.disponibilidad.detener()
+    await db_service.clientes_similares.detener()
 
 app = FastAPI(
     title="CRM Sensorial - Central Restaurante",
-    description="Backend para el chatbot de reservas con Gemini"
+    description="Backend para el chatbot de reservas con Gemini",
+    lifespan=lifespan
 )
 
 # --- Manejador de Excepciones Global ---
@@ -46,11 +83,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# --- Tiempos por etapa (Server-Timing) ---
+if settings.SERVER_TIMING_HABILITADO:
+    app.add_middleware(timing.MiddlewareServerTiming)
+
 # --- Servicios ---
 gemini_service = services.GeminiService()
-db_service = services.DBService()
+recomendaciones_log_writer = services.RecomendacionesLogWriter()
+db_service = services.DBService(log_writer=recomendaciones_log_writer)
+crm_sync_service = sincronizacion_crm.SincronizacionCRMService(db_service)
+promotor_lista_espera = lista_espera.PromotorListaEspera(db_service)
 
 # --- Almacenamiento simple de sesiones de chat en memoria ---
 # (En producción, considera usar Redis para esto)
@@ -65,7 +110,8 @@ async def get_system_prompt(db: AsyncSession, user_id: int) -> str:
     """
     
     # 1. Cargar las experiencias
-    experiencias_contexto = await db_service.get_all_experiences(db)
+    with timing.medir("catalogo"):
+        experiencias_contexto = await db_service.get_all_experiences(db)
     
     base_prompt = (
         "Eres 'Amigo Central', el asistente de IA del restaurante Central. "
@@ -76,7 +122,8 @@ async def get_system_prompt(db: AsyncSession, user_id: int) -> str:
     )
 
     # 2. Obtener contexto del usuario
-    user_contexto = await db_service.get_user_context(db, user_id)
+    with timing.medir("contexto"):
+        user_contexto = await db_service.get_user_context(db, user_id)
 
     # 3. VERIFICAR SI EL PERFIL EXISTE
     perfil_existente = None
@@ -97,8 +144,8 @@ async def get_system_prompt(db: AsyncSession, user_id: int) -> str:
             "1. Saluda al cliente por su nombre.\n"
             "2. **PROACTIVAMENTE**, confirma su perfil. Di algo como: 'Veo que en tu perfil guardado tienes [menciona una alergia/restricción clave]. ¿Usamos este perfil para tu visita o hay algún cambio?'\n"
             "3. Si el cliente menciona CUALQUIER cambio (ej: 'hoy no como carne', 'además soy alérgico a X'), **debes actualizar su perfil**.\n"
-            "4. Para actualizar, primero recolecta TODA la información (alergias, gustos, etc.) y luego llama a `guardar_perfil_alimentario` con el perfil COMPLETO y ACTUALIZADO. Haz esto **automáticamente** sin que el usuario te lo pida.\n"
-            "5. Guíalo para elegir una experiencia, fecha, hora y número de comensales.\n"
+            "4. Para actualizar, llama a `actualizar_perfil_alimentario` enviando SOLO los cambios (qué agregar y qué quitar de cada lista), no el perfil completo. Haz esto **automáticamente** sin que el usuario te lo pida.\n"
+            "5. Guíalo para elegir una experiencia, fecha, hora y número de comensales. Antes de proponer fecha y hora, llama a `consultar_disponibilidad` y ofrece solo horarios devueltos por ella.\n"
             "6. Al final, llama a `crear_reserva`."
         )
     else:
@@ -116,7 +163,7 @@ async def get_system_prompt(db: AsyncSession, user_id: int) -> str:
             "2. **PROACTIVAMENTE**, explícale que te gustaría crear su 'perfil sensorial' para darle el mejor servicio. Di algo como: 'Para que tu experiencia sea perfecta, me gustaría hacerte unas preguntas sobre tus preferencias alimentarias.'\n"
             "3. **Debes** preguntar por: (Alergias, Restricciones (vegano, etc.), Disgustos, Gustos).\n"
             "4. Una vez que tengas esta información, **llama automáticamente** a la función `guardar_perfil_alimentario`. No esperes a que el usuario te lo pida.\n"
-            "5. Después de guardar, guíalo para elegir una experiencia, fecha, hora y número de comensales.\n"
+            "5. Después de guardar, guíalo para elegir una experiencia, fecha, hora y número de comensales. Antes de proponer fecha y hora, llama a `consultar_disponibilidad` y ofrece solo horarios devueltos por ella.\n"
             "6. Al final, llama a `crear_reserva`."
         )
         
@@ -138,15 +185,19 @@ async def chat_endpoint(
 
     # 1. Obtener o crear la sesión de chat
     if session_id not in chat_sessions:
-        # Pasamos el user_id para generar el prompt correcto
-        system_prompt = await get_system_prompt(db, session_user_id)
-        chat_sessions[session_id] = gemini_service.start_chat_session(system_prompt)
+        # Pasamos el user_id para generar el prompt correcto.
+        # Son solo lecturas: van a la réplica salvo que el usuario haya escrito hace poco.
+        with timing.medir("prompt"):
+            async with enrutador_lecturas.session_factory(session_user_id)() as read_db:
+                system_prompt = await get_system_prompt(read_db, session_user_id)
+            chat_sessions[session_id] = gemini_service.start_chat_session(system_prompt)
         
     chat_session = chat_sessions[session_id]
     
     # 2. Enviar el mensaje del usuario a Gemini
     try:
-        response = await chat_session.send_message_async(user_message)
+        with timing.medir("gemini"):
+            response = await chat_session.send_message_async(user_message)
         
         # 3. Manejar la respuesta (puede ser texto o una llamada a función)
         while response.parts[0].function_call:
@@ -157,33 +208,51 @@ async def chat_endpoint(
             function_response_content = None
             
             # 4. Ejecutar la función correspondiente
-            if function_name == "guardar_perfil_alimentario":
-                # --- CAMBIO AQUÍ ---
-                # Pasamos el session_user_id (de la solicitud) y los args (de la IA)
-                tool_result = await db_service.handle_guardar_perfil(db, session_user_id, args)
-                # ... (lógica de actualizar prompt si es necesario)
-                function_response_content = tool_result
-
-            elif function_name == "crear_reserva":
-                # --- CAMBIO AQUÍ ---
-                # Pasamos el session_user_id (de la solicitud) y los args (de la IA)
-                tool_result = await db_service.handle_crear_reserva(db, session_user_id, args)
-                function_response_content = tool_result
-
-            elif function_name == "recomendar_experiencia":
-                tool_result = await db_service.handle_recomendar_experiencia(db, session_user_id, args)
-                function_response_content = tool_result
+            with timing.medir("herramienta", function_name):
+                if function_name == "guardar_perfil_alimentario":
+                    # --- CAMBIO AQUÍ ---
+                    # Pasamos el session_user_id (de la solicitud) y los args (de la IA)
+                    tool_result = await db_service.handle_guardar_perfil(db, session_user_id, args)
+                    # ... (lógica de actualizar prompt si es necesario)
+                    function_response_content = tool_result
+
+                elif function_name == "actualizar_perfil_alimentario":
+                    tool_result = await db_service.handle_actualizar_perfil(db, session_user_id, args)
+                    function_response_content = tool_result
+
+                elif function_name == "consultar_disponibilidad":
+                    tool_result = await db_service.handle_consultar_disponibilidad(db, session_user_id, args)
+                    function_response_content = tool_result
+
+                elif function_name == "crear_reserva":
+                    # --- CAMBIO AQUÍ ---
+                    # Pasamos el session_user_id (de la solicitud) y los args (de la IA)
+                    tool_result = await db_service.handle_crear_reserva(db, session_user_id, args, session_id=session_id)
+                    function_response_content = tool_result
+
+                elif function_name == "unirse_lista_espera":
+                    tool_result = await db_service.handle_unirse_lista_espera(db, session_user_id, args)
+                    function_response_content = tool_result
+
+                elif function_name == "cancelar_lista_espera":
+                    tool_result = await db_service.handle_cancelar_lista_espera(db, session_user_id, args)
+                    function_response_content = tool_result
+
+                elif function_name == "recomendar_experiencia":
+                    tool_result = await db_service.handle_recomendar_experiencia(db, session_user_id, args)
+                    function_response_content = tool_result
             
             if function_response_content is None:
                 raise HTTPException(status_code=400, detail=f"Función desconocida: {function_name}")
 
             # 5. Enviar el resultado de la función de vuelta a Gemini
-            response = await chat_session.send_message_async(
-                [{"function_response": {
-                    "name": function_name,
-                    "response": function_response_content
-                }}]
-            )
+            with timing.medir("gemini"):
+                response = await chat_session.send_message_async(
+                    [{"function_response": {
+                        "name": function_name,
+                        "response": function_response_content
+                    }}]
+                )
         
         # 6. La respuesta final
         try:
@@ -201,6 +270,161 @@ async def chat_endpoint(
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error en chat_endpoint: {str(e)}")
 
+@app.get("/cocina/alergenos")
+async def reporte_alergenos_cocina(
+    fecha: date,
+    experiencia_id: int,
+    formato: str = "json",
+    db: AsyncSession = Depends(get_db_session)
+):
+    """
+    Reporte de alérgenos y restricciones de un turno (fecha + experiencia) para cocina.
+    Se lee del primario: justo después de una reserva, la réplica podría no tenerla.
+    """
+    if formato not in ("json", "csv"):
+        raise HTTPException(status_code=400, detail="Formato no soportado. Usa 'json' o 'csv'.")
+
+    reporte = await db_service.reporte_alergenos_cocina(db, fecha, experiencia_id)
+    if formato == "json":
+        return reporte
+
+    # Un turno tiene a lo sumo unas decenas de reservas y el reporte ya está en memoria
+    # (viene de la caché): el CSV se arma de una vez, no hace falta streaming.
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["reserva_id", "hora", "nombre", "comensales", "codigos", "sin_reconocer", "notas"])
+    writer.writerows(
+        [
+            d["reserva_id"], d["hora"], d["nombre"], d["comensales"],
+            ";".join(d["codigos"]), ";".join(d["sin_reconocer"]), d["notas"] or ""
+        ]
+        for d in reporte["detalle"]
+    )
+
+    nombre_archivo = f"alergenos_{fecha.isoformat()}_exp{experiencia_id}.csv"
+    return Response(
+        content=buffer.getvalue(),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{nombre_archivo}"'}
+    )
+
+@app.get("/reservas", response_model=schemas.PaginaReservasSchema)
+async def buscar_reservas(
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+    estado: Optional[List[str]] = Query(default=None),
+    experiencia_id: Optional[int] = None,
+    usuario_id: Optional[int] = None,
+    nombre: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limite: int = Query(default=50, ge=1, le=200),
+    orden: str = "asc",
+    db: AsyncSession = Depends(get_read_db_session)
+):
+    """
+    Búsqueda de reservas para el staff. Filtros: rango de fechas [desde, hasta),
+    estado (repetible), experiencia, usuario y prefijo de NombreReserva.
+    Para la página siguiente, repetir la consulta con cursor=siguiente_cursor.
+    """
+    if orden not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="Orden no soportado. Usa 'asc' o 'desc'.")
+    try:
+        return await db_service.buscar_reservas(
+            db, desde=desde, hasta=hasta, estados=estado, experiencia_id=experiencia_id,
+            usuario_id=usuario_id, nombre=nombre, cursor=cursor, limite=limite,
+            descendente=(orden == "desc")
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/reservas/estado", response_model=schemas.CambioEstadoResultadoSchema)
+async def cambiar_estado_reservas(
+    cambio: schemas.CambioEstadoReservasSchema,
+    db: AsyncSession = Depends(get_db_session)
+):
+    """
+    Cambio de estado en bloque (confirmar, cancelar, no_show, completar) con un solo UPDATE.
+    Las reservas que no existen o no admiten la transición vuelven en 'no_aplicables'.
+    """
+    return await db_service.cambiar_estado_reservas(db, cambio.accion, cambio.reserva_ids)
+
+@app.get("/ocupacion")
+async def ocupacion(
+    desde: date,
+    hasta: date,
+    experiencia_id: Optional[int] = None,
+    por_turno: bool = False,
+    db: AsyncSession = Depends(get_read_db_session)
+):
+    """
+    Ocupación (comensales y reservas) por día y experiencia en [desde, hasta) para el
+    calendario del staff; con por_turno=true, desglosada por turno de inicio de 15 min.
+    """
+    if hasta <= desde:
+        raise HTTPException(status_code=400, detail="'hasta' debe ser posterior a 'desde'.")
+    if (hasta - desde).days > 366:
+        raise HTTPException(status_code=400, detail="El rango máximo es de un año.")
+    return await db_service.ocupacion(db, desde, hasta, experiencia_id, por_turno)
+
+@app.get("/usuarios/{user_id}/similares")
+async def clientes_similares(
+    user_id: int,
+    k: int = Query(default=10, ge=1, le=100),
+    db: AsyncSession = Depends(get_read_db_session)
+):
+    """
+    Clientes más parecidos por perfil alimentario e historial de reservas, y las
+    experiencias que ellos reservaron ("clientes como tú reservaron..."), para el staff.
+    Se responde desde el índice en memoria (los nombres salen del catálogo).
+    """
+    vecinos = db_service.clientes_similares.similares(user_id, k)
+    experiencias = db_service.clientes_similares.experiencias_de_similares(user_id, max(k, 20))
+    for e in experiencias:
+        experiencia = await db_service.get_experiencia(db, e["experiencia_id"])
+        e["nombre"] = experiencia.Nombre if experiencia else None
+    return {
+        "usuario_id": user_id,
+        "similares": [{"usuario_id": u, "similitud": s} for u, s in vecinos],
+        "experiencias": experiencias
+    }
+
+@app.post("/crm/usuarios/import", response_model=schemas.ImportacionResultadoSchema)
+async def importar_usuarios_crm(
+    request: Request,
+    db: AsyncSession = Depends(get_db_session)
+):
+    """
+    Importación masiva desde el CRM. El cuerpo es NDJSON: una línea por usuario
+    con el formato de UsuarioSyncSchema. Las líneas inválidas se reportan y se saltan.
+    """
+    return await crm_sync_service.importar_usuarios(db, request.stream())
+
+@app.get("/crm/usuarios/export")
+async def exportar_usuarios_crm():
+    """Exportación masiva en NDJSON (una línea por usuario, con su perfil)."""
+    async def ndjson():
+        # Sesión propia: la respuesta se sigue generando después de salir del endpoint.
+        async with AsyncReadSessionFactory() as db:
+            async for bloque in crm_sync_service.exportar_usuarios(db):
+                yield bloque
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@app.get("/metricas")
+def metricas():
+    """Métricas internas del servicio (colas, cachés, etc.)."""
+    return {
+        "log_recomendaciones": recomendaciones_log_writer.metricas(),
+        "contexto_usuarios": db_service.contexto_cache.metricas(),
+        "reporte_cocina": db_service.reporte_cocina_cache.metricas(),
+        "disponibilidad": db_service.disponibilidad.metricas(),
+        "lista_espera": promotor_lista_espera.metricas(),
+        "recomendador": db_service.recomendador.metricas(),
+        "recomendaciones": db_service.recomendacion_cache.metricas(),
+        "clientes_similares": db_service.clientes_similares.metricas(),
+        "tiempos": timing.metricas()
+    }
+
 @app.get("/")
 def read_root():
     return {"status": "CRM Sensorial Backend - OK"}
\ No newline at end of file
@@ -0,0 +1,20 @@
+-- Un perfil por usuario en Preferencias.
+-- Los upserts de perfiles (INSERT ... ON CONFLICT en PostgreSQL/SQLite) y la creación
+-- concurrente en handle_actualizar_perfil se apoyan en este índice único.
+-- Si ya hay usuarios con más de un perfil, el script se detiene sin cambios:
+-- ver "Perfiles duplicados" en migraciones/README.md.
+
+IF EXISTS (
+    SELECT UsuarioId FROM dbo.Preferencias GROUP BY UsuarioId HAVING COUNT(*) > 1
+)
+BEGIN
+    RAISERROR(N'Hay usuarios con más de una fila en dbo.Preferencias; depúralos antes de crear UX_Preferencias_UsuarioId.', 16, 1);
+    RETURN;
+END;
+
+IF NOT EXISTS (
+    SELECT 1 FROM sys.indexes
+    WHERE name = N'UX_Preferencias_UsuarioId' AND object_id = OBJECT_ID(N'dbo.Preferencias')
+)
+    CREATE UNIQUE INDEX UX_Preferencias_UsuarioId ON dbo.Preferencias (UsuarioId);
+GO
@@ -0,0 +1,23 @@
+-- Perfil alimentario normalizado: una fila por alergia/restricción/disgusto/gusto,
+-- mantenida junto a Preferencias.DatosJson. Se rellena con `python jobs.py backfill-etiquetas`.
+
+IF OBJECT_ID(N'dbo.PerfilEtiquetas', N'U') IS NULL
+    CREATE TABLE dbo.PerfilEtiquetas (
+        Id INT IDENTITY(1, 1) NOT NULL CONSTRAINT PK_PerfilEtiquetas PRIMARY KEY,
+        UsuarioId INT NOT NULL
+            CONSTRAINT FK_PerfilEtiquetas_Usuarios REFERENCES dbo.Usuarios (Id) ON DELETE CASCADE,
+        Tipo NVARCHAR(20) NOT NULL,
+        Valor NVARCHAR(150) NOT NULL,
+        Codigo NVARCHAR(30) NULL
+    );
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_PerfilEtiquetas_Tipo_Valor' AND object_id = OBJECT_ID(N'dbo.PerfilEtiquetas'))
+    CREATE INDEX IX_PerfilEtiquetas_Tipo_Valor ON dbo.PerfilEtiquetas (Tipo, Valor, UsuarioId);
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_PerfilEtiquetas_UsuarioId' AND object_id = OBJECT_ID(N'dbo.PerfilEtiquetas'))
+    CREATE INDEX IX_PerfilEtiquetas_UsuarioId ON dbo.PerfilEtiquetas (UsuarioId);
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_PerfilEtiquetas_Codigo' AND object_id = OBJECT_ID(N'dbo.PerfilEtiquetas'))
+    CREATE INDEX IX_PerfilEtiquetas_Codigo ON dbo.PerfilEtiquetas (Codigo, UsuarioId);
+GO
@@ -0,0 +1,15 @@
+-- Códigos canónicos de alérgenos extraídos de Reservas.Restricciones (alergenos.py).
+-- Se rellena con `python jobs.py normalizar-alergenos`.
+
+IF OBJECT_ID(N'dbo.ReservaAlergenos', N'U') IS NULL
+    CREATE TABLE dbo.ReservaAlergenos (
+        ReservaId INT NOT NULL
+            CONSTRAINT FK_ReservaAlergenos_Reservas REFERENCES dbo.Reservas (Id) ON DELETE CASCADE,
+        Codigo NVARCHAR(30) NOT NULL,
+        CONSTRAINT PK_ReservaAlergenos PRIMARY KEY (ReservaId, Codigo)
+    );
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_ReservaAlergenos_Codigo' AND object_id = OBJECT_ID(N'dbo.ReservaAlergenos'))
+    CREATE INDEX IX_ReservaAlergenos_Codigo ON dbo.ReservaAlergenos (Codigo);
+GO
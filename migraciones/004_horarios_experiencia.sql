@@ -0,0 +1,20 @@
+-- Franjas de atención y capacidad por experiencia (disponibilidad.py).
+-- El servidor la lee al arrancar: debe existir antes de desplegar. Vacía = sin control
+-- de capacidad (todas las experiencias aceptan cualquier horario, como antes).
+-- DiaSemana: 0 = lunes ... 6 = domingo; NULL = todos los días.
+
+IF OBJECT_ID(N'dbo.HorariosExperiencia', N'U') IS NULL
+    CREATE TABLE dbo.HorariosExperiencia (
+        Id INT IDENTITY(1, 1) NOT NULL CONSTRAINT PK_HorariosExperiencia PRIMARY KEY,
+        ExperienciaId INT NOT NULL
+            CONSTRAINT FK_HorariosExperiencia_Experiencias REFERENCES dbo.Experiencias (Id) ON DELETE CASCADE,
+        DiaSemana INT NULL,
+        HoraApertura TIME NOT NULL,
+        HoraCierre TIME NOT NULL,
+        CapacidadComensales INT NOT NULL
+    );
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_HorariosExperiencia_ExperienciaId' AND object_id = OBJECT_ID(N'dbo.HorariosExperiencia'))
+    CREATE INDEX IX_HorariosExperiencia_ExperienciaId ON dbo.HorariosExperiencia (ExperienciaId);
+GO
@@ -0,0 +1,11 @@
+-- Claves de idempotencia de crear_reserva (sha256 hexadecimal de la sesión y los datos).
+-- La PK impide que una llamada repetida inserte otra reserva.
+
+IF OBJECT_ID(N'dbo.ReservasIdempotencia', N'U') IS NULL
+    CREATE TABLE dbo.ReservasIdempotencia (
+        Clave NVARCHAR(64) NOT NULL CONSTRAINT PK_ReservasIdempotencia PRIMARY KEY,
+        ReservaId INT NOT NULL
+            CONSTRAINT FK_ReservasIdempotencia_Reservas REFERENCES dbo.Reservas (Id) ON DELETE CASCADE,
+        CreadoEn DATETIME NULL CONSTRAINT DF_ReservasIdempotencia_CreadoEn DEFAULT (GETDATE())
+    );
+GO
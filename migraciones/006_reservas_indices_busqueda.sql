@@ -0,0 +1,19 @@
+-- Índices de la búsqueda paginada de reservas (GET /reservas, keyset por FechaHora, Id)
+-- y del resto de lecturas por turno. Sobre una tabla Reservas grande, crearlos fuera
+-- del horario de servicio (bloquean escrituras mientras se construyen).
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_Reservas_FechaHora_Id' AND object_id = OBJECT_ID(N'dbo.Reservas'))
+    CREATE INDEX IX_Reservas_FechaHora_Id ON dbo.Reservas (FechaHora, Id);
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_Reservas_Estado_FechaHora' AND object_id = OBJECT_ID(N'dbo.Reservas'))
+    CREATE INDEX IX_Reservas_Estado_FechaHora ON dbo.Reservas (Estado, FechaHora, Id);
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_Reservas_ExperienciaId_FechaHora' AND object_id = OBJECT_ID(N'dbo.Reservas'))
+    CREATE INDEX IX_Reservas_ExperienciaId_FechaHora ON dbo.Reservas (ExperienciaId, FechaHora, Id);
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_Reservas_UsuarioId_FechaHora' AND object_id = OBJECT_ID(N'dbo.Reservas'))
+    CREATE INDEX IX_Reservas_UsuarioId_FechaHora ON dbo.Reservas (UsuarioId, FechaHora, Id);
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_Reservas_NombreReserva' AND object_id = OBJECT_ID(N'dbo.Reservas'))
+    CREATE INDEX IX_Reservas_NombreReserva ON dbo.Reservas (NombreReserva);
+GO
@@ -0,0 +1,14 @@
+-- Resumen de ocupación por día, turno de inicio (15 min) y experiencia.
+-- Se puebla con `python jobs.py reconciliar-ocupacion --corregir` tras desplegar.
+
+IF OBJECT_ID(N'dbo.OcupacionDiaria', N'U') IS NULL
+    CREATE TABLE dbo.OcupacionDiaria (
+        Fecha DATE NOT NULL,
+        ExperienciaId INT NOT NULL
+            CONSTRAINT FK_OcupacionDiaria_Experiencias REFERENCES dbo.Experiencias (Id),
+        HoraTurno TIME NOT NULL,
+        Comensales INT NOT NULL CONSTRAINT DF_OcupacionDiaria_Comensales DEFAULT (0),
+        Reservas INT NOT NULL CONSTRAINT DF_OcupacionDiaria_Reservas DEFAULT (0),
+        CONSTRAINT PK_OcupacionDiaria PRIMARY KEY (Fecha, ExperienciaId, HoraTurno)
+    );
+GO
@@ -0,0 +1,62 @@
+-- Lista de espera por turno lleno (lista_espera.py).
+
+IF OBJECT_ID(N'dbo.ListaEspera', N'U') IS NULL
+    CREATE TABLE dbo.ListaEspera (
+        Id INT IDENTITY(1, 1) NOT NULL CONSTRAINT PK_ListaEspera PRIMARY KEY,
+        UsuarioId INT NOT NULL
+            CONSTRAINT FK_ListaEspera_Usuarios REFERENCES dbo.Usuarios (Id) ON DELETE CASCADE,
+        ExperienciaId INT NOT NULL
+            CONSTRAINT FK_ListaEspera_Experiencias REFERENCES dbo.Experiencias (Id),
+        FechaHora DATETIME NOT NULL,
+        NumComensales INT NOT NULL,
+        NombreReserva NVARCHAR(150) NOT NULL,
+        Restricciones NVARCHAR(500) NULL,
+        Prioridad INT NOT NULL CONSTRAINT DF_ListaEspera_Prioridad DEFAULT (0),
+        Estado NVARCHAR(30) NOT NULL CONSTRAINT DF_ListaEspera_Estado DEFAULT (N'esperando'),
+        ReservaId INT NULL
+            CONSTRAINT FK_ListaEspera_Reservas REFERENCES dbo.Reservas (Id),
+        CreadoEn DATETIME NOT NULL CONSTRAINT DF_ListaEspera_CreadoEn DEFAULT (GETDATE()),
+        ActualizadoEn DATETIME NULL
+    );
+GO
+
+-- Mismo orden que el ORDER BY del promotor (FechaHora, Prioridad DESC, Id). Una versión
+-- anterior de este script lo creaba con Prioridad ascendente: se rehace.
+IF EXISTS (
+    SELECT 1
+    FROM sys.indexes i
+    JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+    JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+    WHERE i.name = N'IX_ListaEspera_Turno' AND i.object_id = OBJECT_ID(N'dbo.ListaEspera')
+        AND c.name = N'Prioridad' AND ic.is_descending_key = 0
+)
+    DROP INDEX IX_ListaEspera_Turno ON dbo.ListaEspera;
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_ListaEspera_Turno' AND object_id = OBJECT_ID(N'dbo.ListaEspera'))
+    CREATE INDEX IX_ListaEspera_Turno ON dbo.ListaEspera (ExperienciaId, Estado, FechaHora, Prioridad DESC, Id);
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_ListaEspera_UsuarioId' AND object_id = OBJECT_ID(N'dbo.ListaEspera'))
+    CREATE INDEX IX_ListaEspera_UsuarioId ON dbo.ListaEspera (UsuarioId);
+GO
+
+-- Una sola solicitud activa por usuario, experiencia y horario (índice filtrado; requiere
+-- QUOTED_IDENTIFIER ON, que sqlcmd no activa por defecto). Antes de crearlo se retiran las
+-- solicitudes repetidas que hubiera dejado la comprobación previa: se conserva la más antigua.
+SET QUOTED_IDENTIFIER ON;
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'UX_ListaEspera_Esperando' AND object_id = OBJECT_ID(N'dbo.ListaEspera'))
+BEGIN
+    UPDATE l
+    SET Estado = N'cancelada', ActualizadoEn = GETDATE()
+    FROM dbo.ListaEspera l
+    WHERE l.Estado = N'esperando' AND EXISTS (
+        SELECT 1 FROM dbo.ListaEspera o
+        WHERE o.UsuarioId = l.UsuarioId AND o.ExperienciaId = l.ExperienciaId AND o.FechaHora = l.FechaHora
+            AND o.Estado = N'esperando' AND o.Id < l.Id
+    );
+
+    CREATE UNIQUE INDEX UX_ListaEspera_Esperando ON dbo.ListaEspera (UsuarioId, ExperienciaId, FechaHora)
+        WHERE Estado = N'esperando';
+END;
+GO
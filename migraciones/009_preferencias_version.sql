@@ -0,0 +1,8 @@
+-- Contador de versión del perfil para la concurrencia optimista de
+-- actualizar_perfil_alimentario: cada escritura de Preferencias lo incrementa
+-- (ActualizadoEn queda solo como dato de auditoría).
+
+IF COL_LENGTH(N'dbo.Preferencias', N'Version') IS NULL
+    ALTER TABLE dbo.Preferencias
+        ADD Version INT NOT NULL CONSTRAINT DF_Preferencias_Version DEFAULT 1;
+GO
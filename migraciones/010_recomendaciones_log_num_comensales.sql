@@ -0,0 +1,7 @@
+-- Tamaño del grupo dado al pedir la recomendación. El entrenamiento del recomendador
+-- lo usa como rasgo solo cuando está registrado (antes se tomaba de la reserva
+-- posterior, que es la etiqueta). Las filas anteriores quedan en NULL.
+
+IF COL_LENGTH(N'dbo.RecomendacionesLog', N'NumComensales') IS NULL
+    ALTER TABLE dbo.RecomendacionesLog ADD NumComensales INT NULL;
+GO
@@ -0,0 +1,21 @@
+-- Palabras clave curadas por experiencia para la búsqueda por texto libre del
+-- recomendador (TF-IDF): términos que no están en Nombre ni en Descripcion.
+-- Se editan en el catálogo; el recomendador reconstruye su índice al detectar el cambio.
+-- El relleno inicial solo toca las filas que aún no tienen palabras clave.
+
+IF COL_LENGTH(N'dbo.Experiencias', N'PalabrasClave') IS NULL
+    ALTER TABLE dbo.Experiencias ADD PalabrasClave NVARCHAR(500) NULL;
+GO
+
+UPDATE dbo.Experiencias
+SET PalabrasClave = N'menu degustacion cena gourmet platos pasos tradicional peruana clasica turistas turismo pareja romantica noche gastronomia'
+WHERE Id = 1 AND PalabrasClave IS NULL;
+
+UPDATE dbo.Experiencias
+SET PalabrasClave = N'inmersion completa larga seis horas maridaje vinos cocteles celebracion aniversario cumpleanos negocios corporativo empresa clientes especial exclusiva'
+WHERE Id = 2 AND PalabrasClave IS NULL;
+
+UPDATE dbo.Experiencias
+SET PalabrasClave = N'theobromas laboratorio cacao chocolate amazonico amazonia taller corta ligera ninos familia hijos grupo amigos curiosos dulce vegana'
+WHERE Id = 3 AND PalabrasClave IS NULL;
+GO
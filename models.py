@@ -1,6 +1,6 @@
 from sqlalchemy import (
     Column, Integer, String, DateTime, Boolean, Float, ForeignKey, DECIMAL, Text,
-    Identity
+    Identity, Index, Time, Date, text
 )
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
@@ -32,13 +32,42 @@ class Experiencia(Base):
     Nombre = Column(String(250), nullable=False)
     DuracionMinutos = Column(Integer)
     Descripcion = Column(String(1000))
+    # Términos de búsqueda curados que no están en la descripción (recomendador, TF-IDF)
+    PalabrasClave = Column(String(500))
     Precio = Column(DECIMAL(10, 2))
     Activa = Column(Boolean, nullable=False, default=True)
     CreadoEn = Column(DateTime, nullable=False, default=func.now())
 
+class HorarioExperiencia(Base):
+    """Franja de atención de una experiencia y su capacidad (comensales simultáneos).
+       DiaSemana: 0 = lunes ... 6 = domingo; NULL = todos los días.
+       Una experiencia sin franjas configuradas no tiene control de capacidad."""
+    __tablename__ = 'HorariosExperiencia'
+    __table_args__ = (
+        Index('IX_HorariosExperiencia_ExperienciaId', 'ExperienciaId'),
+        {'schema': 'dbo'}
+    )
+
+    Id = Column(Integer, Identity(), primary_key=True)
+    ExperienciaId = Column(Integer, ForeignKey('dbo.Experiencias.Id', ondelete="CASCADE"), nullable=False)
+    DiaSemana = Column(Integer, nullable=True)
+    HoraApertura = Column(Time, nullable=False)
+    HoraCierre = Column(Time, nullable=False)
+    CapacidadComensales = Column(Integer, nullable=False)
+
+    experiencia = relationship("Experiencia")
+
 class Reserva(Base):
     __tablename__ = 'Reservas'
-    __table_args__ = {'schema': 'dbo'}
+    __table_args__ = (
+        # Búsqueda paginada por (FechaHora, Id): un índice por cada filtro habitual
+        Index('IX_Reservas_FechaHora_Id', 'FechaHora', 'Id'),
+        Index('IX_Reservas_Estado_FechaHora', 'Estado', 'FechaHora', 'Id'),
+        Index('IX_Reservas_ExperienciaId_FechaHora', 'ExperienciaId', 'FechaHora', 'Id'),
+        Index('IX_Reservas_UsuarioId_FechaHora', 'UsuarioId', 'FechaHora', 'Id'),
+        Index('IX_Reservas_NombreReserva', 'NombreReserva'),
+        {'schema': 'dbo'}
+    )
 
     Id = Column(Integer, Identity(), primary_key=True)
     UsuarioId = Column(Integer, ForeignKey('dbo.Usuarios.Id', ondelete="SET NULL"))
@@ -54,18 +83,63 @@ class Reserva(Base):
     usuario = relationship("Usuario", back_populates="reservas")
     experiencia = relationship("Experiencia")
 
+# Estados de Reserva que cuentan como asistencia prevista (ocupan cupo y entran en los reportes)
+ESTADOS_QUE_OCUPAN = ("pendiente", "confirmada", "completada")
+
+# Transiciones de estado de Reserva: acción -> (estados de origen permitidos, estado destino)
+TRANSICIONES_RESERVA = {
+    "confirmar": (("pendiente",), "confirmada"),
+    "cancelar": (("pendiente", "confirmada"), "cancelada"),
+    "no_show": (("pendiente", "confirmada"), "no_show"),
+    "completar": (("pendiente", "confirmada"), "completada"),
+}
+
 class Preferencia(Base):
     __tablename__ = 'Preferencias'
-    __table_args__ = {'schema': 'dbo'}
+    __table_args__ = (
+        # Un perfil por usuario; es además el destino del ON CONFLICT de los upserts
+        Index('UX_Preferencias_UsuarioId', 'UsuarioId', unique=True),
+        {'schema': 'dbo'}
+    )
 
     Id = Column(Integer, Identity(), primary_key=True)
     UsuarioId = Column(Integer, ForeignKey('dbo.Usuarios.Id', ondelete="CASCADE"), nullable=False)
     DatosJson = Column(Text, nullable=True)
     CreadoEn = Column(DateTime, nullable=False, default=func.now())
     ActualizadoEn = Column(DateTime, onupdate=func.now())
+    # Concurrencia optimista: cada escritura del perfil la incrementa en el mismo UPDATE
+    Version = Column(Integer, nullable=False, default=1, server_default=text("1"))
     
     usuario = relationship("Usuario", back_populates="preferencias")
 
+# Listas del perfil alimentario (claves de DatosJson) -> Tipo en PerfilEtiquetas
+TIPOS_ETIQUETA = {
+    "alergias": "alergia",
+    "restricciones": "restriccion",
+    "disgustos": "disgusto",
+    "gustos": "gusto",
+}
+
+class PerfilEtiqueta(Base):
+    """Perfil alimentario normalizado: una fila por alergia/restricción/disgusto/gusto.
+       Se mantiene junto a Preferencias.DatosJson en la misma transacción."""
+    __tablename__ = 'PerfilEtiquetas'
+    __table_args__ = (
+        Index('IX_PerfilEtiquetas_Tipo_Valor', 'Tipo', 'Valor', 'UsuarioId'),
+        Index('IX_PerfilEtiquetas_UsuarioId', 'UsuarioId'),
+        Index('IX_PerfilEtiquetas_Codigo', 'Codigo', 'UsuarioId'),
+        {'schema': 'dbo'}
+    )
+
+    Id = Column(Integer, Identity(), primary_key=True)
+    UsuarioId = Column(Integer, ForeignKey('dbo.Usuarios.Id', ondelete="CASCADE"), nullable=False)
+    Tipo = Column(String(20), nullable=False)
+    Valor = Column(String(150), nullable=False)
+    # Código canónico del alérgeno/restricción (ver alergenos.py); None si no se reconoce.
+    Codigo = Column(String(30))
+
+    usuario = relationship("Usuario")
+
 class RecomendacionesLog(Base):
     __tablename__ = 'RecomendacionesLog'
     __table_args__ = {'schema': 'dbo'}
@@ -75,8 +149,86 @@ class RecomendacionesLog(Base):
     MotivoVisita = Column(String(100))
     Acompanantes = Column(String(100))
     EstiloCocina = Column(String(100))
+    # Tamaño del grupo si el usuario lo dio al pedir la recomendación (rasgo grupo:* al entrenar)
+    NumComensales = Column(Integer, nullable=True)
     ExperienciaRecomendadaId = Column(Integer, ForeignKey('dbo.Experiencias.Id'), nullable=True)
     CreadoEn = Column(DateTime, nullable=False, default=func.now())
 
     usuario = relationship("Usuario")
-    experiencia_recomendada = relationship("Experiencia")
\ No newline at end of file
+    experiencia_recomendada = relationship("Experiencia")
+
+class ReservaAlergeno(Base):
+    """Códigos canónicos de alérgenos/restricciones extraídos de Reserva.Restricciones."""
+    __tablename__ = 'ReservaAlergenos'
+    __table_args__ = (
+        Index('IX_ReservaAlergenos_Codigo', 'Codigo'),
+        {'schema': 'dbo'}
+    )
+
+    ReservaId = Column(Integer, ForeignKey('dbo.Reservas.Id', ondelete="CASCADE"), primary_key=True)
+    Codigo = Column(String(30), primary_key=True)
+
+    reserva = relationship("Reserva")
+
+class ReservaIdempotencia(Base):
+    """Clave de idempotencia de crear_reserva (sha256 de la sesión + datos de la reserva).
+       La PK única impide insertar dos veces la misma reserva aunque se repita la llamada."""
+    __tablename__ = 'ReservasIdempotencia'
+    __table_args__ = {'schema': 'dbo'}
+
+    Clave = Column(String(64), primary_key=True)
+    ReservaId = Column(Integer, ForeignKey('dbo.Reservas.Id', ondelete="CASCADE"), nullable=False)
+    CreadoEn = Column(DateTime, server_default=func.now())
+
+    reserva = relationship("Reserva")
+
+class OcupacionDiaria(Base):
+    """Resumen de ocupación por día, turno de inicio (15 min) y experiencia.
+       Se mantiene en la misma transacción que cada alta o cambio de estado de Reserva
+       (solo cuentan los ESTADOS_QUE_OCUPAN); `python jobs.py reconciliar-ocupacion` lo verifica."""
+    __tablename__ = 'OcupacionDiaria'
+    __table_args__ = {'schema': 'dbo'}
+
+    Fecha = Column(Date, primary_key=True)
+    ExperienciaId = Column(Integer, ForeignKey('dbo.Experiencias.Id'), primary_key=True)
+    HoraTurno = Column(Time, primary_key=True)
+    Comensales = Column(Integer, nullable=False, default=0)
+    Reservas = Column(Integer, nullable=False, default=0)
+
+class ListaEspera(Base):
+    """Solicitud en lista de espera para un turno lleno. El promotor la convierte en Reserva
+       (Estado 'promovida', ReservaId) cuando se libera cupo: en cada horario, primero Prioridad,
+       luego orden de llegada. El usuario puede retirarla (Estado 'cancelada')."""
+    __tablename__ = 'ListaEspera'
+    __table_args__ = (
+        Index('IX_ListaEspera_UsuarioId', 'UsuarioId'),
+        {'schema': 'dbo'}
+    )
+
+    Id = Column(Integer, Identity(), primary_key=True)
+    UsuarioId = Column(Integer, ForeignKey('dbo.Usuarios.Id', ondelete="CASCADE"), nullable=False)
+    ExperienciaId = Column(Integer, ForeignKey('dbo.Experiencias.Id'), nullable=False)
+    FechaHora = Column(DateTime, nullable=False)
+    NumComensales = Column(Integer, nullable=False)
+    NombreReserva = Column(String(150), nullable=False)
+    Restricciones = Column(String(500))
+    Prioridad = Column(Integer, nullable=False, default=0) # Mayor = antes (p. ej. clientes frecuentes)
+    Estado = Column(String(30), nullable=False, default='esperando') # esperando | promovida | cancelada | expirada
+    ReservaId = Column(Integer, ForeignKey('dbo.Reservas.Id'), nullable=True)
+    CreadoEn = Column(DateTime, nullable=False, default=func.now())
+    ActualizadoEn = Column(DateTime, onupdate=func.now())
+
+# Candidatos de un turno: WHERE ExperienciaId AND Estado AND FechaHora en el día,
+# ORDER BY FechaHora, Prioridad DESC, Id (el mismo orden que el índice: sin ordenar aparte)
+Index(
+    'IX_ListaEspera_Turno',
+    ListaEspera.ExperienciaId, ListaEspera.Estado, ListaEspera.FechaHora, ListaEspera.Prioridad.desc(), ListaEspera.Id
+)
+
+# Una sola solicitud activa por usuario, experiencia y horario (unirse_lista_espera repetida o concurrente)
+_SOLO_ESPERANDO = ListaEspera.Estado == 'esperando'
+Index(
+    'UX_ListaEspera_Esperando',
+    ListaEspera.UsuarioId, ListaEspera.ExperienciaId, ListaEspera.FechaHora,
+    unique=True, mssql_where=_SOLO_ESPERANDO, postgresql_where=_SOLO_ESPERANDO, sqlite_where=_SOLO_ESPERANDO
+)
@@ -0,0 +1,460 @@
+"""
+Motor de recomendación de experiencias.
+
+Las respuestas de la herramienta recomendar_experiencia (motivo, acompañantes,
+estilo), el tamaño del grupo y las etiquetas del perfil alimentario se
+convierten en un vector binario de rasgos. Al cargar el catálogo se construye
+una matriz de pesos (experiencias activas x rasgos), así que puntuar todas las
+experiencias es un único producto matriz-vector. Las contribuciones de cada
+rasgo sirven de explicación del ranking. El texto libre de las respuestas suma
+además su similitud TF-IDF con cada experiencia (tfidf.py), para lo que los
+sinónimos no cubren.
+
+Los pesos parten de PESOS_BASE. El trabajo `python jobs.py entrenar-recomendador`
+los ajusta con las conversiones reales y los publica como artefacto versionado
+(pesos_vN.npy + pesos_vN.json y el puntero actual.json); el servidor lo abre con
+memory-map y lo recarga en caliente cuando cambia el puntero.
+"""
+import json
+import os
+import re
+import time
+import traceback
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from alergenos import MatcherAhoCorasick, codigos_alergenos, normalizar_texto
+from tfidf import IndiceTfidf
+
+# Rasgos que salen del texto libre de los argumentos (se buscan como palabras completas).
+SINONIMOS_ARGUMENTOS: Dict[str, List[str]] = {
+    "motivo:celebracion": [
+        "celebracion", "celebracion especial", "cumpleanos", "aniversario", "boda", "pedida de mano",
+        "luna de miel", "despedida", "graduacion"
+    ],
+    "motivo:negocios": ["negocios", "negocio", "trabajo", "corporativo", "empresa", "reunion", "clientes"],
+    "motivo:turismo": ["turismo", "turista", "viaje", "vacaciones", "de paso", "visitando lima"],
+    # "solo" suelto es sobre todo un adverbio ("solo quiero algo ligero"): únicamente frases
+    # inequívocas; la respuesta "Solo" a secas se reconoce aparte en _rasgos_argumentos
+    "acompanantes:solo": [
+        "yo solo", "yo sola", "voy solo", "voy sola", "vengo solo", "vengo sola", "ire solo", "ire sola",
+        "estare solo", "estare sola", "solo yo", "sola yo", "sin acompanantes", "una sola persona"
+    ],
+    "acompanantes:pareja": ["pareja", "esposo", "esposa", "novio", "novia", "enamorado", "enamorada"],
+    "acompanantes:familia": ["familia", "hijo", "hija", "ninos", "padres", "familiares"],
+    "acompanantes:amigos": ["amigos", "amigas", "amistades", "colegas", "companeros"],
+    "estilo:tradicional": ["tradicional", "criolla", "criollo", "peruana", "clasica"],
+    "estilo:moderna": ["moderna", "fusion", "contemporanea", "vanguardia", "innovadora"],
+    "estilo:vegana": ["vegana", "vegano", "vegetal", "vegetariana"],
+    "estilo:gourmet": ["gourmet", "alta cocina", "degustacion", "fine dining"],
+}
+
+# Orden fijo de los rasgos: define las columnas de la matriz de pesos.
+RASGOS: List[str] = [
+    *SINONIMOS_ARGUMENTOS,
+    "motivo:otros",
+    "grupo:1", "grupo:2", "grupo:3-6", "grupo:7+",
+    "restriccion:vegano", "restriccion:vegetariano", "restriccion:sin_alcohol", "restriccion:embarazo",
+    "alergia:cacao", "alergia:lacteos", "alergia:gluten", "alergia:frutos_secos",
+    "gusto:cacao",
+    "sesgo",
+]
+INDICE_RASGO: Dict[str, int] = {rasgo: i for i, rasgo in enumerate(RASGOS)}
+
+# Textos para las explicaciones
+ETIQUETAS_RASGO: Dict[str, str] = {
+    "motivo:celebracion": "es una celebración especial",
+    "motivo:negocios": "es una visita de negocios",
+    "motivo:turismo": "estás de turismo",
+    "motivo:otros": "el motivo de tu visita",
+    "acompanantes:solo": "vienes solo",
+    "acompanantes:pareja": "vienes en pareja",
+    "acompanantes:familia": "vienes en familia",
+    "acompanantes:amigos": "vienes con amigos",
+    "estilo:tradicional": "prefieres cocina tradicional",
+    "estilo:moderna": "te atrae la cocina moderna o de fusión",
+    "estilo:vegana": "prefieres cocina vegana",
+    "estilo:gourmet": "buscas una experiencia gourmet",
+    "grupo:1": "es para una persona",
+    "grupo:2": "es para dos personas",
+    "grupo:3-6": "es para un grupo mediano",
+    "grupo:7+": "es para un grupo grande",
+    "restriccion:vegano": "tu perfil es vegano",
+    "restriccion:vegetariano": "tu perfil es vegetariano",
+    "restriccion:sin_alcohol": "no tomas alcohol",
+    "restriccion:embarazo": "estás embarazada",
+    "alergia:cacao": "tienes alergia al cacao",
+    "alergia:lacteos": "tienes alergia a los lácteos",
+    "alergia:gluten": "tienes alergia al gluten",
+    "alergia:frutos_secos": "tienes alergia a los frutos secos",
+    "gusto:cacao": "te gusta el cacao o el chocolate",
+    "sesgo": "es nuestra experiencia principal",
+}
+
+# Pesos iniciales por experiencia (Id, como en la descripción de las herramientas).
+# Recogen las reglas anteriores y la descripción de cada experiencia; una experiencia
+# que no figure aquí solo puntúa por la penalización de repetir visita.
+PESOS_BASE: Dict[int, Dict[str, float]] = {
+    # 1. Menú Degustación: cena gourmet completa; turistas, parejas, amantes de la gastronomía
+    1: {
+        "sesgo": 0.5, "motivo:turismo": 1.0, "acompanantes:pareja": 0.8, "acompanantes:solo": 0.5,
+        "estilo:tradicional": 0.8, "estilo:gourmet": 0.6, "estilo:moderna": 0.4, "grupo:2": 0.4,
+        "grupo:1": 0.3, "restriccion:vegano": -0.3,
+    },
+    # 2. Inmersión Central: la más completa (6 h, maridaje); celebraciones y visitas corporativas
+    2: {
+        "motivo:celebracion": 1.2, "motivo:negocios": 1.2, "estilo:gourmet": 1.0, "estilo:moderna": 1.0,
+        "acompanantes:pareja": 0.3, "grupo:3-6": 0.3, "restriccion:sin_alcohol": -0.6,
+        "restriccion:embarazo": -0.6, "acompanantes:familia": -0.3,
+    },
+    # 3. Theobromas Lab: cacao amazónico, 2 h, ligera; grupos, familias, curiosos
+    3: {
+        "estilo:vegana": 1.2, "acompanantes:familia": 1.2, "acompanantes:amigos": 0.8, "gusto:cacao": 1.0,
+        "grupo:3-6": 0.5, "grupo:7+": 0.8, "motivo:otros": 0.4, "restriccion:vegano": 0.6,
+        "restriccion:sin_alcohol": 0.3, "alergia:cacao": -3.0, "alergia:lacteos": -0.5,
+        "alergia:frutos_secos": -0.5,
+    },
+}
+
+# Peso por visita completada a la misma experiencia (negativo: se prefiere algo nuevo)
+PESO_REPETIR_VISITA = -0.6
+
+# Peso de la similitud coseno (0..1) entre el texto libre y la descripción de cada experiencia
+PESO_TEXTO = 1.0
+# Contribución mínima del texto para mencionarla entre las razones
+MINIMO_RAZON_TEXTO = 0.2
+
+_matcher_argumentos = MatcherAhoCorasick(SINONIMOS_ARGUMENTOS)
+
+# Archivo que indica qué versión de pesos está publicada (se reemplaza de forma atómica)
+ARCHIVO_PUNTERO = "actual.json"
+
+def _grupo(num_comensales: Optional[int]) -> Optional[str]:
+    if not num_comensales or num_comensales < 1:
+        return None
+    if num_comensales == 1:
+        return "grupo:1"
+    if num_comensales == 2:
+        return "grupo:2"
+    return "grupo:3-6" if num_comensales <= 6 else "grupo:7+"
+
+@lru_cache(maxsize=4096)
+def _rasgos_argumentos(motivo: Optional[str], acompanantes: Optional[str], estilo: Optional[str]) -> FrozenSet[str]:
+    # Las respuestas se repiten mucho ("Pareja", "Gourmet"...): se memoriza el resultado del matcher
+    rasgos = set(_matcher_argumentos.buscar(" ".join(t for t in (motivo, acompanantes, estilo) if t)))
+    if acompanantes and normalizar_texto(acompanantes).strip() in ("solo", "sola"):
+        # La opción "Solo" de la pregunta, respondida tal cual
+        rasgos.add("acompanantes:solo")
+    if motivo and not any(r.startswith("motivo:") for r in rasgos):
+        rasgos.add("motivo:otros")
+    return frozenset(rasgos)
+
+def rasgos_de_entrada(
+    motivo: Optional[str],
+    acompanantes: Optional[str],
+    estilo: Optional[str],
+    num_comensales: Optional[int] = None,
+    perfil: Optional[dict] = None
+) -> List[str]:
+    """Rasgos activos para unos argumentos y un perfil (los que no estén en RASGOS se ignoran)."""
+    rasgos = {"sesgo"} | _rasgos_argumentos(motivo, acompanantes, estilo)
+    grupo = _grupo(num_comensales)
+    if grupo:
+        rasgos.add(grupo)
+    if isinstance(perfil, dict):
+        for tipo, lista in (("restriccion", "restricciones"), ("alergia", "alergias"), ("gusto", "gustos")):
+            for valor in perfil.get(lista) or []:
+                for codigo in codigos_alergenos(str(valor)):
+                    rasgos.add(f"{tipo}:{codigo}")
+    return sorted(r for r in rasgos if r in INDICE_RASGO)
+
+# --- Entrenamiento y artefactos de pesos ---
+
+def _probabilidades(pesos: np.ndarray, x: np.ndarray) -> np.ndarray:
+    z = x @ pesos.T
+    z -= z.max(axis=1, keepdims=True)
+    p = np.exp(z)
+    return p / p.sum(axis=1, keepdims=True)
+
+def entrenar_pesos(
+    x: np.ndarray,
+    y: np.ndarray,
+    pesos_iniciales: np.ndarray,
+    regularizacion: float = 0.05,
+    iteraciones: int = 300,
+    tasa: float = 0.5
+) -> np.ndarray:
+    """
+    Regresión softmax por descenso de gradiente: x (n x rasgos) con la experiencia
+    reservada y (índice de fila en pesos_iniciales). La penalización L2 tira hacia
+    los pesos iniciales, así que con pocos datos el resultado se parece a PESOS_BASE.
+    """
+    w0 = pesos_iniciales.astype(np.float64)
+    w = w0.copy()
+    x = x.astype(np.float64)
+    n = len(y)
+    filas = np.arange(n)
+    for _ in range(iteraciones):
+        p = _probabilidades(w, x)
+        p[filas, y] -= 1.0
+        gradiente = p.T @ x / n + regularizacion * (w - w0)
+        w -= tasa * gradiente
+    return w.astype(np.float32)
+
+def evaluar_pesos(pesos: np.ndarray, x: np.ndarray, y: np.ndarray) -> dict:
+    """Acierto top-1, top-3 y log-loss de una matriz de pesos sobre (x, y)."""
+    if not len(y):
+        return {"acierto_top1": None, "acierto_top3": None, "log_loss": None}
+    p = _probabilidades(pesos.astype(np.float64), x.astype(np.float64))
+    orden = np.argsort(-p, axis=1, kind="stable")
+    return {
+        "acierto_top1": round(float(np.mean(orden[:, 0] == y)), 4),
+        "acierto_top3": round(float(np.mean((orden[:, :3] == y[:, None]).any(axis=1))), 4),
+        "log_loss": round(float(-np.mean(np.log(p[np.arange(len(y)), y] + 1e-12))), 4)
+    }
+
+def guardar_artefacto(directorio: str, pesos: np.ndarray, experiencia_ids: List[int], metadatos: dict) -> int:
+    """
+    Escribe pesos_v{N}.npy y pesos_v{N}.json con la siguiente versión libre y
+    después apunta actual.json a ella (os.replace: el servidor nunca lee un
+    puntero a medias ni una versión incompleta). Devuelve N.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    versiones = [
+        int(m.group(1)) for nombre in os.listdir(directorio)
+        if (m := re.fullmatch(r"pesos_v(\d+)\.npy", nombre))
+    ]
+    version = max(versiones, default=0) + 1
+    base = os.path.join(directorio, f"pesos_v{version}")
+
+    np.save(base + ".npy", np.ascontiguousarray(pesos, dtype=np.float32))
+    with open(base + ".json", "w", encoding="utf-8") as f:
+        json.dump(
+            {**metadatos, "version": version, "experiencia_ids": [int(e) for e in experiencia_ids], "rasgos": RASGOS},
+            f, ensure_ascii=False, indent=2
+        )
+
+    puntero = os.path.join(directorio, ARCHIVO_PUNTERO)
+    with open(puntero + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"version": version}, f)
+    os.replace(puntero + ".tmp", puntero)
+    return version
+
+def cargar_artefacto(directorio: str) -> Tuple[np.ndarray, dict]:
+    """Versión publicada: (pesos abiertos con memory-map, metadatos)."""
+    with open(os.path.join(directorio, ARCHIVO_PUNTERO), encoding="utf-8") as f:
+        version = int(json.load(f)["version"])
+    base = os.path.join(directorio, f"pesos_v{version}")
+    with open(base + ".json", encoding="utf-8") as f:
+        metadatos = json.load(f)
+    pesos = np.load(base + ".npy", mmap_mode="r")
+    if pesos.shape != (len(metadatos["experiencia_ids"]), len(metadatos["rasgos"])):
+        raise ValueError(f"pesos_v{version}.npy no coincide con sus metadatos: {pesos.shape}")
+    return pesos, metadatos
+
+class Recomendador:
+
+    def __init__(
+        self,
+        pesos_base: Dict[int, Dict[str, float]] = PESOS_BASE,
+        peso_repetir: float = PESO_REPETIR_VISITA,
+        directorio_modelos: Optional[str] = None,
+        recarga_segundos: float = 30.0
+    ):
+        self._pesos_base = pesos_base
+        self._peso_repetir = peso_repetir
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._posicion: Dict[int, int] = {}
+        self._pesos = np.zeros((0, len(RASGOS)), dtype=np.float32)
+        self._tfidf = IndiceTfidf()
+        self._peso_repetir_actual = peso_repetir
+        self._experiencias: list = []
+        self._firma: Optional[tuple] = None
+        # Artefacto entrenado (pesos con memory-map, metadatos); None = solo PESOS_BASE
+        self._modelo: Optional[Tuple[np.ndarray, dict]] = None
+        self._directorio = directorio_modelos
+        self._recarga_segundos = recarga_segundos
+        self._proxima_revision = 0.0
+        self._mtime_puntero: Optional[int] = None
+        self.version_modelo: Optional[int] = None
+        # Sube cuando cambia la matriz (contenido del catálogo o pesos nuevos); sirve de clave de caché
+        self.version = 0
+        self.recargar_modelo(forzar=True)
+
+    @property
+    def listo(self) -> bool:
+        return len(self._ids) > 0
+
+    def matriz(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids de experiencia, pesos) en uso, fila a fila."""
+        return self._ids, self._pesos
+
+    @staticmethod
+    def firma_catalogo(experiencias: Iterable) -> tuple:
+        """Lo que del catálogo entra en la matriz y en el índice TF-IDF."""
+        return tuple(sorted(
+            (e.Id, bool(e.Activa), e.Nombre, e.Descripcion or "", e.PalabrasClave or "") for e in experiencias
+        ))
+
+    def construir(self, experiencias: Iterable, forzar: bool = False) -> bool:
+        """
+        Precalcula la matriz de pesos para las experiencias activas del catálogo:
+        PESOS_BASE, sustituidos por los del artefacto entrenado para las experiencias
+        y rasgos que este conozca (una experiencia nueva conserva sus pesos base).
+        Si el catálogo no cambió desde la última vez (misma firma) no hace nada, así
+        que la versión, y con ella la caché de respuestas, sobrevive a las recargas
+        del catálogo; forzar=True reconstruye igual (pesos nuevos). Devuelve True si
+        reconstruyó.
+        """
+        experiencias = list(experiencias)
+        firma = self.firma_catalogo(experiencias)
+        if not forzar and firma == self._firma:
+            return False
+        self._experiencias = experiencias
+        activas = sorted((e.Id for e in self._experiencias if e.Activa))
+        pesos = np.zeros((len(activas), len(RASGOS)), dtype=np.float32)
+        for fila, experiencia_id in enumerate(activas):
+            for rasgo, peso in self._pesos_base.get(experiencia_id, {}).items():
+                if rasgo in INDICE_RASGO:
+                    pesos[fila, INDICE_RASGO[rasgo]] = peso
+
+        peso_repetir = self._peso_repetir
+        if self._modelo is not None:
+            entrenados, metadatos = self._modelo
+            origen = [i for i, r in enumerate(metadatos["rasgos"]) if r in INDICE_RASGO]
+            destino = [INDICE_RASGO[metadatos["rasgos"][i]] for i in origen]
+            fila_modelo = {e: i for i, e in enumerate(metadatos["experiencia_ids"])}
+            for fila, experiencia_id in enumerate(activas):
+                if experiencia_id in fila_modelo:
+                    pesos[fila, destino] = entrenados[fila_modelo[experiencia_id], origen]
+            peso_repetir = metadatos.get("peso_repetir", peso_repetir)
+
+        # Un documento por experiencia activa, en el mismo orden que las filas de pesos
+        por_id = {e.Id: e for e in self._experiencias}
+        tfidf = IndiceTfidf()
+        tfidf.construir(
+            (e, f"{por_id[e].Nombre} {por_id[e].Descripcion or ''} {por_id[e].PalabrasClave or ''}")
+            for e in activas
+        )
+
+        # Se reemplaza todo de una vez: una petición en curso ve la matriz vieja o la nueva
+        self._ids, self._posicion, self._pesos, self._tfidf, self._peso_repetir_actual = (
+            np.array(activas, dtype=np.int64), {e: i for i, e in enumerate(activas)}, pesos, tfidf, peso_repetir
+        )
+        self._firma = firma
+        self.version += 1
+        return True
+
+    def recargar_modelo(self, forzar: bool = False) -> bool:
+        """
+        Carga la versión de pesos a la que apunta actual.json si el puntero cambió.
+        Sin forzar, mira el puntero como mucho una vez cada `recarga_segundos`, así
+        que se puede llamar en cada petición. Si la versión nueva no se puede leer
+        se sigue con la anterior. Devuelve True si cambió el modelo.
+        """
+        if not self._directorio:
+            return False
+        ahora = time.monotonic()
+        if not forzar and ahora < self._proxima_revision:
+            return False
+        self._proxima_revision = ahora + self._recarga_segundos
+        try:
+            mtime = os.stat(os.path.join(self._directorio, ARCHIVO_PUNTERO)).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime_puntero:
+            return False
+        try:
+            modelo = cargar_artefacto(self._directorio)
+        except Exception:
+            traceback.print_exc()
+            return False
+        self._mtime_puntero = mtime
+        self._modelo = modelo
+        self.version_modelo = modelo[1]["version"]
+        if self._experiencias:
+            self.construir(self._experiencias, forzar=True)
+        return True
+
+    def metricas(self) -> dict:
+        metadatos = self._modelo[1] if self._modelo is not None else {}
+        return {
+            "experiencias": len(self._ids),
+            "version": self.version,
+            "version_modelo": self.version_modelo,
+            "entrenado_en": metadatos.get("entrenado_en"),
+            "muestras": metadatos.get("muestras")
+        }
+
+    def vectorizar(self, rasgos: Iterable[str]) -> np.ndarray:
+        x = np.zeros(len(RASGOS), dtype=np.float32)
+        x[[INDICE_RASGO[r] for r in rasgos]] = 1.0
+        return x
+
+    def similitudes_texto(self, texto: Optional[str]) -> np.ndarray:
+        """Similitud TF-IDF del texto con cada experiencia activa (ceros si no comparte términos)."""
+        similitud = self._tfidf.similitudes(texto)
+        return similitud if similitud is not None else np.zeros(len(self._ids), dtype=np.float32)
+
+    def puntuar(
+        self,
+        x: np.ndarray,
+        visitas: Optional[Dict[int, int]] = None,
+        similitud_texto: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Puntaje de cada experiencia activa (en el orden de self._ids) para el vector x.
+           x también puede ser una matriz (n x rasgos): devuelve (n x experiencias)."""
+        puntajes = x @ self._pesos.T
+        if visitas:
+            repetidas = np.zeros(len(self._ids), dtype=np.float32)
+            for experiencia_id, n in visitas.items():
+                if experiencia_id in self._posicion:
+                    repetidas[self._posicion[experiencia_id]] = n
+            puntajes = puntajes + self._peso_repetir_actual * repetidas
+        if similitud_texto is not None:
+            puntajes = puntajes + PESO_TEXTO * similitud_texto
+        return puntajes
+
+    def recomendar(
+        self,
+        rasgos: List[str],
+        historial: Iterable[int] = (),
+        top: int = 3,
+        texto: Optional[str] = None
+    ) -> List[dict]:
+        """Ranking de experiencias con el puntaje y los rasgos que más pesaron a favor y en contra.
+           `texto` (las respuestas tal cual) suma su similitud TF-IDF con cada experiencia."""
+        ids, pesos, tfidf = self._ids, self._pesos, self._tfidf
+        if not len(ids):
+            return []
+        visitas: Dict[int, int] = {}
+        for experiencia_id in historial:
+            visitas[experiencia_id] = visitas.get(experiencia_id, 0) + 1
+
+        x = self.vectorizar(rasgos)
+        similitud_texto = tfidf.similitudes(texto)
+        puntajes = self.puntuar(x, visitas, similitud_texto)
+        orden = np.argsort(-puntajes, kind="stable")[:top]
+
+        ranking = []
+        for fila in orden:
+            contribuciones = pesos[fila] * x
+            a_favor = [i for i in np.argsort(-contribuciones) if contribuciones[i] > 0][:3]
+            en_contra = [i for i in np.argsort(contribuciones) if contribuciones[i] < 0][:2]
+            experiencia_id = int(ids[fila])
+            razones = [ETIQUETAS_RASGO.get(RASGOS[i], RASGOS[i]) for i in a_favor]
+            if similitud_texto is not None and PESO_TEXTO * similitud_texto[fila] >= MINIMO_RAZON_TEXTO:
+                palabras = tfidf.coincidencias(texto, experiencia_id)
+                razones.insert(0, f"encaja con lo que buscas ({', '.join(palabras)})")
+            razones_contra = [ETIQUETAS_RASGO.get(RASGOS[i], RASGOS[i]) for i in en_contra]
+            if visitas.get(experiencia_id):
+                razones_contra.append("ya la visitaste")
+            ranking.append({
+                "experiencia_id": experiencia_id,
+                "puntaje": round(float(puntajes[fila]), 3),
+                "razones": razones[:3],
+                "en_contra": razones_contra
+            })
+        return ranking
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional, List, Dict, Any
+from pydantic import BaseModel, EmailStr, Field
+from typing import Optional, List, Dict, Any, Literal
 from datetime import datetime
 
 # --- Esquemas para el Chat ---
@@ -35,4 +35,50 @@ class CrearReservaSchema(BaseModel):
     experiencia_id: int
     fecha_hora: datetime
     restricciones_adicionales: Optional[str] = None
-    user_id: Optional[int] = None # ID del usuario si ya existe
\ No newline at end of file
+    user_id: Optional[int] = None # ID del usuario si ya existe
+
+# --- Esquemas para la sincronización con el CRM ---
+
+# Una línea del NDJSON de importación/exportación de usuarios
+class UsuarioSyncSchema(BaseModel):
+    nombre: str = Field(min_length=1, max_length=150)
+    email: EmailStr = Field(max_length=256)
+    firebase_uid: Optional[str] = Field(default=None, max_length=200)
+    perfil: Optional[PerfilAlimentarioSchema] = None # Si no viene, no se toca el perfil
+
+class ImportacionResultadoSchema(BaseModel):
+    procesadas: int
+    insertadas: int
+    actualizadas: int
+    invalidas: int
+    errores: List[Dict[str, Any]] # Primeros errores: {"linea": n, "error": "..."}
+    segundos: float
+    filas_por_segundo: float
+
+# --- Esquemas para la búsqueda de reservas (staff) ---
+
+# Proyección ligera: solo las columnas que muestra el listado
+class ReservaResumenSchema(BaseModel):
+    id: int
+    fecha_hora: datetime
+    estado: str
+    experiencia_id: int
+    num_comensales: int
+    nombre_reserva: str
+    usuario_id: Optional[int] = None
+
+class PaginaReservasSchema(BaseModel):
+    items: List[ReservaResumenSchema]
+    siguiente_cursor: Optional[str] = None # None = no hay más páginas
+
+# Cambio de estado en bloque (staff)
+class CambioEstadoReservasSchema(BaseModel):
+    accion: Literal["confirmar", "cancelar", "no_show", "completar"]
+    reserva_ids: List[int] = Field(min_length=1, max_length=1000) # Un UPDATE por petición
+
+class CambioEstadoResultadoSchema(BaseModel):
+    accion: str
+    estado: str
+    actualizadas: int
+    reserva_ids: List[int]
+    no_aplicables: List[int]
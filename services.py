@@ -1,19 +1,393 @@
 import google.generativeai as genai
+import asyncio
+import base64
+import hashlib
 import json
 import traceback
-from sqlalchemy import func
+from collections import deque
+from sqlalchemy import func, insert, update, delete, bindparam, and_, or_, case, cast, null, union_all, String
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import joinedload
-from datetime import datetime
+from datetime import datetime, date, time, timedelta
+from typing import Callable, Dict, List, Optional
 import models
 import schemas
-from database import settings
+from cache import CacheLRU
+from alergenos import codigos_alergenos, normalizar_texto
+from disponibilidad import MotorDisponibilidad, SinCupoError, MINUTOS_TURNO
+from recomendador import Recomendador, rasgos_de_entrada
+from similares import IndiceClientesSimilares
+from tfidf import terminos
+from database import settings, AsyncSessionFactory, enrutador_lecturas, construir_upsert, soporta_returning, soporta_update_returning
 from tools import chatbot_tools
 
 # Configurar el cliente de Gemini
 genai.configure(api_key=settings.GOOGLE_API_KEY)
 
+# --- Sentencias precompiladas para las consultas frecuentes ---
+# Se construyen una sola vez al importar el módulo y se ejecutan con parámetros
+# enlazados: cada llamada reutiliza el mismo objeto y su SQL compilado (caché de
+# compilación de SQLAlchemy; en asyncpg además como prepared statement).
+_SELECT_CATALOGO = select(models.Experiencia)
+
+_SELECT_EXPERIENCIA = select(models.Experiencia).where(models.Experiencia.Id == bindparam("experiencia_id"))
+
+_SELECT_CONTEXTO_USUARIO = (
+    select(models.Usuario)
+    .options(
+        joinedload(models.Usuario.preferencias),
+        joinedload(models.Usuario.reservas)
+    )
+    .where(models.Usuario.Id == bindparam("user_id"))
+)
+
+_SELECT_PREFERENCIA_USUARIO = select(models.Preferencia).where(models.Preferencia.UsuarioId == bindparam("user_id"))
+
+_SELECT_PERFIL_VERSIONADO = (
+    select(models.Preferencia.Id, models.Preferencia.DatosJson, models.Preferencia.Version)
+    .where(models.Preferencia.UsuarioId == bindparam("user_id"))
+)
+
+# Actualización optimista: solo escribe si Version sigue siendo la que se leyó, y la incrementa.
+_UPDATE_PERFIL_VERSIONADO = (
+    update(models.Preferencia)
+    .where(
+        models.Preferencia.Id == bindparam("preferencia_id"),
+        models.Preferencia.Version == bindparam("version_leida")
+    )
+    .values(
+        DatosJson=bindparam("datos_json"),
+        Version=models.Preferencia.Version + 1,
+        ActualizadoEn=func.now()
+    )
+    .execution_options(synchronize_session=False)
+)
+
+_SELECT_USUARIO_EXISTE = select(models.Usuario.Id).where(models.Usuario.Id == bindparam("user_id"))
+
+_INSERT_RESERVA = insert(models.Reserva).returning(models.Reserva.Id)
+
+# INSERT ... ON CONFLICT DO UPDATE en PostgreSQL/SQLite; None en SQL Server.
+_UPSERT_PREFERENCIA = construir_upsert(
+    models.Preferencia, ["UsuarioId"], ["DatosJson", "ActualizadoEn"], incrementar=("Version",)
+)
+
+_DELETE_ETIQUETAS_USUARIO = (
+    delete(models.PerfilEtiqueta)
+    .where(models.PerfilEtiqueta.UsuarioId == bindparam("user_id"))
+    .execution_options(synchronize_session=False)
+)
+
+_INSERT_ETIQUETAS = insert(models.PerfilEtiqueta)
+
+_INSERT_RESERVA_ALERGENOS = insert(models.ReservaAlergeno)
+
+_SELECT_RESERVA_POR_CLAVE = (
+    select(models.ReservaIdempotencia.ReservaId, models.Reserva.Estado)
+    .join(models.Reserva, models.Reserva.Id == models.ReservaIdempotencia.ReservaId)
+    .where(models.ReservaIdempotencia.Clave == bindparam("clave"))
+)
+
+_DELETE_CLAVE_IDEMPOTENCIA = (
+    delete(models.ReservaIdempotencia)
+    .where(models.ReservaIdempotencia.Clave == bindparam("clave"))
+    .execution_options(synchronize_session=False)
+)
+
+_INSERT_CLAVE_IDEMPOTENCIA = insert(models.ReservaIdempotencia)
+
+# Solicitud que el usuario ya tiene esperando para ese horario (a lo sumo una: UX_ListaEspera_Esperando)
+_SELECT_ESPERA_ACTIVA = (
+    select(models.ListaEspera.Id, models.ListaEspera.Prioridad)
+    .where(
+        models.ListaEspera.UsuarioId == bindparam("user_id"),
+        models.ListaEspera.ExperienciaId == bindparam("experiencia_id"),
+        models.ListaEspera.FechaHora == bindparam("fecha_hora"),
+        models.ListaEspera.Estado == 'esperando'
+    )
+)
+
+# Resumen OcupacionDiaria: incremento atómico por (Fecha, ExperienciaId, HoraTurno).
+# En PostgreSQL/SQLite un upsert que suma; en SQL Server UPDATE y, si no había fila, INSERT.
+_UPSERT_OCUPACION = construir_upsert(
+    models.OcupacionDiaria, ["Fecha", "ExperienciaId", "HoraTurno"], ["Comensales", "Reservas"], sumar=True
+)
+
+def _sumar_sin_negativos(columna, parametro: str):
+    # Una reserva anterior al resumen no está contada: al cancelarla el turno queda en 0, no en negativo
+    nuevo = columna + bindparam(parametro)
+    return case((nuevo > 0, nuevo), else_=0)
+
+# UPDATE de Core (no ORM) para poder ejecutarlo en lote con una lista de turnos
+_UPDATE_OCUPACION = (
+    update(models.OcupacionDiaria.__table__)
+    .where(
+        models.OcupacionDiaria.Fecha == bindparam("fecha"),
+        models.OcupacionDiaria.ExperienciaId == bindparam("experiencia_id"),
+        models.OcupacionDiaria.HoraTurno == bindparam("hora_turno")
+    )
+    .values(
+        Comensales=_sumar_sin_negativos(models.OcupacionDiaria.Comensales, "comensales"),
+        Reservas=_sumar_sin_negativos(models.OcupacionDiaria.Reservas, "reservas")
+    )
+)
+
+_INSERT_OCUPACION = insert(models.OcupacionDiaria)
+
+# Cambios de estado en bloque: un UPDATE por acción, limitado a los estados de origen
+# permitidos (una reserva ya cancelada no pasa a completada). La lista de Ids se expande
+# en el IN al ejecutar; se devuelven las filas cambiadas para invalidar cachés y cupo.
+_COLUMNAS_TRANSICION = (
+    models.Reserva.Id, models.Reserva.UsuarioId, models.Reserva.ExperienciaId,
+    models.Reserva.FechaHora, models.Reserva.NumComensales
+)
+
+def _filtro_transicion(origen: tuple):
+    return and_(
+        models.Reserva.Id.in_(bindparam("reserva_ids", expanding=True)),
+        models.Reserva.Estado.in_(origen)
+    )
+
+_SELECT_TRANSICION = {
+    accion: select(*_COLUMNAS_TRANSICION).where(_filtro_transicion(origen))
+    for accion, (origen, _) in models.TRANSICIONES_RESERVA.items()
+}
+
+_UPDATE_TRANSICION = {
+    accion: (
+        update(models.Reserva)
+        .where(_filtro_transicion(origen))
+        .values(Estado=destino, ActualizadoEn=func.now())
+        .execution_options(synchronize_session=False)
+    )
+    for accion, (origen, destino) in models.TRANSICIONES_RESERVA.items()
+}
+
+# Búsqueda de reservas: proyección ligera (sin cargar entidades ORM)
+_COLUMNAS_BUSQUEDA_RESERVAS = (
+    models.Reserva.Id, models.Reserva.FechaHora, models.Reserva.Estado, models.Reserva.ExperienciaId,
+    models.Reserva.NumComensales, models.Reserva.NombreReserva, models.Reserva.UsuarioId
+)
+
+# Reporte de cocina: reservas de un turno (fecha + experiencia) con las alergias/restricciones
+# del perfil de quien reserva y las de la propia reserva, en una sola consulta (UNION ALL).
+_FILTRO_TURNO = (
+    models.Reserva.ExperienciaId == bindparam("experiencia_id"),
+    models.Reserva.FechaHora >= bindparam("desde"),
+    models.Reserva.FechaHora < bindparam("hasta"),
+    models.Reserva.Estado.in_(models.ESTADOS_QUE_OCUPAN)
+)
+_COLUMNAS_RESERVA_COCINA = (
+    models.Reserva.Id.label("reserva_id"),
+    models.Reserva.NombreReserva,
+    models.Reserva.NumComensales,
+    models.Reserva.FechaHora,
+    models.Reserva.Restricciones
+)
+_SELECT_REPORTE_COCINA = union_all(
+    select(
+        *_COLUMNAS_RESERVA_COCINA,
+        models.PerfilEtiqueta.Valor.label("valor"),
+        models.PerfilEtiqueta.Codigo.label("codigo")
+    )
+    .outerjoin(
+        models.PerfilEtiqueta,
+        and_(
+            models.PerfilEtiqueta.UsuarioId == models.Reserva.UsuarioId,
+            models.PerfilEtiqueta.Tipo.in_(("alergia", "restriccion"))
+        )
+    )
+    .where(*_FILTRO_TURNO),
+    select(
+        *_COLUMNAS_RESERVA_COCINA,
+        cast(null(), String(150)).label("valor"),
+        models.ReservaAlergeno.Codigo.label("codigo")
+    )
+    .join(models.ReservaAlergeno, models.ReservaAlergeno.ReservaId == models.Reserva.Id)
+    .where(*_FILTRO_TURNO)
+)
+
+def etiquetas_de_perfil(user_id: int, perfil: dict) -> list:
+    """Convierte un perfil alimentario (dict de listas) en filas de PerfilEtiquetas, sin duplicados.
+       Las alergias y restricciones llevan su código canónico (una fila por código reconocido)."""
+    filas = []
+    for clave, tipo in models.TIPOS_ETIQUETA.items():
+        vistos = set()
+        for valor in perfil.get(clave) or []:
+            if not isinstance(valor, str):
+                continue
+            valor = valor.strip().lower()[:150]
+            if not valor:
+                continue
+            codigos = codigos_alergenos(valor) if tipo in ("alergia", "restriccion") else set()
+            for codigo in sorted(codigos) or [None]:
+                if (valor, codigo) not in vistos:
+                    vistos.add((valor, codigo))
+                    filas.append({"UsuarioId": user_id, "Tipo": tipo, "Valor": valor, "Codigo": codigo})
+    return filas
+
+def aplicar_patch_perfil(perfil: dict, agregar: dict, quitar: dict) -> dict:
+    """
+    Aplica altas y bajas por lista (alergias, restricciones, disgustos, gustos) a un perfil.
+    Las comparaciones ignoran mayúsculas y tildes ("Maní" quita "mani"). Devuelve un perfil nuevo.
+    """
+    nuevo = {clave: valor for clave, valor in perfil.items() if clave not in models.TIPOS_ETIQUETA}
+    for clave in models.TIPOS_ETIQUETA:
+        a_quitar = {normalizar_texto(v) for v in quitar.get(clave) or []}
+        lista = [v for v in perfil.get(clave) or [] if isinstance(v, str) and normalizar_texto(v) not in a_quitar]
+        presentes = {normalizar_texto(v) for v in lista}
+        for valor in agregar.get(clave) or []:
+            valor = valor.strip()
+            normalizado = normalizar_texto(valor)
+            if valor and normalizado not in presentes:
+                lista.append(valor)
+                presentes.add(normalizado)
+        if lista or clave in perfil:
+            nuevo[clave] = lista
+    return nuevo
+
+def _listas_de_args(valor) -> dict:
+    """Convierte un MapComposite de listas (args anidados de Gemini) en un dict de listas de str."""
+    if not valor:
+        return {}
+    return {clave: [str(v) for v in lista] for clave, lista in dict(valor).items() if lista}
+
+def alergenos_de_reserva(reserva_id: int, restricciones: Optional[str]) -> list:
+    """Filas de ReservaAlergenos para el texto libre de Reserva.Restricciones."""
+    return [{"ReservaId": reserva_id, "Codigo": codigo} for codigo in sorted(codigos_alergenos(restricciones or ""))]
+
+def codificar_cursor(fecha_hora: datetime, reserva_id: int) -> str:
+    """Cursor opaco de la búsqueda de reservas: la clave (FechaHora, Id) de la última fila."""
+    crudo = json.dumps([fecha_hora.isoformat(), reserva_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(crudo.encode()).decode().rstrip("=")
+
+def decodificar_cursor(cursor: str) -> tuple:
+    """Inverso de codificar_cursor. Lanza ValueError si el cursor no es válido."""
+    try:
+        crudo = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        fecha_hora, reserva_id = json.loads(crudo)
+        return datetime.fromisoformat(fecha_hora), int(reserva_id)
+    except Exception as e:
+        raise ValueError(f"Cursor inválido: {cursor}") from e
+
+def turno_ocupacion(fecha_hora: datetime) -> tuple:
+    """(Fecha, HoraTurno) del resumen OcupacionDiaria: el inicio redondeado al turno de 15 min."""
+    minutos = (fecha_hora.hour * 60 + fecha_hora.minute) // MINUTOS_TURNO * MINUTOS_TURNO
+    return fecha_hora.date(), time(minutos // 60, minutos % 60)
+
+async def actualizar_ocupacion_diaria(db: AsyncSession, reservas: list, signo: int):
+    """
+    Suma (signo=1) o resta (signo=-1) reservas al resumen OcupacionDiaria, sin commit:
+    debe ir en la misma transacción que el cambio en Reservas. Cada reserva es una fila o
+    tupla (FechaHora, ExperienciaId, NumComensales); se agrupan por turno antes de escribir.
+    Restar nunca crea filas ni deja valores negativos: las reservas anteriores al resumen
+    no estaban contadas (las recupera `python jobs.py reconciliar-ocupacion --corregir`).
+    """
+    deltas: Dict[tuple, list] = {}
+    for fecha_hora, experiencia_id, comensales in reservas:
+        delta = deltas.setdefault((*turno_ocupacion(fecha_hora), experiencia_id), [0, 0])
+        delta[0] += signo * (comensales or 0)
+        delta[1] += signo
+    if not deltas:
+        return
+
+    parametros = [
+        {"fecha": fecha, "hora_turno": hora, "experiencia_id": experiencia_id, "comensales": c, "reservas": r}
+        for (fecha, hora, experiencia_id), (c, r) in deltas.items()
+    ]
+    if signo < 0:
+        await db.execute(_UPDATE_OCUPACION, parametros)
+        return
+    if _UPSERT_OCUPACION is not None:
+        await db.execute(_UPSERT_OCUPACION, [
+            {"Fecha": p["fecha"], "HoraTurno": p["hora_turno"], "ExperienciaId": p["experiencia_id"],
+             "Comensales": p["comensales"], "Reservas": p["reservas"]}
+            for p in parametros
+        ])
+        return
+    for p in parametros:
+        result = await db.execute(_UPDATE_OCUPACION, p)
+        if result.rowcount:
+            continue
+        try:
+            # Otra transacción puede crear la fila del turno entre el UPDATE y el INSERT:
+            # el INSERT va en un savepoint y, si choca con la PK, se vuelve a sumar con UPDATE.
+            async with db.begin_nested():
+                await db.execute(_INSERT_OCUPACION, {
+                    "Fecha": p["fecha"], "HoraTurno": p["hora_turno"], "ExperienciaId": p["experiencia_id"],
+                    "Comensales": p["comensales"], "Reservas": p["reservas"]
+                })
+        except IntegrityError:
+            await db.execute(_UPDATE_OCUPACION, p)
+
+async def insertar_reserva(db: AsyncSession, valores_reserva: dict) -> int:
+    """
+    Inserta una Reserva con sus alérgenos normalizados y la suma al resumen OcupacionDiaria,
+    sin commit (el llamador admite el cupo y confirma la transacción). Devuelve el Id.
+    """
+    if soporta_returning():
+        # INSERT ... OUTPUT INSERTED.Id (RETURNING en otros motores):
+        # una sola sentencia, sin el SELECT extra de db.refresh.
+        result = await db.execute(_INSERT_RESERVA, valores_reserva)
+        reserva_id = result.scalar_one()
+    else:
+        nueva_reserva = models.Reserva(**valores_reserva)
+        db.add(nueva_reserva)
+        await db.flush()
+        reserva_id = nueva_reserva.Id
+
+    # Alérgenos de la reserva normalizados a códigos (misma transacción)
+    filas_alergenos = alergenos_de_reserva(reserva_id, valores_reserva["Restricciones"])
+    if filas_alergenos:
+        await db.execute(_INSERT_RESERVA_ALERGENOS, filas_alergenos)
+    await actualizar_ocupacion_diaria(
+        db, [(valores_reserva["FechaHora"], valores_reserva["ExperienciaId"], valores_reserva["NumComensales"])], signo=1
+    )
+    return reserva_id
+
+async def transicionar_reservas(db: AsyncSession, accion: str, reserva_ids: List[int]) -> list:
+    """
+    Aplica una transición de estado a un bloque de reservas con un solo UPDATE (sin commit).
+    Solo cambian las que están en un estado de origen válido; devuelve esas filas
+    (Id, UsuarioId, ExperienciaId, FechaHora, NumComensales).
+    """
+    if not reserva_ids:
+        return []
+    parametros = {"reserva_ids": list(reserva_ids)}
+    if soporta_update_returning():
+        result = await db.execute(_UPDATE_TRANSICION[accion].returning(*_COLUMNAS_TRANSICION), parametros)
+        filas = result.all()
+    else:
+        result = await db.execute(_SELECT_TRANSICION[accion], parametros)
+        filas = result.all()
+        if filas:
+            await db.execute(_UPDATE_TRANSICION[accion], {"reserva_ids": [f.Id for f in filas]})
+
+    # Todos los estados de origen ocupan: si el destino no, la reserva sale del resumen
+    if models.TRANSICIONES_RESERVA[accion][1] not in models.ESTADOS_QUE_OCUPAN:
+        await actualizar_ocupacion_diaria(
+            db, [(f.FechaHora, f.ExperienciaId, f.NumComensales) for f in filas], signo=-1
+        )
+    return filas
+
+def clave_idempotencia(session_id: str, operacion: str, valores: dict) -> str:
+    """sha256 de la sesión, la operación y los valores ya normalizados (JSON canónico):
+       la misma llamada repetida en la sesión produce la misma clave."""
+    canonico = json.dumps(
+        [session_id, operacion, valores],
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(canonico.encode("utf-8")).hexdigest()
+
+async def reemplazar_etiquetas_perfil(db: AsyncSession, user_id: int, perfil: dict):
+    """Reescribe las etiquetas del usuario. No hace commit: va en la transacción del llamador."""
+    await db.execute(_DELETE_ETIQUETAS_USUARIO, {"user_id": user_id})
+    filas = etiquetas_de_perfil(user_id, perfil)
+    if filas:
+        await db.execute(_INSERT_ETIQUETAS, filas)
+
 class GeminiService:
     def __init__(self):
         pass
@@ -44,12 +418,179 @@ class GeminiService:
         
         return response
 
+class RecomendacionesLogWriter:
+    """
+    Escritura diferida (write-behind) de RecomendacionesLog.
+    Las filas se acumulan en memoria y se insertan en lote (executemany)
+    cuando se llena el lote o vence el intervalo, fuera del turno del chat.
+    """
+
+    def __init__(
+        self,
+        session_factory=AsyncSessionFactory,
+        tamano_lote: int = settings.LOG_RECOMENDACIONES_LOTE,
+        intervalo_segundos: float = settings.LOG_RECOMENDACIONES_INTERVALO_SEGUNDOS,
+        max_pendientes: int = settings.LOG_RECOMENDACIONES_MAX_PENDIENTES
+    ):
+        self._session_factory = session_factory
+        self.tamano_lote = tamano_lote
+        self.intervalo_segundos = intervalo_segundos
+        self.max_pendientes = max_pendientes
+        self._pendientes: deque = deque()
+        self._lote_lleno = asyncio.Event()
+        self._cerrando = False
+        self._tarea: Optional[asyncio.Task] = None
+
+        # Métricas
+        self.escritas = 0
+        self.descartadas = 0
+        self.fallidas = 0
+        self.lotes = 0
+
+    def iniciar(self):
+        """Arranca la tarea de fondo que vacía el buffer."""
+        if self._tarea is None:
+            self._cerrando = False
+            self._tarea = asyncio.create_task(self._bucle())
+
+    def registrar(self, fila: dict) -> bool:
+        """Encola una fila sin bloquear. Si el buffer está lleno, o el writer ya se
+           detuvo y nadie la escribiría, la descarta (cuenta en `descartadas`)."""
+        if self._cerrando or len(self._pendientes) >= self.max_pendientes:
+            self.descartadas += 1
+            return False
+        fila.setdefault("CreadoEn", datetime.now())
+        self._pendientes.append(fila)
+        if len(self._pendientes) >= self.tamano_lote:
+            self._lote_lleno.set()
+        return True
+
+    async def _bucle(self):
+        while not self._cerrando:
+            try:
+                await asyncio.wait_for(self._lote_lleno.wait(), self.intervalo_segundos)
+            except asyncio.TimeoutError:
+                pass
+            self._lote_lleno.clear()
+            await self._vaciar()
+        # Apagado: lo que quede se escribe antes de salir.
+        await self._vaciar()
+
+    async def _vaciar(self):
+        while self._pendientes:
+            lote = [self._pendientes.popleft() for _ in range(min(self.tamano_lote, len(self._pendientes)))]
+            await self._escribir(lote)
+
+    async def _escribir(self, lote: list):
+        try:
+            async with self._session_factory() as db:
+                await db.execute(insert(models.RecomendacionesLog), lote)
+                await db.commit()
+            self.escritas += len(lote)
+            self.lotes += 1
+        except Exception:
+            self.fallidas += len(lote)
+            traceback.print_exc()
+
+    async def detener(self):
+        """Detiene la tarea de fondo después de escribir todo lo pendiente.
+           Desde aquí `registrar` descarta las filas (hasta otro `iniciar`)."""
+        self._cerrando = True
+        if self._tarea is None:
+            await self._vaciar()
+            return
+        self._lote_lleno.set()
+        await self._tarea
+        self._tarea = None
+
+    def metricas(self) -> dict:
+        return {
+            "pendientes": len(self._pendientes),
+            "escritas": self.escritas,
+            "descartadas": self.descartadas,
+            "fallidas": self.fallidas,
+            "lotes": self.lotes
+        }
+
 class DBService:
-    
+
+    # Reintentos de handle_actualizar_perfil ante escrituras concurrentes
+    MAX_REINTENTOS_PERFIL = 3
+    # Límites de la herramienta consultar_disponibilidad
+    MAX_DIAS_DISPONIBILIDAD = 60
+    MAX_RESULTADOS_DISPONIBILIDAD = 20
+
+    def __init__(
+        self,
+        log_writer: Optional[RecomendacionesLogWriter] = None,
+        disponibilidad: Optional[MotorDisponibilidad] = None
+    ):
+        # Si hay un writer, los logs de recomendación se escriben en diferido.
+        self._log_writer = log_writer
+        # Capacidad por franja: índice de ocupación en memoria (se carga en el arranque)
+        self.disponibilidad = disponibilidad or MotorDisponibilidad()
+        # Se llaman con (experiencia_id, día) cada vez que se libera cupo (p. ej. la lista de espera)
+        self._oyentes_cupo_liberado: List[Callable[[int, date], None]] = []
+        # Catálogo de experiencias en memoria (Id -> Experiencia), usado para validar
+        # sin consultar la BD en cada herramienta.
+        self._catalogo: Dict[int, models.Experiencia] = {}
+        # Matriz de pesos del recomendador; se reconstruye cuando cambia el contenido del
+        # catálogo y cuando se publica una versión nueva de los pesos entrenados
+        self.recomendador = Recomendador(
+            directorio_modelos=settings.RECOMENDADOR_MODELOS_DIR,
+            recarga_segundos=settings.RECOMENDADOR_RECARGA_SEGUNDOS
+        )
+        # Respuesta de recomendar_experiencia por (versión del recomendador, rasgos, historial).
+        # La versión cambia con el catálogo o los pesos, así que no hace falta TTL.
+        self.recomendacion_cache = CacheLRU(max_entradas=settings.RECOMENDACION_CACHE_MAX_ENTRADAS)
+        # Vecinos por perfil e historial; se le avisa de cada usuario que cambia
+        self.clientes_similares = IndiceClientesSimilares()
+        # Contexto ya formateado por user_id. Se actualiza/invalida en cada escritura del usuario.
+        self.contexto_cache = CacheLRU(
+            max_entradas=settings.CONTEXTO_CACHE_MAX_USUARIOS,
+            ttl_segundos=settings.CONTEXTO_CACHE_TTL_SEGUNDOS
+        )
+        # Claves de idempotencia recientes -> reserva_id (evita la consulta en los reintentos inmediatos)
+        self.idempotencia_cache = CacheLRU(
+            max_entradas=settings.IDEMPOTENCIA_CACHE_MAX_CLAVES,
+            ttl_segundos=settings.IDEMPOTENCIA_CACHE_TTL_SEGUNDOS
+        )
+        # Reporte de cocina por (fecha, experiencia_id). Se invalida cuando cambia una reserva del turno.
+        self.reporte_cocina_cache = CacheLRU(
+            max_entradas=500,
+            ttl_segundos=settings.REPORTE_COCINA_CACHE_TTL_SEGUNDOS
+        )
+
+    async def _cargar_catalogo(self, db: AsyncSession) -> Dict[int, models.Experiencia]:
+        """Recarga el catálogo completo de experiencias en memoria."""
+        result = await db.execute(_SELECT_CATALOGO)
+        self._catalogo = {exp.Id: exp for exp in result.scalars().all()}
+        self.recomendador.construir(self._catalogo.values())
+        return self._catalogo
+
+    async def get_experiencia(self, db: AsyncSession, experiencia_id: int) -> Optional[models.Experiencia]:
+        """Busca una experiencia en el catálogo en memoria.
+           Si el ID no está (una experiencia creada recientemente, o un ID inventado) se
+           busca solo esa fila por clave primaria: un ID inválido no recarga el catálogo."""
+        if not self._catalogo:
+            await self._cargar_catalogo(db)
+        experiencia = self._catalogo.get(experiencia_id)
+        if experiencia is None:
+            try:
+                experiencia_id = int(experiencia_id)
+            except (TypeError, ValueError):
+                return None
+            experiencia = (await db.execute(_SELECT_EXPERIENCIA, {"experiencia_id": experiencia_id})).scalar_one_or_none()
+            if experiencia is not None:
+                # Entra en el catálogo en memoria; el recomendador la incorpora en la próxima recarga
+                self._catalogo[experiencia.Id] = experiencia
+        return experiencia
+
     async def get_all_experiences(self, db: AsyncSession) -> str:
-        """Obtiene las 3 experiencias de la BD para dárselas al chatbot como contexto."""
-        result = await db.execute(select(models.Experiencia).where(models.Experiencia.Activa == True))
-        experiencias = result.scalars().all()
+        """Obtiene las 3 experiencias de la BD para dárselas al chatbot como contexto.
+           De paso refresca el catálogo en memoria."""
+        catalogo = await self._cargar_catalogo(db)
+        experiencias = [exp for exp in catalogo.values() if exp.Activa]
         
         experiencias_texto = "\n\n--- EXPERIENCIAS DISPONIBLES ---\n"
         for exp in experiencias:
@@ -61,18 +602,16 @@ class DBService:
         return experiencias_texto
 
     async def get_user_context(self, db: AsyncSession, user_id: int) -> dict:
-        """Obtiene los datos del usuario, su perfil y su historial para el contexto."""
+        """Obtiene los datos del usuario, su perfil y su historial para el contexto.
+           Se sirve desde la caché si el usuario no ha cambiado desde la última vez."""
         if not user_id:
             return None
+
+        contexto = self.contexto_cache.get(user_id)
+        if contexto is not None:
+            return contexto
         
-        result = await db.execute(
-            select(models.Usuario)
-            .options(
-                joinedload(models.Usuario.preferencias),
-                joinedload(models.Usuario.reservas)
-            )
-            .where(models.Usuario.Id == user_id)
-        )
+        result = await db.execute(_SELECT_CONTEXTO_USUARIO, {"user_id": user_id})
         usuario = result.scalars().first()
 
         if not usuario:
@@ -84,14 +623,256 @@ class DBService:
             "perfil_alimentario": json.loads(usuario.preferencias.DatosJson) if usuario.preferencias and usuario.preferencias.DatosJson else "Sin perfil.",
             "historial_reservas": [
                 {
-                    "fecha": r.FechaHora, 
+                    "fecha": r.FechaHora.isoformat(timespec="minutes"),
                     "experiencia_id": r.ExperienciaId, 
                     "estado": r.Estado
                 } for r in usuario.reservas if r.Estado == 'completada'
             ]
         }
+        self.contexto_cache.set(user_id, contexto)
         return contexto
 
+    def invalidar_contexto_usuario(self, user_id: Optional[int]):
+        """Descarta el contexto cacheado de un usuario (p. ej. tras un cambio de estado de sus reservas)."""
+        if user_id:
+            self.contexto_cache.invalidar(user_id)
+            self.clientes_similares.marcar(user_id)
+
+    def _actualizar_perfil_en_cache(self, user_id: int, perfil_data: dict):
+        """Write-through: si el contexto del usuario está en caché, le pone el perfil nuevo."""
+        contexto = self.contexto_cache.peek(user_id)
+        if contexto is not None:
+            self.contexto_cache.set(user_id, {**contexto, "perfil_alimentario": perfil_data})
+        self.clientes_similares.marcar(user_id)
+
+
+    async def reporte_alergenos_cocina(self, db: AsyncSession, fecha: date, experiencia_id: int) -> dict:
+        """
+        Alérgenos y restricciones de todas las reservas de un turno (fecha + experiencia),
+        agregados por código para la preparación de cocina. Se cachea por turno.
+        """
+        clave = (fecha, experiencia_id)
+        reporte = self.reporte_cocina_cache.get(clave)
+        if reporte is not None:
+            return reporte
+
+        desde = datetime.combine(fecha, datetime.min.time())
+        result = await db.execute(
+            _SELECT_REPORTE_COCINA,
+            {"experiencia_id": experiencia_id, "desde": desde, "hasta": desde + timedelta(days=1)}
+        )
+
+        reservas: Dict[int, dict] = {}
+        for fila in result:
+            detalle = reservas.get(fila.reserva_id)
+            if detalle is None:
+                detalle = reservas[fila.reserva_id] = {
+                    "reserva_id": fila.reserva_id,
+                    "nombre": fila.NombreReserva,
+                    "hora": fila.FechaHora.strftime("%H:%M"),
+                    "comensales": fila.NumComensales,
+                    "codigos": set(),
+                    "sin_reconocer": set(),
+                    "notas": fila.Restricciones
+                }
+            if fila.codigo:
+                detalle["codigos"].add(fila.codigo)
+            elif fila.valor:
+                detalle["sin_reconocer"].add(fila.valor)
+
+        # Agregación por código en memoria
+        por_codigo: Dict[str, dict] = {}
+        for detalle in reservas.values():
+            for codigo in detalle["codigos"]:
+                agregado = por_codigo.setdefault(codigo, {"codigo": codigo, "reservas": 0, "comensales": 0, "reserva_ids": []})
+                agregado["reservas"] += 1
+                agregado["comensales"] += detalle["comensales"]
+                agregado["reserva_ids"].append(detalle["reserva_id"])
+
+        detalles = sorted(reservas.values(), key=lambda d: (d["hora"], d["reserva_id"]))
+        for detalle in detalles:
+            detalle["codigos"] = sorted(detalle["codigos"])
+            detalle["sin_reconocer"] = sorted(detalle["sin_reconocer"])
+
+        reporte = {
+            "fecha": fecha.isoformat(),
+            "experiencia_id": experiencia_id,
+            "reservas": len(detalles),
+            "comensales": sum(d["comensales"] for d in detalles),
+            "alergenos": sorted(por_codigo.values(), key=lambda a: (-a["comensales"], a["codigo"])),
+            "detalle": detalles
+        }
+        self.reporte_cocina_cache.set(clave, reporte)
+        return reporte
+
+    async def buscar_reservas(
+        self,
+        db: AsyncSession,
+        desde: Optional[datetime] = None,
+        hasta: Optional[datetime] = None,
+        estados: Optional[List[str]] = None,
+        experiencia_id: Optional[int] = None,
+        usuario_id: Optional[int] = None,
+        nombre: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limite: int = 50,
+        descendente: bool = False
+    ) -> schemas.PaginaReservasSchema:
+        """
+        Búsqueda de reservas para el frontend del staff con paginación keyset sobre
+        (FechaHora, Id): cada página continúa tras la última fila de la anterior, así
+        que el coste no crece con el número de página (a diferencia de OFFSET).
+        La condición del cursor se expande con OR porque SQL Server no admite
+        comparaciones de tuplas. Lanza ValueError si el cursor no es válido.
+        """
+        condiciones = []
+        if desde is not None:
+            condiciones.append(models.Reserva.FechaHora >= desde)
+        if hasta is not None:
+            condiciones.append(models.Reserva.FechaHora < hasta)
+        if estados:
+            condiciones.append(models.Reserva.Estado.in_(estados))
+        if experiencia_id is not None:
+            condiciones.append(models.Reserva.ExperienciaId == experiencia_id)
+        if usuario_id is not None:
+            condiciones.append(models.Reserva.UsuarioId == usuario_id)
+        if nombre:
+            # LIKE 'prefijo%': aprovecha IX_Reservas_NombreReserva
+            condiciones.append(models.Reserva.NombreReserva.startswith(nombre, autoescape=True))
+        if cursor:
+            ultima_fecha, ultimo_id = decodificar_cursor(cursor)
+            if descendente:
+                condiciones.append(or_(
+                    models.Reserva.FechaHora < ultima_fecha,
+                    and_(models.Reserva.FechaHora == ultima_fecha, models.Reserva.Id < ultimo_id)
+                ))
+            else:
+                condiciones.append(or_(
+                    models.Reserva.FechaHora > ultima_fecha,
+                    and_(models.Reserva.FechaHora == ultima_fecha, models.Reserva.Id > ultimo_id)
+                ))
+
+        orden = (
+            (models.Reserva.FechaHora.desc(), models.Reserva.Id.desc()) if descendente
+            else (models.Reserva.FechaHora, models.Reserva.Id)
+        )
+        # Se pide una fila de más para saber si hay página siguiente
+        result = await db.execute(
+            select(*_COLUMNAS_BUSQUEDA_RESERVAS)
+            .where(*condiciones)
+            .order_by(*orden)
+            .limit(limite + 1)
+        )
+        filas = result.all()
+        hay_mas = len(filas) > limite
+        filas = filas[:limite]
+
+        return schemas.PaginaReservasSchema(
+            items=[
+                schemas.ReservaResumenSchema(
+                    id=f.Id, fecha_hora=f.FechaHora, estado=f.Estado, experiencia_id=f.ExperienciaId,
+                    num_comensales=f.NumComensales, nombre_reserva=f.NombreReserva, usuario_id=f.UsuarioId
+                )
+                for f in filas
+            ],
+            siguiente_cursor=codificar_cursor(filas[-1].FechaHora, filas[-1].Id) if hay_mas else None
+        )
+
+    async def ocupacion(
+        self,
+        db: AsyncSession,
+        desde: date,
+        hasta: date,
+        experiencia_id: Optional[int] = None,
+        por_turno: bool = False
+    ) -> List[dict]:
+        """
+        Comensales y reservas por día (o por turno) en [desde, hasta), leídos del resumen
+        OcupacionDiaria: el coste depende del número de días, no del tamaño de Reservas.
+        """
+        tabla = models.OcupacionDiaria
+        condiciones = [tabla.Fecha >= desde, tabla.Fecha < hasta, tabla.Reservas > 0]
+        if experiencia_id is not None:
+            condiciones.append(tabla.ExperienciaId == experiencia_id)
+
+        if por_turno:
+            result = await db.execute(
+                select(tabla.Fecha, tabla.ExperienciaId, tabla.HoraTurno, tabla.Comensales, tabla.Reservas)
+                .where(*condiciones)
+                .order_by(tabla.Fecha, tabla.ExperienciaId, tabla.HoraTurno)
+            )
+            return [
+                {
+                    "fecha": f.Fecha.isoformat(), "experiencia_id": f.ExperienciaId,
+                    "hora": f.HoraTurno.strftime("%H:%M"), "comensales": f.Comensales, "reservas": f.Reservas
+                }
+                for f in result
+            ]
+
+        result = await db.execute(
+            select(
+                tabla.Fecha, tabla.ExperienciaId,
+                func.sum(tabla.Comensales).label("comensales"), func.sum(tabla.Reservas).label("reservas")
+            )
+            .where(*condiciones)
+            .group_by(tabla.Fecha, tabla.ExperienciaId)
+            .order_by(tabla.Fecha, tabla.ExperienciaId)
+        )
+        return [
+            {"fecha": f.Fecha.isoformat(), "experiencia_id": f.ExperienciaId, "comensales": f.comensales, "reservas": f.reservas}
+            for f in result
+        ]
+
+    def invalidar_reporte_cocina(self, fecha_hora: datetime, experiencia_id: int):
+        """Descarta el reporte cacheado del turno al que pertenece una reserva."""
+        self.reporte_cocina_cache.invalidar((fecha_hora.date(), experiencia_id))
+
+    def suscribir_cupo_liberado(self, oyente: Callable[[int, date], None]):
+        self._oyentes_cupo_liberado.append(oyente)
+
+    def despues_de_transicion(self, accion: str, filas: list):
+        """Mantiene cachés, reportes y cupo al día tras confirmar un cambio de estado en bloque."""
+        libera_cupo = models.TRANSICIONES_RESERVA[accion][1] not in models.ESTADOS_QUE_OCUPAN
+        if libera_cupo and filas:
+            # Una reserva que ya no ocupa deja de contar como duplicado de su clave
+            liberadas = {f.Id for f in filas}
+            self.idempotencia_cache.invalidar_donde(lambda _, reserva_id: reserva_id in liberadas)
+        for fila in filas:
+            enrutador_lecturas.registrar_escritura(fila.UsuarioId)
+            self.invalidar_contexto_usuario(fila.UsuarioId)
+            self.invalidar_reporte_cocina(fila.FechaHora, fila.ExperienciaId)
+            if libera_cupo:
+                self.disponibilidad.liberar(fila.ExperienciaId, fila.FechaHora, fila.NumComensales)
+                for oyente in self._oyentes_cupo_liberado:
+                    oyente(fila.ExperienciaId, fila.FechaHora.date())
+
+    async def cambiar_estado_reservas(self, db: AsyncSession, accion: str, reserva_ids: List[int]) -> dict:
+        """Transición de estado en bloque pedida por el staff (confirmar, cancelar, no_show, completar)."""
+        async with self.disponibilidad.transicion():
+            try:
+                filas = await transicionar_reservas(db, accion, reserva_ids)
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+            self.despues_de_transicion(accion, filas)
+
+        cambiadas = {f.Id for f in filas}
+        return {
+            "accion": accion,
+            "estado": models.TRANSICIONES_RESERVA[accion][1],
+            "actualizadas": len(cambiadas),
+            "reserva_ids": sorted(cambiadas),
+            # No existen o no estaban en un estado de origen válido
+            "no_aplicables": sorted(set(reserva_ids) - cambiadas)
+        }
+
+    def _despues_de_guardar_perfil(self, user_id: int, perfil_data: dict):
+        """Mantiene réplica, cachés y reportes al día tras confirmar un cambio de perfil."""
+        enrutador_lecturas.registrar_escritura(user_id)
+        self._actualizar_perfil_en_cache(user_id, perfil_data)
+        # El perfil entra en los reportes de cocina de todas sus reservas.
+        self.reporte_cocina_cache.limpiar()
 
     async def handle_guardar_perfil(self, db: AsyncSession, user_id: int, args: dict) -> dict:
         """Lógica para la herramienta 'guardar_perfil_alimentario'.
@@ -110,28 +891,41 @@ class DBService:
             # Convertir el diccionario limpio a un string JSON para guardarlo en la BD.
             datos_str = json.dumps(perfil_data)
 
-            # Buscar una preferencia existente para este usuario.
-            result = await db.execute(select(models.Preferencia).where(models.Preferencia.UsuarioId == user_id))
-            preferencia = result.scalars().first()
-
-            if preferencia:
-                # Si existe, actualizarla.
-                preferencia.DatosJson = datos_str
-                preferencia.ActualizadoEn = func.now()
+            if _UPSERT_PREFERENCIA is not None:
+                # Upsert nativo: una sola sentencia.
+                await db.execute(
+                    _UPSERT_PREFERENCIA,
+                    {"UsuarioId": user_id, "DatosJson": datos_str, "ActualizadoEn": datetime.now()}
+                )
             else:
-                # Si no existe, crear una nueva.
-                # Asegurarse de que el usuario existe para evitar errores de FK.
-                user_result = await db.execute(select(models.Usuario.Id).where(models.Usuario.Id == user_id))
-                if not user_result.scalars().first():
-                    return {"status": "error", "message": f"Error crítico: El usuario con ID {user_id} no existe."}
+                # Buscar una preferencia existente para este usuario.
+                result = await db.execute(_SELECT_PREFERENCIA_USUARIO, {"user_id": user_id})
+                preferencia = result.scalars().first()
 
-                preferencia = models.Preferencia(
-                    UsuarioId=user_id,
-                    DatosJson=datos_str
-                )
-                db.add(preferencia)
+                if preferencia:
+                    # Si existe, actualizarla.
+                    preferencia.DatosJson = datos_str
+                    preferencia.ActualizadoEn = func.now()
+                    # Invalida las lecturas en curso de actualizar_perfil_alimentario
+                    preferencia.Version = models.Preferencia.Version + 1
+                else:
+                    # Si no existe, crear una nueva.
+                    # Asegurarse de que el usuario existe para evitar errores de FK.
+                    user_result = await db.execute(_SELECT_USUARIO_EXISTE, {"user_id": user_id})
+                    if not user_result.scalars().first():
+                        return {"status": "error", "message": f"Error crítico: El usuario con ID {user_id} no existe."}
+
+                    preferencia = models.Preferencia(
+                        UsuarioId=user_id,
+                        DatosJson=datos_str
+                    )
+                    db.add(preferencia)
+
+            # Etiquetas normalizadas, en la misma transacción que DatosJson.
+            await reemplazar_etiquetas_perfil(db, user_id, perfil_data)
 
             await db.commit()
+            self._despues_de_guardar_perfil(user_id, perfil_data)
             
             return {
                 "status": "exito", 
@@ -139,14 +933,110 @@ class DBService:
                 "user_id": user_id
             }
 
+        except IntegrityError:
+            # Con upsert nativo, un usuario inexistente llega como violación de FK.
+            await db.rollback()
+            return {"status": "error", "message": f"Error crítico: El usuario con ID {user_id} no existe."}
+
         except Exception as e:
             await db.rollback()
             traceback.print_exc()
             return {"status": "error", "message": f"Error al guardar el perfil: {e}"}
 
-    async def handle_crear_reserva(self, db: AsyncSession, user_id: int, args: dict) -> dict:
+    async def handle_actualizar_perfil(self, db: AsyncSession, user_id: int, args: dict) -> dict:
+        """Lógica para la herramienta 'actualizar_perfil_alimentario'.
+           Aplica altas/bajas sobre el perfil guardado con concurrencia optimista:
+           si otro cambio llegó entre la lectura y la escritura, se vuelve a intentar."""
+        try:
+            agregar = _listas_de_args(args.get('agregar'))
+            quitar = _listas_de_args(args.get('quitar'))
+            if not agregar and not quitar:
+                return {"status": "info", "message": "No se indicó ningún cambio en el perfil."}
+
+            for _ in range(self.MAX_REINTENTOS_PERFIL):
+                result = await db.execute(_SELECT_PERFIL_VERSIONADO, {"user_id": user_id})
+                fila = result.first()
+                perfil_actual = json.loads(fila.DatosJson) if fila and fila.DatosJson else {}
+                perfil_nuevo = aplicar_patch_perfil(perfil_actual, agregar, quitar)
+
+                if perfil_nuevo == perfil_actual:
+                    # Nada que escribir.
+                    await db.rollback()
+                    return {
+                        "status": "exito",
+                        "message": "El perfil ya estaba así, no hubo cambios.",
+                        "perfil": perfil_actual
+                    }
+
+                datos_str = json.dumps(perfil_nuevo)
+                if fila is None:
+                    user_result = await db.execute(_SELECT_USUARIO_EXISTE, {"user_id": user_id})
+                    if not user_result.scalars().first():
+                        return {"status": "error", "message": f"Error crítico: El usuario con ID {user_id} no existe."}
+                    try:
+                        # UsuarioId es único: si otro proceso creó el perfil antes, falla y se reintenta.
+                        db.add(models.Preferencia(UsuarioId=user_id, DatosJson=datos_str))
+                        await db.flush()
+                    except IntegrityError:
+                        await db.rollback()
+                        continue
+                else:
+                    result = await db.execute(
+                        _UPDATE_PERFIL_VERSIONADO,
+                        {"preferencia_id": fila.Id, "datos_json": datos_str, "version_leida": fila.Version}
+                    )
+                    if result.rowcount == 0:
+                        # Conflicto: el perfil cambió desde que lo leímos.
+                        await db.rollback()
+                        continue
+
+                await reemplazar_etiquetas_perfil(db, user_id, perfil_nuevo)
+                await db.commit()
+                self._despues_de_guardar_perfil(user_id, perfil_nuevo)
+                return {
+                    "status": "exito",
+                    "message": f"Perfil alimentario actualizado para el usuario {user_id}.",
+                    "perfil": perfil_nuevo
+                }
+
+            return {"status": "error", "message": "El perfil se modificó al mismo tiempo desde otro lugar. Intenta de nuevo."}
+
+        except Exception as e:
+            await db.rollback()
+            traceback.print_exc()
+            return {"status": "error", "message": f"Error al actualizar el perfil: {e}"}
+
+    async def _reserva_por_clave(self, db: AsyncSession, clave: str) -> Optional[int]:
+        """Reserva ya creada con esta clave, si sigue ocupando cupo. Si se canceló (o quedó
+           como no_show) la clave se borra en la transacción en curso: la llamada vuelve a reservar."""
+        reserva_id = self.idempotencia_cache.get(clave)
+        if reserva_id is None:
+            fila = (await db.execute(_SELECT_RESERVA_POR_CLAVE, {"clave": clave})).first()
+            if fila is None:
+                return None
+            if fila.Estado not in models.ESTADOS_QUE_OCUPAN:
+                await db.execute(_DELETE_CLAVE_IDEMPOTENCIA, {"clave": clave})
+                return None
+            reserva_id = fila.ReservaId
+            self.idempotencia_cache.set(clave, reserva_id)
+        return reserva_id
+
+    def _respuesta_reserva_duplicada(self, reserva_id: int) -> dict:
+        return {
+            "status": "exito",
+            "message": f"La reserva ya estaba creada (no se duplicó). ID de reserva: {reserva_id}.",
+            "reserva_id": reserva_id,
+            "duplicada": True
+        }
+
+    async def handle_crear_reserva(
+        self, db: AsyncSession, user_id: int, args: dict, session_id: Optional[str] = None
+    ) -> dict:
         """Lógica para la herramienta 'crear_reserva'.
-           Recibe el user_id desde main.py, no desde la IA."""
+           Recibe el user_id desde main.py, no desde la IA.
+           Con session_id la operación es idempotente: si Gemini repite la llamada o el
+           cliente reintenta /chat, se devuelve la reserva ya creada en vez de otra fila."""
+        clave = None
         try:
             if not user_id:
                 return {"status": "error", "message": "Error interno: No se pudo identificar al usuario."}
@@ -154,97 +1044,356 @@ class DBService:
             experiencia_id = args.get('experiencia_id')
 
             # --- VALIDACIÓN ---
-            # 1. Verificar que el experiencia_id existe
+            # 1. Verificar que el experiencia_id existe (contra el catálogo en memoria)
             if experiencia_id:
-                result = await db.execute(
-                    select(models.Experiencia).where(models.Experiencia.Id == experiencia_id)
-                )
-                experiencia = result.scalars().first()
+                experiencia = await self.get_experiencia(db, experiencia_id)
                 if not experiencia:
+                    ids_validos = ", ".join(str(i) for i in sorted(self._catalogo))
                     return {
                         "status": "error",
-                        "message": f"El ID de experiencia {experiencia_id} no es válido. Los IDs válidos son 1, 2 o 3. Por favor, pregunta de nuevo al usuario."
+                        "message": f"El ID de experiencia {experiencia_id} no es válido. Los IDs válidos son {ids_validos}. Por favor, pregunta de nuevo al usuario."
                     }
             else:
                 return {"status": "error", "message": "El campo 'experiencia_id' es obligatorio."}
             # --- FIN VALIDACIÓN ---
 
+            experiencia_id = int(experiencia_id)
             fecha_hora_dt = datetime.fromisoformat(args['fecha_hora'])
+            num_comensales = int(args['num_comensales'])
+            if num_comensales < 1:
+                return {"status": "error", "message": "El número de comensales debe ser al menos 1."}
 
-            nueva_reserva = models.Reserva(
-                UsuarioId=user_id,
-                NombreReserva=args['nombre_reserva'],
-                NumComensales=args['num_comensales'],
-                ExperienciaId=experiencia_id,
-                FechaHora=fecha_hora_dt,
-                Restricciones=args.get('restricciones_adicionales'),
-                Estado='pendiente'
-            )
-            
-            db.add(nueva_reserva)
-            await db.commit()
-            await db.refresh(nueva_reserva)
+            valores_reserva = {
+                "UsuarioId": user_id,
+                "NombreReserva": args['nombre_reserva'],
+                "NumComensales": num_comensales,
+                "ExperienciaId": experiencia_id,
+                "FechaHora": fecha_hora_dt,
+                "Restricciones": args.get('restricciones_adicionales'),
+                "Estado": 'pendiente'
+            }
+
+            if session_id:
+                clave = clave_idempotencia(session_id, "crear_reserva", valores_reserva)
+                reserva_existente = await self._reserva_por_clave(db, clave)
+                if reserva_existente is not None:
+                    return self._respuesta_reserva_duplicada(reserva_existente)
+
+            # Admisión atómica: el cupo queda tomado mientras se inserta y se devuelve si falla
+            async with self.disponibilidad.admitir(experiencia_id, fecha_hora_dt, num_comensales):
+                reserva_id = await insertar_reserva(db, valores_reserva)
+                if clave:
+                    # PK única: una llamada concurrente con la misma clave falla aquí
+                    await db.execute(_INSERT_CLAVE_IDEMPOTENCIA, {"Clave": clave, "ReservaId": reserva_id})
+                await db.commit()
+            if clave:
+                self.idempotencia_cache.set(clave, reserva_id)
+            enrutador_lecturas.registrar_escritura(user_id)
+            self.invalidar_contexto_usuario(user_id)
+            self.invalidar_reporte_cocina(fecha_hora_dt, experiencia_id)
             
             return {
                 "status": "exito",
-                "message": f"Reserva creada con éxito. ID de reserva: {nueva_reserva.Id}.",
-                "reserva_id": nueva_reserva.Id
+                "message": f"Reserva creada con éxito. ID de reserva: {reserva_id}.",
+                "reserva_id": reserva_id
             }
-        
+
+        except SinCupoError as e:
+            sugerencia = ", o anotarse en la lista de espera (unirse_lista_espera)" if e.motivo == "sin_cupo" else ""
+            return {
+                "status": e.motivo,
+                "message": f"{e} Propón al usuario otro horario o fecha{sugerencia}."
+            }
+        except IntegrityError as e:
+            await db.rollback()
+            # Otra petición con la misma clave ganó la carrera: se devuelve su reserva
+            if clave:
+                reserva_existente = await self._reserva_por_clave(db, clave)
+                if reserva_existente is not None:
+                    return self._respuesta_reserva_duplicada(reserva_existente)
+            traceback.print_exc()
+            return {"status": "error", "message": f"Error en handle_crear_reserva: {e}"}
         except Exception as e:
             await db.rollback()
             traceback.print_exc()
             return {"status": "error", "message": f"Error en handle_crear_reserva: {e}"}
 
+    async def handle_unirse_lista_espera(self, db: AsyncSession, user_id: int, args: dict) -> dict:
+        """Lógica para la herramienta 'unirse_lista_espera'.
+           Una sola solicitud activa por usuario, experiencia y horario."""
+        try:
+            if not user_id:
+                return {"status": "error", "message": "Error interno: No se pudo identificar al usuario."}
+            experiencia_id = args.get('experiencia_id')
+            if not experiencia_id or not await self.get_experiencia(db, experiencia_id):
+                ids_validos = ", ".join(str(i) for i in sorted(self._catalogo))
+                return {"status": "error", "message": f"El ID de experiencia {experiencia_id} no es válido. Los IDs válidos son {ids_validos}."}
+            experiencia_id = int(experiencia_id)
+            fecha_hora_dt = datetime.fromisoformat(args['fecha_hora'])
+            num_comensales = int(args['num_comensales'])
+            if num_comensales < 1:
+                return {"status": "error", "message": "El número de comensales debe ser al menos 1."}
+            if fecha_hora_dt <= datetime.now():
+                return {"status": "error", "message": "La fecha y hora deben ser futuras."}
+
+            parametros = {"user_id": user_id, "experiencia_id": experiencia_id, "fecha_hora": fecha_hora_dt}
+            fila = (await db.execute(_SELECT_ESPERA_ACTIVA, parametros)).first()
+            if fila is None:
+                espera = models.ListaEspera(
+                    UsuarioId=user_id,
+                    ExperienciaId=experiencia_id,
+                    FechaHora=fecha_hora_dt,
+                    NumComensales=num_comensales,
+                    NombreReserva=args['nombre_reserva'],
+                    Restricciones=args.get('restricciones_adicionales'),
+                    Estado='esperando'
+                )
+                db.add(espera)
+                try:
+                    await db.commit()
+                    enrutador_lecturas.registrar_escritura(user_id)
+                    fila = (espera.Id, espera.Prioridad)
+                except IntegrityError:
+                    # Otra llamada igual se anotó entre la consulta y el INSERT (UX_ListaEspera_Esperando)
+                    await db.rollback()
+                    fila = (await db.execute(_SELECT_ESPERA_ACTIVA, parametros)).first()
+                    if fila is None:
+                        raise
+            espera_id, prioridad = fila
+
+            # Puesto en el turno, con el mismo orden que sigue el promotor: Prioridad y llegada
+            result = await db.execute(
+                select(func.count())
+                .select_from(models.ListaEspera)
+                .where(
+                    models.ListaEspera.ExperienciaId == experiencia_id,
+                    models.ListaEspera.Estado == 'esperando',
+                    models.ListaEspera.FechaHora == fecha_hora_dt,
+                    or_(
+                        models.ListaEspera.Prioridad > prioridad,
+                        and_(models.ListaEspera.Prioridad == prioridad, models.ListaEspera.Id <= espera_id)
+                    )
+                )
+            )
+            puesto = result.scalar_one()
+            # Por si el cupo se liberó mientras tanto
+            for oyente in self._oyentes_cupo_liberado:
+                oyente(experiencia_id, fecha_hora_dt.date())
+
+            return {
+                "status": "exito",
+                "message": f"Anotado en la lista de espera (puesto {puesto}). Si se libera cupo, la reserva se creará automáticamente.",
+                "lista_espera_id": espera_id,
+                "puesto": puesto
+            }
+
+        except Exception as e:
+            await db.rollback()
+            traceback.print_exc()
+            return {"status": "error", "message": f"Error en handle_unirse_lista_espera: {e}"}
+
+    async def handle_cancelar_lista_espera(self, db: AsyncSession, user_id: int, args: dict) -> dict:
+        """Lógica para la herramienta 'cancelar_lista_espera'.
+           Retira las solicitudes del usuario que siguen esperando: una por su ID, o las de
+           una experiencia (y, si se indica, un horario). Las ya promovidas son reservas."""
+        try:
+            if not user_id:
+                return {"status": "error", "message": "Error interno: No se pudo identificar al usuario."}
+            condiciones = [models.ListaEspera.UsuarioId == user_id, models.ListaEspera.Estado == 'esperando']
+            if args.get('lista_espera_id'):
+                condiciones.append(models.ListaEspera.Id == int(args['lista_espera_id']))
+            elif args.get('experiencia_id'):
+                condiciones.append(models.ListaEspera.ExperienciaId == int(args['experiencia_id']))
+                if args.get('fecha_hora'):
+                    condiciones.append(models.ListaEspera.FechaHora == datetime.fromisoformat(args['fecha_hora']))
+            else:
+                return {"status": "error", "message": "Indica el ID de la solicitud o la experiencia a retirar de la lista de espera."}
+
+            result = await db.execute(
+                update(models.ListaEspera)
+                .where(*condiciones)
+                .values(Estado='cancelada', ActualizadoEn=func.now())
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            if result.rowcount == 0:
+                return {"status": "info", "message": "No hay solicitudes en lista de espera que coincidan (quizá ya se convirtieron en reserva)."}
+            enrutador_lecturas.registrar_escritura(user_id)
+            return {
+                "status": "exito",
+                "message": f"Se retiraron {result.rowcount} solicitud(es) de la lista de espera.",
+                "canceladas": result.rowcount
+            }
+
+        except Exception as e:
+            await db.rollback()
+            traceback.print_exc()
+            return {"status": "error", "message": f"Error en handle_cancelar_lista_espera: {e}"}
+
+    async def handle_consultar_disponibilidad(self, db: AsyncSession, user_id: int, args: dict) -> dict:
+        """Lógica para la herramienta 'consultar_disponibilidad'.
+           Se responde desde el índice de ocupación en memoria, sin consultar Reservas."""
+        try:
+            experiencia_id = args.get('experiencia_id')
+            if not experiencia_id or not await self.get_experiencia(db, experiencia_id):
+                ids_validos = ", ".join(str(i) for i in sorted(self._catalogo))
+                return {"status": "error", "message": f"El ID de experiencia {experiencia_id} no es válido. Los IDs válidos son {ids_validos}."}
+            num_comensales = int(args.get('num_comensales') or 1)
+
+            desde = datetime.fromisoformat(args['fecha_desde'])
+            desde = max(desde, datetime.now())
+            hasta = datetime.fromisoformat(args['fecha_hasta']) if args.get('fecha_hasta') else None
+            if hasta is None:
+                hasta = desde + timedelta(days=7)
+            elif len(args['fecha_hasta']) <= 10:
+                # Solo fecha: se incluye el día completo
+                hasta += timedelta(days=1, microseconds=-1)
+            hasta = min(hasta, desde + timedelta(days=self.MAX_DIAS_DISPONIBILIDAD))
+            limite = min(int(args.get('max_resultados') or 5), self.MAX_RESULTADOS_DISPONIBILIDAD)
+
+            turnos = self.disponibilidad.proximos_turnos(experiencia_id, num_comensales, desde, hasta, limite)
+            if turnos is None:
+                return {
+                    "status": "exito",
+                    "message": "Esta experiencia no tiene límite de cupo configurado: cualquier fecha y hora es válida.",
+                    "horarios": []
+                }
+            if not turnos:
+                return {
+                    "status": "sin_cupo",
+                    "message": f"No hay horarios para {num_comensales} comensales entre el {desde:%d/%m/%Y} y el {hasta:%d/%m/%Y}. Propón otro rango de fechas.",
+                    "horarios": []
+                }
+            return {
+                "status": "exito",
+                "message": f"{len(turnos)} horarios disponibles para {num_comensales} comensales.",
+                "duracion_minutos": self.disponibilidad.duracion_minutos(experiencia_id),
+                "horarios": [
+                    {"fecha_hora": inicio.isoformat(timespec="minutes"), "cupo_libre": libre}
+                    for inicio, libre in turnos
+                ]
+            }
+
+        except Exception as e:
+            traceback.print_exc()
+            return {"status": "error", "message": f"Error en handle_consultar_disponibilidad: {e}"}
+
     async def handle_recomendar_experiencia(self, db: AsyncSession, user_id: int, args: dict) -> dict:
         """
         Lógica para la herramienta 'recomendar_experiencia'.
-        Analiza las preferencias del usuario, elige una experiencia y lo registra.
+        Puntúa todas las experiencias activas con el recomendador (respuestas del usuario,
+        tamaño del grupo, perfil alimentario e historial) y registra la elegida.
         """
         try:
             motivo = args.get('motivo_visita')
             acompanantes = args.get('acompanantes')
             estilo_cocina = args.get('estilo_cocina')
+            num_comensales = int(args['num_comensales']) if args.get('num_comensales') else None
 
-            # --- Lógica de recomendación simple (puede ser más compleja) ---
-            experiencia_recomendada_id = 1  # Default
-            if "gourmet" in estilo_cocina.lower() or "fusión" in estilo_cocina.lower():
-                experiencia_recomendada_id = 2
-            elif "vegana" in estilo_cocina.lower():
-                experiencia_recomendada_id = 3
-            elif motivo.lower() in ["celebración especial", "negocios"]:
-                 experiencia_recomendada_id = 2
-
-
-            # Loggear la recomendación
-            nuevo_log = models.RecomendacionesLog(
-                UsuarioId=user_id,
-                MotivoVisita=motivo,
-                Acompanantes=acompanantes,
-                EstiloCocina=estilo_cocina,
-                ExperienciaRecomendadaId=experiencia_recomendada_id
-            )
-            db.add(nuevo_log)
-            await db.commit()
+            if not self.recomendador.listo:
+                await self._cargar_catalogo(db)
+            else:
+                self.recomendador.recargar_modelo()
 
-            # Obtener los detalles de la experiencia para devolverlos
-            result = await db.execute(
-                select(models.Experiencia).where(models.Experiencia.Id == experiencia_recomendada_id)
+            # Perfil e historial desde el contexto (normalmente ya en caché)
+            contexto = await self.get_user_context(db, user_id) if user_id else None
+            perfil = contexto["perfil_alimentario"] if contexto else None
+            historial = [r["experiencia_id"] for r in contexto["historial_reservas"]] if contexto else []
+
+            rasgos = rasgos_de_entrada(motivo, acompanantes, estilo_cocina, num_comensales, perfil)
+            texto = " ".join(t for t in (motivo, acompanantes, estilo_cocina) if t)
+            # Los rasgos ya recogen los argumentos normalizados y las etiquetas del perfil;
+            # los términos, lo que aporta el texto libre a la similitud TF-IDF
+            clave = (
+                self.recomendador.version, tuple(rasgos), tuple(r for r, _ in terminos(texto)),
+                tuple(sorted(historial))
             )
-            experiencia_obj = result.scalars().first()
+            respuesta = self.recomendacion_cache.get(clave)
+            if respuesta is None:
+                respuesta = self._respuesta_recomendacion(
+                    self.recomendador.recomendar(rasgos, historial, texto=texto)
+                )
+                if respuesta["status"] != "exito":
+                    return respuesta
+                self.recomendacion_cache.set(clave, respuesta)
+            # Depende del usuario, no de la clave: se añade fuera de la caché
+            respuesta = self._con_clientes_similares(respuesta, user_id)
 
-            return {
-                "status": "exito",
-                "message": f"Basado en tus preferencias, te recomiendo la experiencia '{experiencia_obj.Nombre}'.",
-                "experiencia_recomendada": {
-                    "id": experiencia_obj.Id,
-                    "nombre": experiencia_obj.Nombre,
-                    "descripcion": experiencia_obj.Descripcion,
-                    "precio": float(experiencia_obj.Precio)
-                }
+            # Loggear la recomendación (en diferido si hay writer, es solo analítica)
+            datos_log = {
+                "UsuarioId": user_id,
+                "MotivoVisita": motivo,
+                "Acompanantes": acompanantes,
+                "EstiloCocina": estilo_cocina,
+                "NumComensales": num_comensales,
+                "ExperienciaRecomendadaId": respuesta["experiencia_recomendada"]["id"]
             }
+            if self._log_writer:
+                self._log_writer.registrar(datos_log)
+            else:
+                db.add(models.RecomendacionesLog(**datos_log))
+                await db.commit()
+
+            return respuesta
 
         except Exception as e:
             await db.rollback()
             traceback.print_exc()
-            return {"status": "error", "message": f"Error en handle_recomendar_experiencia: {e}"}
\ No newline at end of file
+            return {"status": "error", "message": f"Error en handle_recomendar_experiencia: {e}"}
+
+    def _con_clientes_similares(self, respuesta: dict, user_id: Optional[int]) -> dict:
+        """
+        Añade a la respuesta lo que reservaron los clientes más parecidos al usuario
+        ("clientes como tú") y, si coincide con la recomendada, lo da como razón.
+        No toca el puntaje: el ranking es el del modelo entrenado y evaluado.
+        """
+        similares = self.clientes_similares.experiencias_de_similares(user_id) if user_id else []
+        similares = [e for e in similares if e["experiencia_id"] in self._catalogo]
+        if not similares:
+            return respuesta
+        recomendada = respuesta["experiencia_recomendada"]
+        if any(e["experiencia_id"] == recomendada["id"] for e in similares):
+            recomendada = {**recomendada, "razones": recomendada["razones"] + ["clientes con gustos parecidos la reservaron"]}
+        return {
+            **respuesta,
+            "experiencia_recomendada": recomendada,
+            "clientes_como_tu": [
+                {
+                    "id": e["experiencia_id"],
+                    "nombre": self._catalogo[e["experiencia_id"]].Nombre,
+                    "clientes": e["clientes"],
+                    "ya_reservada": e["ya_reservada"]
+                }
+                for e in similares
+            ]
+        }
+
+    def _respuesta_recomendacion(self, ranking: List[dict]) -> dict:
+        """Respuesta de la herramienta a partir del ranking; detalles desde el catálogo en memoria."""
+        if not ranking:
+            return {"status": "error", "message": "No hay experiencias activas para recomendar."}
+        mejor = ranking[0]
+        experiencia_obj = self._catalogo[mejor["experiencia_id"]]
+        return {
+            "status": "exito",
+            "message": f"Basado en tus preferencias, te recomiendo la experiencia '{experiencia_obj.Nombre}'.",
+            "experiencia_recomendada": {
+                "id": experiencia_obj.Id,
+                "nombre": experiencia_obj.Nombre,
+                "descripcion": experiencia_obj.Descripcion,
+                "precio": float(experiencia_obj.Precio),
+                "puntaje": mejor["puntaje"],
+                "razones": mejor["razones"],
+                "en_contra": mejor["en_contra"]
+            },
+            "alternativas": [
+                {
+                    "id": r["experiencia_id"],
+                    "nombre": self._catalogo[r["experiencia_id"]].Nombre,
+                    "puntaje": r["puntaje"],
+                    "razones": r["razones"],
+                    "en_contra": r["en_contra"]
+                }
+                for r in ranking[1:]
+            ]
+        }
\ No newline at end of file
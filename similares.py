@@ -0,0 +1,244 @@
+"""
+Índice de clientes similares ("clientes como tú reservaron X").
+
+Cada usuario es un vector disperso de rasgos: sus etiquetas de perfil
+(PerfilEtiquetas, por código canónico o por valor si no lo tiene) y las
+experiencias que reservó, con peso log(1 + reservas). El vocabulario es pequeño
+(decenas de etiquetas y experiencias), así que los vectores se guardan ya
+normalizados como filas de una matriz float32: la similitud coseno contra todos
+los usuarios es un producto matriz-vector y el top-k exacto sale de un
+argpartition.
+
+El índice se carga completo al arrancar. Después, cada usuario que cambia
+(perfil o reservas) se marca con `marcar` y se relee en bloque cada pocos segundos.
+"""
+import asyncio
+import math
+import traceback
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from database import AsyncSessionFactory, settings
+
+PREFIJO_EXPERIENCIA = "experiencia:"
+
+def _consulta_etiquetas(usuario_ids: Optional[List[int]] = None):
+    stmt = select(
+        models.PerfilEtiqueta.UsuarioId, models.PerfilEtiqueta.Tipo,
+        func.coalesce(models.PerfilEtiqueta.Codigo, models.PerfilEtiqueta.Valor)
+    )
+    if usuario_ids is not None:
+        stmt = stmt.where(models.PerfilEtiqueta.UsuarioId.in_(usuario_ids))
+    return stmt
+
+def _consulta_reservas(usuario_ids: Optional[List[int]] = None):
+    stmt = (
+        select(models.Reserva.UsuarioId, models.Reserva.ExperienciaId, func.count())
+        .where(models.Reserva.UsuarioId.is_not(None), models.Reserva.Estado.in_(models.ESTADOS_QUE_OCUPAN))
+        .group_by(models.Reserva.UsuarioId, models.Reserva.ExperienciaId)
+    )
+    if usuario_ids is not None:
+        stmt = stmt.where(models.Reserva.UsuarioId.in_(usuario_ids))
+    return stmt
+
+class IndiceClientesSimilares:
+
+    CRECIMIENTO_COLUMNAS = 32
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession] = AsyncSessionFactory,
+        intervalo_segundos: float = settings.SIMILARES_INTERVALO_SEGUNDOS,
+        tamano_lote: int = 500
+    ):
+        self._session_factory = session_factory
+        self._intervalo_segundos = intervalo_segundos
+        self._tamano_lote = tamano_lote
+        self._vocabulario: Dict[str, int] = {}
+        self._fila: Dict[int, int] = {}        # usuario_id -> fila
+        self._usuarios = np.zeros(0, dtype=np.int64)  # fila -> usuario_id (0 = libre)
+        self._matriz = np.zeros((0, self.CRECIMIENTO_COLUMNAS), dtype=np.float32)
+        self._filas_usadas = 0
+        self._libres: List[int] = []
+        self._pendientes: Set[int] = set()
+        self._tarea: Optional[asyncio.Task] = None
+        self._cerrando = asyncio.Event()
+        self.cargado_en: Optional[datetime] = None
+        self.actualizaciones = 0
+
+    # --- Vectores ---
+
+    @staticmethod
+    def _rasgos(etiquetas: Iterable[Tuple[str, str]], reservas: Iterable[Tuple[int, int]]) -> Dict[str, float]:
+        rasgos = {f"{tipo}:{valor}": 1.0 for tipo, valor in etiquetas}
+        for experiencia_id, n in reservas:
+            rasgos[f"{PREFIJO_EXPERIENCIA}{experiencia_id}"] = math.log1p(n)
+        return rasgos
+
+    def _columna(self, rasgo: str) -> int:
+        columna = self._vocabulario.get(rasgo)
+        if columna is None:
+            columna = len(self._vocabulario)
+            self._vocabulario[rasgo] = columna
+            if columna >= self._matriz.shape[1]:
+                self._matriz = np.pad(self._matriz, ((0, 0), (0, self.CRECIMIENTO_COLUMNAS)))
+        return columna
+
+    def _asignar(self, usuario_id: int, rasgos: Dict[str, float]):
+        """Pone (o quita, si no tiene rasgos) el vector normalizado de un usuario."""
+        norma = math.sqrt(sum(p * p for p in rasgos.values()))
+        fila = self._fila.get(usuario_id)
+        if not norma:
+            if fila is not None:
+                self._matriz[fila] = 0.0
+                self._usuarios[fila] = 0
+                self._libres.append(fila)
+                del self._fila[usuario_id]
+            return
+
+        columnas = [self._columna(r) for r in rasgos]
+        if fila is None:
+            if self._libres:
+                fila = self._libres.pop()
+            else:
+                fila = self._filas_usadas
+                self._filas_usadas += 1
+                if fila >= len(self._matriz):
+                    capacidad = max(1024, 2 * len(self._matriz))
+                    self._matriz = np.pad(self._matriz, ((0, capacidad - len(self._matriz)), (0, 0)))
+                    self._usuarios = np.pad(self._usuarios, (0, capacidad - len(self._usuarios)))
+            self._fila[usuario_id] = fila
+            self._usuarios[fila] = usuario_id
+        self._matriz[fila] = 0.0
+        self._matriz[fila, columnas] = [p / norma for p in rasgos.values()]
+
+    # --- Carga y actualización incremental ---
+
+    async def _leer(self, db: AsyncSession, usuario_ids: Optional[List[int]] = None) -> Dict[int, Dict[str, float]]:
+        etiquetas: Dict[int, list] = {}
+        for usuario_id, tipo, valor in await db.execute(_consulta_etiquetas(usuario_ids)):
+            etiquetas.setdefault(usuario_id, []).append((tipo, valor))
+        reservas: Dict[int, list] = {}
+        for usuario_id, experiencia_id, n in await db.execute(_consulta_reservas(usuario_ids)):
+            reservas.setdefault(usuario_id, []).append((experiencia_id, n))
+        return {
+            usuario_id: self._rasgos(etiquetas.get(usuario_id, ()), reservas.get(usuario_id, ()))
+            for usuario_id in (usuario_ids if usuario_ids is not None else etiquetas.keys() | reservas.keys())
+        }
+
+    async def cargar(self):
+        """Construye el índice completo desde PerfilEtiquetas y Reservas."""
+        async with self._session_factory() as db:
+            vectores = await self._leer(db)
+        # Se construye aparte y se reemplaza de una vez
+        nuevo = IndiceClientesSimilares(self._session_factory, self._intervalo_segundos, self._tamano_lote)
+        for usuario_id, rasgos in vectores.items():
+            nuevo._asignar(usuario_id, rasgos)
+        (self._vocabulario, self._fila, self._usuarios, self._matriz, self._filas_usadas, self._libres) = (
+            nuevo._vocabulario, nuevo._fila, nuevo._usuarios, nuevo._matriz, nuevo._filas_usadas, nuevo._libres
+        )
+        self.cargado_en = datetime.now()
+
+    def marcar(self, usuario_id: Optional[int]):
+        """Anota que el perfil o las reservas de un usuario cambiaron (se relee en el próximo ciclo)."""
+        if usuario_id:
+            self._pendientes.add(usuario_id)
+
+    async def actualizar_pendientes(self):
+        while self._pendientes:
+            lote = [self._pendientes.pop() for _ in range(min(self._tamano_lote, len(self._pendientes)))]
+            try:
+                async with self._session_factory() as db:
+                    vectores = await self._leer(db, lote)
+            except Exception:
+                # Se reintentan en el próximo ciclo
+                self._pendientes.update(lote)
+                raise
+            for usuario_id, rasgos in vectores.items():
+                self._asignar(usuario_id, rasgos)
+            self.actualizaciones += len(lote)
+
+    def iniciar(self):
+        """Lanza la actualización periódica de los usuarios marcados (llamar tras `cargar`)."""
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._bucle())
+
+    async def _bucle(self):
+        while not self._cerrando.is_set():
+            try:
+                await asyncio.wait_for(self._cerrando.wait(), timeout=self._intervalo_segundos)
+            except asyncio.TimeoutError:
+                pass
+            if self._cerrando.is_set():
+                break
+            try:
+                await self.actualizar_pendientes()
+            except Exception:
+                traceback.print_exc()
+
+    async def detener(self):
+        self._cerrando.set()
+        if self._tarea is not None:
+            await self._tarea
+            self._tarea = None
+
+    # --- Consultas ---
+
+    def similares(self, usuario_id: int, k: int = 10) -> List[Tuple[int, float]]:
+        """Los k usuarios más parecidos (similitud coseno > 0), de mayor a menor."""
+        fila = self._fila.get(usuario_id)
+        if fila is None:
+            return []
+        matriz = self._matriz[:self._filas_usadas]
+        puntajes = matriz @ matriz[fila]
+        puntajes[fila] = 0.0
+        k = min(k, len(puntajes) - 1)
+        if k <= 0:
+            return []
+        mejores = np.argpartition(-puntajes, k - 1)[:k]
+        mejores = mejores[np.argsort(-puntajes[mejores], kind="stable")]
+        return [(int(self._usuarios[i]), round(float(puntajes[i]), 4)) for i in mejores if puntajes[i] > 0]
+
+    def experiencias_de_similares(self, usuario_id: int, k: int = 20, top: int = 3) -> List[dict]:
+        """
+        Experiencias que reservaron los k usuarios más parecidos, puntuadas por la suma
+        de sus similitudes. Las que el usuario ya reservó se marcan con ya_reservada.
+        """
+        vecinos = self.similares(usuario_id, k)
+        if not vecinos:
+            return []
+        columnas = {
+            int(rasgo[len(PREFIJO_EXPERIENCIA):]): columna
+            for rasgo, columna in self._vocabulario.items() if rasgo.startswith(PREFIJO_EXPERIENCIA)
+        }
+        filas = [self._fila[v] for v, _ in vecinos]
+        similitudes = np.array([s for _, s in vecinos], dtype=np.float32)
+        reservaron = self._matriz[np.ix_(filas, list(columnas.values()))] > 0
+        puntajes = similitudes @ reservaron
+        propia = self._matriz[self._fila[usuario_id]]
+        ranking = []
+        for i in np.argsort(-puntajes, kind="stable")[:top]:
+            if puntajes[i] <= 0:
+                break
+            experiencia_id, columna = list(columnas.items())[i]
+            ranking.append({
+                "experiencia_id": experiencia_id,
+                "puntaje": round(float(puntajes[i]), 4),
+                "clientes": int(reservaron[:, i].sum()),
+                "ya_reservada": bool(propia[columna] > 0)
+            })
+        return ranking
+
+    def metricas(self) -> dict:
+        return {
+            "usuarios": len(self._fila),
+            "rasgos": len(self._vocabulario),
+            "pendientes": len(self._pendientes),
+            "actualizaciones": self.actualizaciones,
+            "cargado_en": self.cargado_en.isoformat() if self.cargado_en else None
+        }
@@ -0,0 +1,255 @@
+import json
+import time
+import traceback
+from datetime import datetime
+from typing import AsyncIterator, List, Tuple
+from pydantic import ValidationError
+from sqlalchemy import insert, update, delete, select, bindparam, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+import schemas
+from database import settings, enrutador_lecturas, soporta_returning, construir_upsert, DIALECTO
+from services import DBService, etiquetas_de_perfil
+
+# Upsert de perfiles en lote (PostgreSQL/SQLite); None en SQL Server.
+# Como cualquier escritura del perfil, incrementa Version (concurrencia optimista).
+_UPSERT_PREFERENCIAS = construir_upsert(
+    models.Preferencia, ["UsuarioId"], ["DatosJson", "ActualizadoEn"], incrementar=("Version",)
+)
+
+# SQL Server: UPDATE por Id en lote (executemany), también incrementando Version
+_UPDATE_PREFERENCIAS = (
+    update(models.Preferencia.__table__)
+    .where(models.Preferencia.Id == bindparam("preferencia_id"))
+    .values(
+        DatosJson=bindparam("datos_json"),
+        ActualizadoEn=bindparam("ahora"),
+        Version=models.Preferencia.Version + 1
+    )
+)
+
+def _email_en(emails: List[str]):
+    """
+    Usuario.Email IN (...) sin distinguir mayúsculas. SQL Server ya compara así
+    (collation CI) y sin lower() conserva el índice; PostgreSQL y SQLite no.
+    """
+    emails = [email.lower() for email in emails]
+    if DIALECTO == "mssql":
+        return models.Usuario.Email.in_(emails)
+    return func.lower(models.Usuario.Email).in_(emails)
+
+async def _lineas_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, str]]:
+    """Parte un flujo de bytes en líneas NDJSON no vacías: (número de línea, texto)."""
+    pendiente = b""
+    numero = 0
+    async for chunk in chunks:
+        pendiente += chunk
+        *lineas, pendiente = pendiente.split(b"\n")
+        for linea in lineas:
+            numero += 1
+            if linea.strip():
+                yield numero, linea.decode("utf-8", errors="replace")
+    if pendiente.strip():
+        yield numero + 1, pendiente.decode("utf-8", errors="replace")
+
+class SincronizacionCRMService:
+    """
+    Importación/exportación masiva de Usuarios y Preferencias para el CRM en C#.
+    La importación agrupa las filas en lotes grandes (una transacción por lote,
+    INSERT/UPDATE con executemany) y salta las filas inválidas sin abortar el lote.
+    """
+
+    MAX_ERRORES_REPORTADOS = 100
+
+    def __init__(self, db_service: DBService, tamano_lote: int = settings.CRM_LOTE_SINCRONIZACION):
+        self.db_service = db_service
+        self.tamano_lote = tamano_lote
+
+    async def importar_usuarios(self, db: AsyncSession, chunks: AsyncIterator[bytes]) -> schemas.ImportacionResultadoSchema:
+        inicio = time.perf_counter()
+        resultado = {"procesadas": 0, "insertadas": 0, "actualizadas": 0, "invalidas": 0, "errores": []}
+
+        lote: List[Tuple[int, schemas.UsuarioSyncSchema]] = []
+        async for numero, texto in _lineas_ndjson(chunks):
+            resultado["procesadas"] += 1
+            try:
+                lote.append((numero, schemas.UsuarioSyncSchema.model_validate_json(texto)))
+            except ValidationError as e:
+                self._registrar_error(resultado, numero, e.errors(include_url=False)[0]["msg"])
+                continue
+            if len(lote) >= self.tamano_lote:
+                await self._importar_lote(db, lote, resultado)
+                lote = []
+        if lote:
+            await self._importar_lote(db, lote, resultado)
+
+        segundos = time.perf_counter() - inicio
+        return schemas.ImportacionResultadoSchema(
+            **resultado,
+            segundos=round(segundos, 3),
+            filas_por_segundo=round(resultado["procesadas"] / segundos, 1) if segundos else 0.0
+        )
+
+    def _registrar_error(self, resultado: dict, numero: int, mensaje: str):
+        resultado["invalidas"] += 1
+        if len(resultado["errores"]) < self.MAX_ERRORES_REPORTADOS:
+            resultado["errores"].append({"linea": numero, "error": mensaje})
+
+    async def _importar_lote(self, db: AsyncSession, lote: list, resultado: dict):
+        # Si el mismo email viene varias veces en el lote, gana la última línea.
+        por_email = {}
+        for numero, fila in lote:
+            por_email[fila.email.lower()] = (numero, fila)
+        lote = list(por_email.values())
+
+        try:
+            insertadas, actualizadas, usuario_ids = await self._escribir_lote(db, [fila for _, fila in lote])
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            traceback.print_exc()
+            # El lote falló en la BD: se aíslan las filas culpables reintentando una a una.
+            insertadas = actualizadas = 0
+            usuario_ids = []
+            for numero, fila in lote:
+                try:
+                    i, a, ids = await self._escribir_lote(db, [fila])
+                    await db.commit()
+                except Exception as e:
+                    await db.rollback()
+                    self._registrar_error(resultado, numero, str(e).splitlines()[0])
+                    continue
+                insertadas += i
+                actualizadas += a
+                usuario_ids += ids
+
+        resultado["insertadas"] += insertadas
+        resultado["actualizadas"] += actualizadas
+        for usuario_id in usuario_ids:
+            enrutador_lecturas.registrar_escritura(usuario_id)
+            self.db_service.invalidar_contexto_usuario(usuario_id)
+        if any(fila.perfil is not None for _, fila in lote):
+            self.db_service.reporte_cocina_cache.limpiar()
+
+    async def _escribir_lote(self, db: AsyncSession, filas: List[schemas.UsuarioSyncSchema]) -> Tuple[int, int, list]:
+        """Escribe un lote sin hacer commit. Devuelve (insertadas, actualizadas, ids de usuario)."""
+        ahora = datetime.now()
+
+        # 1. Qué emails ya existen (una sola consulta por lote)
+        result = await db.execute(
+            select(models.Usuario.Id, models.Usuario.Email)
+            .where(_email_en([f.email for f in filas]))
+        )
+        existentes = {email.lower(): usuario_id for usuario_id, email in result.all()}
+
+        nuevos = [f for f in filas if f.email.lower() not in existentes]
+        a_actualizar = [f for f in filas if f.email.lower() in existentes]
+
+        # 2. UPDATE por clave primaria en lote (executemany)
+        if a_actualizar:
+            await db.execute(
+                update(models.Usuario),
+                [
+                    {
+                        "Id": existentes[f.email.lower()],
+                        "Nombre": f.nombre,
+                        "ActualizadoEn": ahora,
+                        # Sin firebase_uid en la línea, se conserva el que ya tenga el usuario
+                        **({"FirebaseUid": f.firebase_uid} if f.firebase_uid is not None else {})
+                    }
+                    for f in a_actualizar
+                ]
+            )
+
+        # 3. INSERT en lote; los Id nuevos vuelven con RETURNING/OUTPUT si el motor lo permite
+        if nuevos:
+            filas_insert = [{"Nombre": f.nombre, "Email": f.email, "FirebaseUid": f.firebase_uid} for f in nuevos]
+            if soporta_returning():
+                result = await db.execute(
+                    insert(models.Usuario).returning(models.Usuario.Id, models.Usuario.Email),
+                    filas_insert
+                )
+            else:
+                await db.execute(insert(models.Usuario), filas_insert)
+                result = await db.execute(
+                    select(models.Usuario.Id, models.Usuario.Email)
+                    .where(_email_en([f.email for f in nuevos]))
+                )
+            existentes.update({email.lower(): usuario_id for usuario_id, email in result.all()})
+
+        # 4. Perfiles: DatosJson + etiquetas normalizadas
+        perfiles = {
+            existentes[f.email.lower()]: f.perfil.model_dump()
+            for f in filas if f.perfil is not None
+        }
+        if perfiles:
+            await self._escribir_perfiles(db, perfiles, ahora)
+
+        return len(nuevos), len(a_actualizar), list(existentes.values())
+
+    async def _escribir_perfiles(self, db: AsyncSession, perfiles: dict, ahora: datetime):
+        filas_perfil = [
+            {"UsuarioId": usuario_id, "DatosJson": json.dumps(perfil), "ActualizadoEn": ahora}
+            for usuario_id, perfil in perfiles.items()
+        ]
+        if _UPSERT_PREFERENCIAS is not None:
+            await db.execute(_UPSERT_PREFERENCIAS, filas_perfil)
+        else:
+            result = await db.execute(
+                select(models.Preferencia.Id, models.Preferencia.UsuarioId)
+                .where(models.Preferencia.UsuarioId.in_(list(perfiles)))
+            )
+            preferencia_ids = {usuario_id: preferencia_id for preferencia_id, usuario_id in result.all()}
+            a_actualizar = [
+                {"preferencia_id": preferencia_ids[f["UsuarioId"]], "datos_json": f["DatosJson"], "ahora": ahora}
+                for f in filas_perfil if f["UsuarioId"] in preferencia_ids
+            ]
+            a_insertar = [f for f in filas_perfil if f["UsuarioId"] not in preferencia_ids]
+            if a_actualizar:
+                await db.execute(_UPDATE_PREFERENCIAS, a_actualizar)
+            if a_insertar:
+                await db.execute(insert(models.Preferencia), a_insertar)
+
+        await db.execute(
+            delete(models.PerfilEtiqueta)
+            .where(models.PerfilEtiqueta.UsuarioId.in_(list(perfiles)))
+            .execution_options(synchronize_session=False)
+        )
+        etiquetas = [fila for usuario_id, perfil in perfiles.items() for fila in etiquetas_de_perfil(usuario_id, perfil)]
+        if etiquetas:
+            await db.execute(insert(models.PerfilEtiqueta), etiquetas)
+
+    async def exportar_usuarios(self, db: AsyncSession) -> AsyncIterator[str]:
+        """Genera el NDJSON de todos los usuarios con su perfil, por bloques (keyset por Id)."""
+        ultimo_id = 0
+        while True:
+            result = await db.execute(
+                select(
+                    models.Usuario.Id, models.Usuario.Nombre, models.Usuario.Email,
+                    models.Usuario.FirebaseUid, models.Preferencia.DatosJson
+                )
+                .outerjoin(models.Preferencia, models.Preferencia.UsuarioId == models.Usuario.Id)
+                .where(models.Usuario.Id > ultimo_id)
+                .order_by(models.Usuario.Id)
+                .limit(self.tamano_lote)
+            )
+            filas = result.all()
+            if not filas:
+                return
+            ultimo_id = filas[-1].Id
+
+            bloque = []
+            for fila in filas:
+                try:
+                    perfil = json.loads(fila.DatosJson) if fila.DatosJson else None
+                except ValueError:
+                    perfil = None
+                bloque.append(json.dumps({
+                    "id": fila.Id,
+                    "nombre": fila.Nombre,
+                    "email": fila.Email,
+                    "firebase_uid": fila.FirebaseUid,
+                    "perfil": perfil
+                }, ensure_ascii=False))
+            yield "\n".join(bloque) + "\n"
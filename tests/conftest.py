@@ -0,0 +1,76 @@
+"""
+Configuración común de las pruebas.
+
+Las pruebas usan una base SQLite temporal (nunca la de .env): las variables de
+entorno se fijan antes de importar `database`, que crea el motor al importarse.
+Cada prueba con la fixture `db` parte de un esquema recién creado. Las pruebas
+asíncronas se ejecutan con el plugin de anyio (`pytestmark = pytest.mark.anyio`).
+
+    pip install -r requirements-dev.txt
+    python -m pytest -q
+"""
+import os
+import tempfile
+
+_DIRECTORIO = tempfile.mkdtemp(prefix="crm_pruebas_")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_DIRECTORIO, 'pruebas.db')}"
+os.environ.pop("READ_DATABASE_URL", None)
+os.environ.setdefault("GOOGLE_API_KEY", "pruebas")
+os.environ["RECOMENDADOR_MODELOS_DIR"] = os.path.join(_DIRECTORIO, "modelos")
+
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+import database
+import models
+
+# Catálogo de prueba con los mismos Ids que el de producción
+EXPERIENCIAS = [
+    {
+        "Id": 1, "Codigo": "DEG", "Nombre": "Menú Degustación", "DuracionMinutos": 180, "Precio": 890,
+        "Descripcion": "Recorrido por los ecosistemas del Perú en un menú de altura para amantes de la gastronomía.",
+        "PalabrasClave": "cena gourmet pareja romantica noche turismo"
+    },
+    {
+        "Id": 2, "Codigo": "INM", "Nombre": "Inmersión Central", "DuracionMinutos": 360, "Precio": 1800,
+        "Descripcion": "La experiencia más completa: visita al laboratorio, menú con maridaje y sobremesa.",
+        "PalabrasClave": "celebracion aniversario cumpleanos negocios corporativo"
+    },
+    {
+        "Id": 3, "Codigo": "THB", "Nombre": "Theobromas Lab", "DuracionMinutos": 120, "Precio": 250,
+        "Descripcion": "Taller de cacao amazónico y chocolate, ideal para grupos y familias.",
+        "PalabrasClave": "ninos hijos dulce taller corto"
+    },
+]
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+async def db():
+    """Sesión sobre un esquema vacío recién creado."""
+    async with database.engine.begin() as conn:
+        await conn.run_sync(database.Base.metadata.drop_all)
+        await conn.run_sync(database.Base.metadata.create_all)
+    async with database.AsyncSessionFactory() as sesion:
+        yield sesion
+    # Las conexiones quedan ligadas al event loop de la prueba
+    await database.engine.dispose()
+
+@pytest.fixture
+async def catalogo(db):
+    """Las tres experiencias y un usuario (Id 1)."""
+    db.add_all(models.Experiencia(**e) for e in EXPERIENCIAS)
+    db.add(models.Usuario(Id=1, Nombre="Ana", Email="ana@example.com"))
+    await db.commit()
+    return db
+
+def proximo_dia(dia_semana: int, desde: date = None) -> date:
+    """Primer día con ese día de la semana (0 = lunes) a partir de mañana."""
+    dia = (desde or date.today()) + timedelta(days=1)
+    return dia + timedelta(days=(dia_semana - dia.weekday()) % 7)
+
+def a_las(dia: date, hora: int, minuto: int = 0) -> datetime:
+    return datetime.combine(dia, time(hora, minuto))
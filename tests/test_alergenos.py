@@ -0,0 +1,60 @@
+import pytest
+
+from alergenos import MatcherAhoCorasick, codigos_alergenos, con_plurales, normalizar_texto
+
+def test_normalizar_texto():
+    assert normalizar_texto("¡Maní, CAMARÓN y piñones!") == " mani camaron y pinones "
+    assert normalizar_texto("") == "  "
+
+@pytest.mark.parametrize("texto, codigos", [
+    ("Alérgica al MANÍ", {"mani"}),
+    ("no come mariscos ni pulpo", {"mariscos", "moluscos"}),
+    ("almendras, camarones y nueces", {"frutos_secos", "crustaceos"}),
+    ("celíaca, sin gluten", {"gluten"}),
+    ("vegana y abstemia", {"vegano", "sin_alcohol"}),
+    ("castaña de brasil", {"frutos_secos"}),
+    ("", set()),
+    ("ninguna", set()),
+])
+def test_codigos_de_texto_libre(texto, codigos):
+    assert codigos_alergenos(texto) == codigos
+
+def test_solo_palabras_completas():
+    # "pez" no dentro de "pezuña", "apio" no dentro de "apiolado", "nata" no dentro de "natación"
+    assert codigos_alergenos("pezuña de cerdo") == set()
+    assert codigos_alergenos("le gusta la natación") == set()
+    assert codigos_alergenos("pez espada") == {"pescado"}
+
+def test_patrones_que_se_solapan():
+    matcher = MatcherAhoCorasick({"a": ["leche"], "b": ["crema de leche"], "c": ["crema"]})
+    assert matcher.buscar("crema de leche") == {"a", "b", "c"}
+    assert matcher.buscar("leche de coco") == {"a"}
+
+def test_sufijo_de_un_patron_que_es_otro_patron():
+    # Al fallar "castana de br..." el autómata debe seguir reconociendo "de bruselas"
+    matcher = MatcherAhoCorasick({"x": ["castana de brasil"], "y": ["de bruselas"]})
+    assert matcher.buscar("castaña de bruselas") == {"y"}
+
+def test_plurales_simples():
+    matcher = MatcherAhoCorasick({"crustaceos": ["camaron"], "frutos_secos": ["almendra"]})
+    assert matcher.buscar("camarones") == {"crustaceos"}
+    assert matcher.buscar("almendras") == {"frutos_secos"}
+
+def test_plural_de_palabras_en_z():
+    assert con_plurales("pez") == {"pez", "pezs", "pezes", "peces"}
+    assert codigos_alergenos("no come peces") == {"pescado"}
+    assert codigos_alergenos("nueces y altramuces") == {"frutos_secos", "altramuces"}
+
+@pytest.mark.parametrize("texto, codigos", [
+    # La harina sola no implica gluten
+    ("postre con harina de arroz", set()),
+    ("harina de maíz", set()),
+    ("harina de trigo", {"gluten"}),
+    # "chancho" solo cuenta como restricción cuando se excluye
+    ("le encanta el chancho", set()),
+    ("quiere chancho al palo", set()),
+    ("sin chancho por favor", {"sin_cerdo"}),
+    ("no come chancho", {"sin_cerdo"}),
+])
+def test_palabras_ambiguas(texto, codigos):
+    assert codigos_alergenos(texto) == codigos
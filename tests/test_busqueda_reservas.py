@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import models
+from services import DBService, codificar_cursor, decodificar_cursor
+
+def test_cursor_ida_y_vuelta():
+    fecha_hora = datetime(2026, 3, 14, 20, 15, 30, 123456)
+    cursor = codificar_cursor(fecha_hora, 4821)
+    assert "=" not in cursor
+    assert decodificar_cursor(cursor) == (fecha_hora, 4821)
+
+@pytest.mark.parametrize("cursor", ["", "no es base64!", "bm9wZQ", codificar_cursor(datetime(2026, 1, 1), 1)[:-3]])
+def test_cursor_invalido(cursor):
+    with pytest.raises(ValueError):
+        decodificar_cursor(cursor)
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("descendente", [False, True])
+async def test_paginacion_keyset_con_fechas_repetidas(catalogo, descendente):
+    db = catalogo
+    inicio = datetime(2026, 5, 1, 19, 0)
+    # Bloques de cuatro reservas con la misma FechaHora: el Id desempata
+    db.add_all(
+        models.Reserva(
+            UsuarioId=1, NombreReserva=f"Reserva {i}", NumComensales=2, ExperienciaId=1 + i % 3,
+            FechaHora=inicio + timedelta(minutes=15 * (i // 4)), Estado="pendiente"
+        )
+        for i in range(23)
+    )
+    await db.commit()
+
+    servicio = DBService()
+    vistos, cursor, paginas = [], None, 0
+    while True:
+        pagina = await servicio.buscar_reservas(db, cursor=cursor, limite=5, descendente=descendente)
+        vistos += [(r.fecha_hora, r.id) for r in pagina.items]
+        paginas += 1
+        cursor = pagina.siguiente_cursor
+        if cursor is None:
+            break
+
+    assert paginas == 5
+    assert len(vistos) == len(set(vistos)) == 23
+    assert vistos == sorted(vistos, reverse=descendente)
+
+@pytest.mark.anyio
+async def test_filtros_y_prefijo_de_nombre(catalogo):
+    db = catalogo
+    fecha = datetime(2026, 5, 1, 19, 0)
+    db.add_all([
+        models.Reserva(UsuarioId=1, NombreReserva="Ana 50%", NumComensales=2, ExperienciaId=1, FechaHora=fecha, Estado="pendiente"),
+        models.Reserva(UsuarioId=1, NombreReserva="Ana 5", NumComensales=2, ExperienciaId=1, FechaHora=fecha, Estado="cancelada"),
+        models.Reserva(UsuarioId=1, NombreReserva="Ana 500", NumComensales=2, ExperienciaId=2, FechaHora=fecha, Estado="pendiente"),
+    ])
+    await db.commit()
+
+    servicio = DBService()
+    # El % del prefijo se escapa: no actúa como comodín
+    pagina = await servicio.buscar_reservas(db, nombre="Ana 50%")
+    assert [r.nombre_reserva for r in pagina.items] == ["Ana 50%"]
+    pagina = await servicio.buscar_reservas(db, nombre="Ana 5", estados=["pendiente"], experiencia_id=1)
+    assert [r.nombre_reserva for r in pagina.items] == ["Ana 50%"]
+    assert pagina.siguiente_cursor is None
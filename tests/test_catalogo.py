@@ -0,0 +1,39 @@
+import pytest
+
+import models
+from services import DBService
+
+pytestmark = pytest.mark.anyio
+
+def _contar_recargas(servicio: DBService) -> list:
+    recargas = []
+    cargar = servicio._cargar_catalogo
+
+    async def contando(db):
+        recargas.append(db)
+        return await cargar(db)
+
+    servicio._cargar_catalogo = contando
+    return recargas
+
+async def test_un_id_desconocido_no_recarga_el_catalogo(catalogo):
+    servicio = DBService()
+    recargas = _contar_recargas(servicio)
+
+    assert (await servicio.get_experiencia(catalogo, 1)).Nombre == "Menú Degustación"
+    assert len(recargas) == 1
+    for _ in range(3):
+        assert await servicio.get_experiencia(catalogo, 99) is None
+    assert await servicio.get_experiencia(catalogo, "no es un id") is None
+    assert len(recargas) == 1
+
+async def test_una_experiencia_nueva_se_busca_por_clave_primaria(catalogo):
+    servicio = DBService()
+    await servicio.get_all_experiences(catalogo)
+    recargas = _contar_recargas(servicio)
+    catalogo.add(models.Experiencia(Id=4, Codigo="NUE", Nombre="Experiencia nueva", Precio=100))
+    await catalogo.commit()
+
+    assert (await servicio.get_experiencia(catalogo, "4")).Nombre == "Experiencia nueva"
+    assert 4 in servicio._catalogo
+    assert not recargas
@@ -0,0 +1,61 @@
+import pytest
+
+import models
+from conftest import a_las, proximo_dia
+from services import DBService
+
+pytestmark = pytest.mark.anyio
+
+TURNO = a_las(proximo_dia(3), 20)
+
+def _metricas(servicio: DBService) -> tuple:
+    metricas = servicio.contexto_cache.metricas()
+    return metricas["aciertos"], metricas["fallos"]
+
+async def test_la_segunda_lectura_sale_de_la_cache(catalogo):
+    servicio = DBService()
+    primero = await servicio.get_user_context(catalogo, 1)
+    segundo = await servicio.get_user_context(catalogo, 1)
+    assert segundo == primero
+    assert primero["perfil_alimentario"] == "Sin perfil."
+    assert _metricas(servicio) == (1, 1)
+
+async def test_guardar_el_perfil_actualiza_el_contexto_en_cache(catalogo):
+    servicio = DBService()
+    await servicio.get_user_context(catalogo, 1)
+
+    await servicio.handle_guardar_perfil(catalogo, 1, {"alergias": ["maní"]})
+    assert servicio.contexto_cache.peek(1)["perfil_alimentario"] == {"alergias": ["maní"]}
+    await servicio.handle_actualizar_perfil(catalogo, 1, {"agregar": {"gustos": ["cacao"]}})
+    contexto = await servicio.get_user_context(catalogo, 1)
+    # Write-through: acierto, sin volver a la BD
+    assert contexto["perfil_alimentario"] == {"alergias": ["maní"], "gustos": ["cacao"]}
+    assert _metricas(servicio) == (1, 1)
+
+async def test_crear_una_reserva_invalida_el_contexto(catalogo):
+    servicio = DBService()
+    await servicio.get_user_context(catalogo, 1)
+
+    respuesta = await servicio.handle_crear_reserva(catalogo, 1, {
+        "experiencia_id": 1, "fecha_hora": TURNO.isoformat(), "num_comensales": 2, "nombre_reserva": "Ana"
+    })
+    assert respuesta["status"] == "exito"
+    assert servicio.contexto_cache.peek(1) is None
+    await servicio.get_user_context(catalogo, 1)
+    assert _metricas(servicio) == (0, 2)
+
+async def test_un_cambio_de_estado_invalida_el_contexto(catalogo):
+    reserva = models.Reserva(
+        UsuarioId=1, NombreReserva="Ana", NumComensales=2, ExperienciaId=2, FechaHora=TURNO, Estado="confirmada"
+    )
+    catalogo.add(reserva)
+    await catalogo.commit()
+    servicio = DBService()
+    assert (await servicio.get_user_context(catalogo, 1))["historial_reservas"] == []
+
+    await servicio.cambiar_estado_reservas(catalogo, "completar", [reserva.Id])
+    assert servicio.contexto_cache.peek(1) is None
+    catalogo.expire_all()
+    contexto = await servicio.get_user_context(catalogo, 1)
+    assert [r["experiencia_id"] for r in contexto["historial_reservas"]] == [2]
+    assert _metricas(servicio) == (0, 2)
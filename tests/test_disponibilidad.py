@@ -0,0 +1,149 @@
+import asyncio
+from datetime import date, time, timedelta
+
+import pytest
+from sqlalchemy import select
+
+import database
+import models
+from conftest import a_las, proximo_dia
+from disponibilidad import MotorDisponibilidad, SinCupoError
+from services import DBService
+
+pytestmark = pytest.mark.anyio
+
+LUNES = proximo_dia(0)
+
+async def _motor(db, horarios=(), reservas=()) -> MotorDisponibilidad:
+    """Carga un motor con franjas [(experiencia, día, apertura, cierre, capacidad)] y reservas."""
+    for experiencia_id, dia, apertura, cierre, capacidad in horarios:
+        db.add(models.HorarioExperiencia(
+            ExperienciaId=experiencia_id, DiaSemana=dia, HoraApertura=apertura,
+            HoraCierre=cierre, CapacidadComensales=capacidad
+        ))
+    for experiencia_id, fecha_hora, comensales, estado in reservas:
+        db.add(models.Reserva(
+            UsuarioId=1, NombreReserva="Ana", NumComensales=comensales, ExperienciaId=experiencia_id,
+            FechaHora=fecha_hora, Estado=estado
+        ))
+    await db.commit()
+    motor = MotorDisponibilidad(session_factory=database.AsyncSessionFactory, recarga_minutos=0)
+    await motor.cargar()
+    return motor
+
+# Theobromas Lab (Id 3) dura 120 min: de 15:00 a 21:00, 10 comensales a la vez
+CENA = (3, None, time(15, 0), time(21, 0), 10)
+
+async def test_sin_franjas_no_hay_limite(catalogo):
+    motor = await _motor(catalogo)
+    assert motor.cupo_libre(3, a_las(LUNES, 4)) is None
+    assert motor.proximos_turnos(3, 50, a_las(LUNES, 0), a_las(LUNES, 23), 5) is None
+    motor.comprobar(3, a_las(LUNES, 4), 500)
+
+async def test_la_reserva_completa_debe_caber_en_la_franja(catalogo):
+    motor = await _motor(catalogo, [CENA])
+    motor.comprobar(3, a_las(LUNES, 19), 2)
+    with pytest.raises(SinCupoError) as error:
+        # Termina a las 21:15, después del cierre
+        motor.comprobar(3, a_las(LUNES, 19, 15), 2)
+    assert error.value.motivo == "fuera_de_horario"
+    with pytest.raises(SinCupoError):
+        motor.comprobar(3, a_las(LUNES, 14, 45), 2)
+
+async def test_franja_de_un_solo_dia_de_la_semana(catalogo):
+    motor = await _motor(catalogo, [(3, 0, time(15, 0), time(21, 0), 10)])
+    assert motor.cupo_libre(3, a_las(LUNES, 16)) == 10
+    assert motor.cupo_libre(3, a_las(LUNES + timedelta(days=1), 16)) == 0
+
+async def test_las_reservas_ocupan_todos_los_turnos_de_su_duracion(catalogo):
+    motor = await _motor(catalogo, [CENA], [(3, a_las(LUNES, 16), 6, "confirmada")])
+    # 16:00-18:00 ocupado; una reserva a las 17:45 se solapa en el último turno
+    assert motor.cupo_libre(3, a_las(LUNES, 15)) == 4
+    assert motor.cupo_libre(3, a_las(LUNES, 17, 45)) == 4
+    assert motor.cupo_libre(3, a_las(LUNES, 18)) == 10
+    with pytest.raises(SinCupoError) as error:
+        motor.comprobar(3, a_las(LUNES, 17), 5)
+    assert error.value.motivo == "sin_cupo"
+
+async def test_cargar_ignora_canceladas_y_dias_pasados(catalogo):
+    ayer = date.today() - timedelta(days=1)
+    motor = await _motor(catalogo, [CENA], [
+        (3, a_las(LUNES, 16), 6, "cancelada"),
+        (3, a_las(LUNES, 16), 3, "no_show"),
+        (3, a_las(ayer, 16), 9, "completada"),
+    ])
+    assert motor.cupo_libre(3, a_las(LUNES, 16)) == 10
+    assert motor.metricas()["dias_indexados"] == 0
+
+async def test_admitir_devuelve_el_cupo_si_el_bloque_falla(catalogo):
+    motor = await _motor(catalogo, [CENA])
+    with pytest.raises(RuntimeError):
+        async with motor.admitir(3, a_las(LUNES, 16), 8):
+            assert motor.cupo_libre(3, a_las(LUNES, 16)) == 2
+            raise RuntimeError("falló el INSERT")
+    assert motor.cupo_libre(3, a_las(LUNES, 16)) == 10
+    assert motor.metricas()["admisiones_en_curso"] == 0
+
+async def test_admisiones_concurrentes_no_sobrepasan_la_capacidad(catalogo):
+    motor = await _motor(catalogo, [CENA])
+
+    async def reservar(comensales):
+        try:
+            async with motor.admitir(3, a_las(LUNES, 16), comensales):
+                # Simula el INSERT y el commit: cede el turno a la otra admisión
+                await asyncio.sleep(0.01)
+            return True
+        except SinCupoError:
+            return False
+
+    resultados = await asyncio.gather(reservar(6), reservar(6), reservar(4))
+    assert resultados == [True, False, True]
+    assert motor.cupo_libre(3, a_las(LUNES, 16)) == 0
+
+async def test_liberar_devuelve_el_cupo(catalogo):
+    motor = await _motor(catalogo, [CENA], [(3, a_las(LUNES, 16), 6, "pendiente")])
+    motor.liberar(3, a_las(LUNES, 16), 6)
+    assert motor.cupo_libre(3, a_las(LUNES, 16)) == 10
+
+async def test_una_reserva_que_cruza_medianoche_se_corta_en_el_dia(catalogo):
+    motor = await _motor(catalogo, [(3, None, time(0, 0), time(23, 59), 10)], [(3, a_las(LUNES, 23, 30), 4, "pendiente")])
+    assert motor.cupo_libre(3, a_las(LUNES, 21, 30)) == 10
+    assert motor.cupo_libre(3, a_las(LUNES, 21, 45)) == 6
+    # No se arrastra a los primeros turnos del día siguiente
+    assert motor.cupo_libre(3, a_las(LUNES + timedelta(days=1), 0)) == 10
+
+async def test_proximos_turnos_salta_los_llenos_y_respeta_el_limite(catalogo):
+    motor = await _motor(catalogo, [CENA], [(3, a_las(LUNES, 15), 9, "confirmada")])
+    turnos = motor.proximos_turnos(3, 2, a_las(LUNES, 0), a_las(LUNES, 23, 59), 3)
+    # 15:00-16:45 se solapan con la reserva de 9; el primer inicio libre es 17:00
+    assert turnos == [(a_las(LUNES, 17), 10), (a_las(LUNES, 17, 15), 10), (a_las(LUNES, 17, 30), 10)]
+    assert motor.proximos_turnos(3, 11, a_las(LUNES, 0), a_las(LUNES, 23, 59), 3) == []
+
+async def test_la_recarga_espera_a_la_transicion_en_curso(catalogo):
+    motor = await _motor(catalogo, [CENA])
+    async with motor.transicion():
+        recarga = asyncio.create_task(motor.cargar())
+        await asyncio.sleep(0.05)
+        assert not recarga.done()
+    await recarga
+    assert motor.cargado_en is not None
+
+async def test_una_cancelacion_durante_la_recarga_se_descuenta_una_vez(catalogo, monkeypatch):
+    servicio = DBService()
+    servicio.disponibilidad = await _motor(catalogo, [CENA], [
+        (3, a_las(LUNES, 16), 6, "confirmada"), (3, a_las(LUNES, 16), 2, "confirmada")
+    ])
+    reserva_id = (await catalogo.execute(select(models.Reserva.Id).where(models.Reserva.NumComensales == 6))).scalar_one()
+    commit = catalogo.commit
+    recargas = []
+
+    async def commit_y_recarga():
+        await commit()
+        # La recarga periódica se dispara entre el commit de la cancelación y su liberar
+        recargas.append(asyncio.create_task(servicio.disponibilidad.cargar()))
+        await asyncio.sleep(0.05)
+
+    monkeypatch.setattr(catalogo, "commit", commit_y_recarga)
+    await servicio.cambiar_estado_reservas(catalogo, "cancelar", [reserva_id])
+    await asyncio.gather(*recargas)
+    assert servicio.disponibilidad.cupo_libre(3, a_las(LUNES, 16)) == 8
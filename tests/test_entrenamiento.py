@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+import models
+from jobs import _recomendaciones_con_conversion, rasgos_de_log, replay_recomendador
+from recomendador import Recomendador, guardar_artefacto
+from services import DBService
+
+pytestmark = pytest.mark.anyio
+
+AHORA = datetime(2026, 6, 1, 12, 0)
+
+async def test_el_log_guarda_el_tamano_del_grupo(catalogo):
+    servicio = DBService()
+    respuesta = await servicio.handle_recomendar_experiencia(catalogo, 1, {
+        "motivo_visita": "Turismo", "acompanantes": "Familia", "estilo_cocina": "Tradicional", "num_comensales": 4
+    })
+    assert respuesta["status"] == "exito"
+    log = (await catalogo.execute(select(models.RecomendacionesLog))).scalar_one()
+    assert log.NumComensales == 4
+
+async def test_el_tamano_del_grupo_no_sale_de_la_reserva(catalogo):
+    catalogo.add_all([
+        # Sin tamaño de grupo en la recomendación, y luego una reserva de 8
+        models.RecomendacionesLog(
+            UsuarioId=1, MotivoVisita="Turismo", Acompanantes="Amigos", EstiloCocina="Gourmet",
+            ExperienciaRecomendadaId=1, CreadoEn=AHORA
+        ),
+        models.RecomendacionesLog(
+            UsuarioId=1, MotivoVisita="Turismo", Acompanantes="Pareja", EstiloCocina="Gourmet",
+            NumComensales=2, ExperienciaRecomendadaId=1, CreadoEn=AHORA + timedelta(minutes=5)
+        ),
+        models.Reserva(
+            UsuarioId=1, NombreReserva="Ana", NumComensales=8, ExperienciaId=3,
+            FechaHora=AHORA + timedelta(days=3), Estado="pendiente", CreadoEn=AHORA + timedelta(hours=1)
+        ),
+    ])
+    await catalogo.commit()
+
+    lotes = [lote async for lote in _recomendaciones_con_conversion(catalogo, 14, 100)]
+    (sin_grupo, _, conversion), (con_grupo, _, _) = lotes[0]
+    assert conversion.ExperienciaId == 3
+    assert not [r for r in rasgos_de_log(sin_grupo, None) if r.startswith("grupo:")]
+    assert "grupo:2" in rasgos_de_log(con_grupo, None)
+
+async def test_el_replay_solo_usa_recomendaciones_posteriores_al_entrenamiento(catalogo, tmp_path):
+    base = Recomendador()
+    base.construir((await catalogo.execute(select(models.Experiencia))).scalars().all())
+    ids, pesos = base.matriz()
+    guardar_artefacto(str(tmp_path), pesos, ids.tolist(), {"entrenado_en": AHORA.isoformat(timespec="seconds")})
+    catalogo.add_all(
+        models.RecomendacionesLog(
+            UsuarioId=1, MotivoVisita="Turismo", Acompanantes="Pareja", EstiloCocina="Gourmet",
+            ExperienciaRecomendadaId=1, CreadoEn=AHORA + timedelta(days=dias)
+        )
+        for dias in (-2, -1, 1)
+    )
+    await catalogo.commit()
+
+    # Las dos primeras sirvieron para entrenar: solo se reproduce la posterior
+    entrenado = await replay_recomendador(directorio=str(tmp_path))
+    assert entrenado["version_modelo"] == 1
+    assert entrenado["desde"] == AHORA.isoformat(timespec="seconds")
+    assert entrenado["recomendaciones"] == 1
+    # PESOS_BASE sobre la misma ventana, o sobre todo el log si no se indica
+    assert (await replay_recomendador(solo_base=True, desde=AHORA))["recomendaciones"] == 1
+    assert (await replay_recomendador(solo_base=True))["recomendaciones"] == 3
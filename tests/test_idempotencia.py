@@ -0,0 +1,114 @@
+import asyncio
+from datetime import time
+
+import pytest
+from sqlalchemy import func, select
+
+import database
+import models
+from conftest import a_las, proximo_dia
+from services import DBService, clave_idempotencia
+
+pytestmark = pytest.mark.anyio
+
+FECHA = a_las(proximo_dia(4), 16)
+
+ARGS = {
+    "experiencia_id": 3,
+    "fecha_hora": FECHA.isoformat(),
+    "num_comensales": 4,
+    "nombre_reserva": "Ana",
+    "restricciones_adicionales": "sin maní"
+}
+
+async def _reservas(db) -> int:
+    return (await db.execute(select(func.count()).select_from(models.Reserva))).scalar_one()
+
+async def _servicio(db, capacidad=None) -> DBService:
+    if capacidad is not None:
+        db.add(models.HorarioExperiencia(
+            ExperienciaId=3, HoraApertura=time(15), HoraCierre=time(21), CapacidadComensales=capacidad
+        ))
+        await db.commit()
+    servicio = DBService()
+    await servicio.disponibilidad.cargar()
+    return servicio
+
+def test_la_clave_depende_de_la_sesion_la_operacion_y_los_valores():
+    valores = {"NumComensales": 2, "FechaHora": FECHA}
+    assert clave_idempotencia("s1", "crear_reserva", valores) == clave_idempotencia("s1", "crear_reserva", dict(valores))
+    assert clave_idempotencia("s1", "crear_reserva", valores) != clave_idempotencia("s2", "crear_reserva", valores)
+    assert clave_idempotencia("s1", "crear_reserva", valores) != clave_idempotencia("s1", "crear_reserva", {**valores, "NumComensales": 3})
+
+async def test_repetir_la_llamada_devuelve_la_misma_reserva(catalogo):
+    servicio = await _servicio(catalogo, capacidad=10)
+    primera = await servicio.handle_crear_reserva(catalogo, 1, ARGS, session_id="sesion-1")
+    segunda = await servicio.handle_crear_reserva(catalogo, 1, dict(ARGS), session_id="sesion-1")
+
+    assert primera["status"] == segunda["status"] == "exito"
+    assert segunda["reserva_id"] == primera["reserva_id"]
+    assert segunda["duplicada"] is True
+    assert await _reservas(catalogo) == 1
+    # El duplicado no vuelve a tomar cupo
+    assert servicio.disponibilidad.cupo_libre(3, FECHA) == 6
+
+async def test_la_clave_se_recuerda_en_la_bd_tras_reiniciar(catalogo):
+    primera = await (await _servicio(catalogo)).handle_crear_reserva(catalogo, 1, ARGS, session_id="sesion-1")
+    # Otro proceso (o tras reiniciar): la caché está vacía y la clave sale de ReservasIdempotencia
+    segunda = await (await _servicio(catalogo)).handle_crear_reserva(catalogo, 1, ARGS, session_id="sesion-1")
+    assert segunda["reserva_id"] == primera["reserva_id"]
+    assert await _reservas(catalogo) == 1
+
+async def test_otra_sesion_u_otros_datos_crean_otra_reserva(catalogo):
+    servicio = await _servicio(catalogo)
+    a = await servicio.handle_crear_reserva(catalogo, 1, ARGS, session_id="sesion-1")
+    b = await servicio.handle_crear_reserva(catalogo, 1, ARGS, session_id="sesion-2")
+    c = await servicio.handle_crear_reserva(catalogo, 1, {**ARGS, "num_comensales": 5}, session_id="sesion-1")
+    assert len({a["reserva_id"], b["reserva_id"], c["reserva_id"]}) == 3
+    assert "duplicada" not in c
+
+async def test_sin_sesion_no_hay_idempotencia(catalogo):
+    servicio = await _servicio(catalogo)
+    await servicio.handle_crear_reserva(catalogo, 1, ARGS)
+    await servicio.handle_crear_reserva(catalogo, 1, ARGS)
+    assert await _reservas(catalogo) == 2
+
+async def test_llamadas_concurrentes_crean_una_sola_reserva(catalogo):
+    servicio = await _servicio(catalogo, capacidad=10)
+
+    async def llamar():
+        async with database.AsyncSessionFactory() as db:
+            return await servicio.handle_crear_reserva(db, 1, ARGS, session_id="sesion-1")
+
+    resultados = await asyncio.gather(llamar(), llamar(), llamar())
+    assert {r["status"] for r in resultados} == {"exito"}
+    assert len({r["reserva_id"] for r in resultados}) == 1
+    assert sum(bool(r.get("duplicada")) for r in resultados) == 2
+    assert await _reservas(catalogo) == 1
+    assert servicio.disponibilidad.cupo_libre(3, FECHA) == 6
+
+async def test_una_llamada_rechazada_por_cupo_no_guarda_la_clave(catalogo):
+    servicio = await _servicio(catalogo, capacidad=3)
+    rechazada = await servicio.handle_crear_reserva(catalogo, 1, ARGS, session_id="sesion-1")
+    assert rechazada["status"] == "sin_cupo"
+    total = (await catalogo.execute(select(func.count()).select_from(models.ReservaIdempotencia))).scalar_one()
+    assert total == 0
+
+@pytest.mark.parametrize("mismo_proceso", [True, False])
+async def test_cancelar_y_volver_a_reservar_en_la_misma_sesion(catalogo, mismo_proceso):
+    servicio = await _servicio(catalogo, capacidad=10)
+    primera = await servicio.handle_crear_reserva(catalogo, 1, ARGS, session_id="sesion-1")
+    await servicio.cambiar_estado_reservas(catalogo, "cancelar", [primera["reserva_id"]])
+
+    # En otro proceso la caché no se enteró de la cancelación: decide la BD
+    otro = servicio if mismo_proceso else await _servicio(catalogo, capacidad=None)
+    segunda = await otro.handle_crear_reserva(catalogo, 1, dict(ARGS), session_id="sesion-1")
+    assert segunda["status"] == "exito"
+    assert "duplicada" not in segunda
+    assert segunda["reserva_id"] != primera["reserva_id"]
+    assert await _reservas(catalogo) == 2
+
+    # La clave apunta ahora a la reserva nueva
+    tercera = await otro.handle_crear_reserva(catalogo, 1, dict(ARGS), session_id="sesion-1")
+    assert tercera["duplicada"] is True
+    assert tercera["reserva_id"] == segunda["reserva_id"]
@@ -0,0 +1,98 @@
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import database
+import models
+import services
+import sincronizacion_crm
+from conftest import a_las, proximo_dia
+from database import EnrutadorLecturas
+from services import DBService
+from sincronizacion_crm import SincronizacionCRMService
+
+pytestmark = pytest.mark.anyio
+
+def _adelantar(enrutador: EnrutadorLecturas, user_id: int, segundos: float):
+    """Como si la última escritura del usuario hubiera sido `segundos` antes."""
+    enrutador._ultimas_escrituras[user_id] -= segundos
+
+async def _base(ruta: str, nombre: str) -> sessionmaker:
+    """Un archivo SQLite con una sola experiencia que dice de qué base es."""
+    url = f"sqlite+aiosqlite:///{ruta}"
+    motor = create_async_engine(url, **database._opciones_motor(url))
+    async with motor.begin() as conn:
+        await conn.run_sync(database.Base.metadata.create_all)
+    fabrica = sessionmaker(bind=motor, class_=AsyncSession, expire_on_commit=False)
+    async with fabrica() as db:
+        db.add(models.Experiencia(Id=1, Codigo="X", Nombre=nombre))
+        await db.commit()
+    return fabrica
+
+async def _leida_de(enrutador: EnrutadorLecturas, user_id: int) -> str:
+    async with enrutador.session_factory(user_id)() as db:
+        return (await db.execute(select(models.Experiencia.Nombre))).scalar_one()
+
+async def test_lecturas_con_dos_bases_locales(tmp_path):
+    primario = await _base(str(tmp_path / "primario.db"), "primario")
+    replica = await _base(str(tmp_path / "replica.db"), "replica")
+    enrutador = EnrutadorLecturas(10.0, primario=primario, replica=replica)
+    try:
+        assert await _leida_de(enrutador, 1) == "replica"
+        assert await _leida_de(enrutador, None) == "replica"
+
+        enrutador.registrar_escritura(1)
+        _adelantar(enrutador, 1, 9.5)
+        # Dentro de la ventana el que escribió lee del primario; los demás siguen en la réplica
+        assert await _leida_de(enrutador, 1) == "primario"
+        assert await _leida_de(enrutador, 2) == "replica"
+
+        _adelantar(enrutador, 1, 1)
+        assert await _leida_de(enrutador, 1) == "replica"
+    finally:
+        for fabrica in (primario, replica):
+            await fabrica.kw["bind"].dispose()
+
+@pytest.fixture
+def enrutador(monkeypatch):
+    enrutador = EnrutadorLecturas(10.0)
+    for modulo in (services, sincronizacion_crm):
+        monkeypatch.setattr(modulo, "enrutador_lecturas", enrutador)
+    return enrutador
+
+async def test_las_transiciones_en_bloque_registran_la_escritura(catalogo, enrutador):
+    reserva = models.Reserva(
+        UsuarioId=1, NombreReserva="Ana", NumComensales=2, ExperienciaId=1,
+        FechaHora=a_las(proximo_dia(2), 20), Estado="pendiente"
+    )
+    catalogo.add(reserva)
+    await catalogo.commit()
+
+    await DBService().cambiar_estado_reservas(catalogo, "confirmar", [reserva.Id])
+    assert enrutador.debe_leer_del_primario(1)
+
+async def test_la_lista_de_espera_registra_la_escritura(catalogo, enrutador):
+    servicio = DBService()
+    args = {
+        "experiencia_id": 3, "fecha_hora": a_las(proximo_dia(2), 16).isoformat(),
+        "num_comensales": 2, "nombre_reserva": "Ana"
+    }
+    respuesta = await servicio.handle_unirse_lista_espera(catalogo, 1, args)
+    assert respuesta["status"] == "exito"
+    assert enrutador.debe_leer_del_primario(1)
+
+    _adelantar(enrutador, 1, 11)
+    assert not enrutador.debe_leer_del_primario(1)
+    respuesta = await servicio.handle_cancelar_lista_espera(catalogo, 1, {"lista_espera_id": respuesta["lista_espera_id"]})
+    assert respuesta["status"] == "exito"
+    assert enrutador.debe_leer_del_primario(1)
+
+async def test_la_importacion_del_crm_registra_la_escritura(catalogo, enrutador):
+    async def ndjson():
+        yield b'{"nombre": "Ana", "email": "ana@example.com"}\n{"nombre": "Luis", "email": "luis@example.com"}\n'
+
+    await SincronizacionCRMService(DBService()).importar_usuarios(catalogo, ndjson())
+    luis = (await catalogo.execute(select(models.Usuario.Id).where(models.Usuario.Email == "luis@example.com"))).scalar_one()
+    assert enrutador.debe_leer_del_primario(1)
+    assert enrutador.debe_leer_del_primario(luis)
@@ -0,0 +1,119 @@
+import pytest
+from sqlalchemy import false, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateIndex
+
+import database
+import models
+import services
+from conftest import a_las, proximo_dia
+from lista_espera import _SELECT_CANDIDATOS
+from services import DBService
+
+pytestmark = pytest.mark.anyio
+
+DIA = proximo_dia(5)
+TURNO = a_las(DIA, 16)
+
+def _args(nombre: str, fecha_hora=TURNO) -> dict:
+    return {"experiencia_id": 3, "fecha_hora": fecha_hora.isoformat(), "num_comensales": 2, "nombre_reserva": nombre}
+
+async def _usuario(db, usuario_id: int):
+    db.add(models.Usuario(Id=usuario_id, Nombre=f"Cliente {usuario_id}", Email=f"cliente{usuario_id}@example.com"))
+    await db.commit()
+
+async def test_el_puesto_respeta_la_prioridad(catalogo):
+    servicio = DBService()
+    for usuario_id in (2, 3):
+        await _usuario(catalogo, usuario_id)
+    primero = await servicio.handle_unirse_lista_espera(catalogo, 1, _args("Ana"))
+    # Cliente frecuente: la prioridad la pone el equipo, no el chat
+    catalogo.add(models.ListaEspera(
+        UsuarioId=2, ExperienciaId=3, FechaHora=TURNO, NumComensales=2, NombreReserva="Frecuente", Prioridad=5
+    ))
+    await catalogo.commit()
+    tercero = await servicio.handle_unirse_lista_espera(catalogo, 3, _args("Luis"))
+
+    assert primero["puesto"] == 1
+    assert tercero["puesto"] == 3
+    # Volver a pedirlo no duplica la solicitud y ya refleja que el frecuente va delante
+    assert (await servicio.handle_unirse_lista_espera(catalogo, 1, _args("Ana")))["puesto"] == 2
+
+async def test_los_candidatos_salen_en_el_orden_del_indice(catalogo):
+    await _usuario(catalogo, 2)
+    for usuario_id, fecha_hora, prioridad in [(1, TURNO, 0), (1, a_las(DIA, 15), 0), (2, TURNO, 3), (2, a_las(DIA, 15), 1)]:
+        catalogo.add(models.ListaEspera(
+            UsuarioId=usuario_id, ExperienciaId=3, FechaHora=fecha_hora, NumComensales=2,
+            NombreReserva="Ana", Prioridad=prioridad
+        ))
+    await catalogo.commit()
+    result = await catalogo.execute(_SELECT_CANDIDATOS, {
+        "experiencia_id": 3, "desde": a_las(DIA, 0), "hasta": a_las(DIA, 23, 59)
+    })
+    assert [(e.FechaHora.hour, e.Prioridad) for e in result.scalars()] == [(15, 1), (15, 0), (16, 3), (16, 0)]
+
+    indice = next(i for i in models.ListaEspera.__table__.indexes if i.name == "IX_ListaEspera_Turno")
+    ddl = str(CreateIndex(indice).compile(dialect=database.engine.dialect))
+    assert ddl.endswith('("ExperienciaId", "Estado", "FechaHora", "Prioridad" DESC, "Id")')
+
+async def test_cancelar_solo_retira_las_solicitudes_propias_que_esperan(catalogo):
+    servicio = DBService()
+    await _usuario(catalogo, 2)
+    mia = await servicio.handle_unirse_lista_espera(catalogo, 1, _args("Ana"))
+    otra = await servicio.handle_unirse_lista_espera(catalogo, 1, _args("Ana", a_las(DIA, 17)))
+    ajena = await servicio.handle_unirse_lista_espera(catalogo, 2, _args("Luis"))
+
+    # Otro usuario no puede retirarla
+    respuesta = await servicio.handle_cancelar_lista_espera(catalogo, 2, {"lista_espera_id": mia["lista_espera_id"]})
+    assert respuesta["status"] == "info"
+
+    respuesta = await servicio.handle_cancelar_lista_espera(catalogo, 1, {"lista_espera_id": mia["lista_espera_id"]})
+    assert respuesta == {"status": "exito", "message": respuesta["message"], "canceladas": 1}
+    # Ya cancelada: nada que hacer
+    assert (await servicio.handle_cancelar_lista_espera(catalogo, 1, {"lista_espera_id": mia["lista_espera_id"]}))["status"] == "info"
+    # Por experiencia, sin horario: todas las del usuario en esa experiencia
+    assert (await servicio.handle_cancelar_lista_espera(catalogo, 1, {"experiencia_id": 3}))["canceladas"] == 1
+    assert (await servicio.handle_cancelar_lista_espera(catalogo, 1, {}))["status"] == "error"
+
+    catalogo.expire_all()
+    estados = dict((await catalogo.execute(select(models.ListaEspera.Id, models.ListaEspera.Estado))).all())
+    assert estados == {
+        mia["lista_espera_id"]: "cancelada", otra["lista_espera_id"]: "cancelada", ajena["lista_espera_id"]: "esperando"
+    }
+    # El que queda sube al primer puesto del turno
+    assert (await servicio.handle_unirse_lista_espera(catalogo, 2, _args("Luis")))["puesto"] == 1
+
+def _espera(usuario_id=1, estado="esperando") -> models.ListaEspera:
+    return models.ListaEspera(
+        UsuarioId=usuario_id, ExperienciaId=3, FechaHora=TURNO, NumComensales=2, NombreReserva="Ana", Estado=estado
+    )
+
+async def test_la_bd_impide_dos_solicitudes_activas_para_el_mismo_turno(catalogo):
+    # Las ya cerradas no cuentan
+    catalogo.add_all([_espera(estado="cancelada"), _espera(estado="promovida"), _espera()])
+    await catalogo.commit()
+    catalogo.add(_espera())
+    with pytest.raises(IntegrityError):
+        await catalogo.commit()
+
+async def test_unirse_en_carrera_devuelve_la_solicitud_existente(catalogo, monkeypatch):
+    existente = _espera()
+    catalogo.add(existente)
+    await catalogo.commit()
+    existente_id = existente.Id
+    execute = catalogo.execute
+    consultas = []
+
+    async def execute_en_carrera(stmt, *args, **kwargs):
+        # La primera consulta no ve la solicitud: la otra llamada aún no había hecho commit
+        if stmt is services._SELECT_ESPERA_ACTIVA and not consultas:
+            consultas.append(stmt)
+            stmt = stmt.where(false())
+        return await execute(stmt, *args, **kwargs)
+
+    monkeypatch.setattr(catalogo, "execute", execute_en_carrera)
+    respuesta = await DBService().handle_unirse_lista_espera(catalogo, 1, _args("Ana"))
+    assert respuesta["status"] == "exito"
+    assert respuesta["lista_espera_id"] == existente_id
+    total = (await catalogo.execute(select(func.count()).select_from(models.ListaEspera))).scalar_one()
+    assert total == 1
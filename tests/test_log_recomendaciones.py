@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+
+import database
+import models
+from services import RecomendacionesLogWriter
+
+pytestmark = pytest.mark.anyio
+
+def _fila(experiencia_id: int = 1) -> dict:
+    return {"UsuarioId": 1, "MotivoVisita": "Turismo", "ExperienciaRecomendadaId": experiencia_id}
+
+def _writer(**opciones) -> RecomendacionesLogWriter:
+    opciones = {"tamano_lote": 100, "intervalo_segundos": 60, "max_pendientes": 1000, **opciones}
+    return RecomendacionesLogWriter(session_factory=database.AsyncSessionFactory, **opciones)
+
+async def _en_bd(db) -> int:
+    return (await db.execute(select(func.count()).select_from(models.RecomendacionesLog))).scalar_one()
+
+async def test_escribe_al_llenarse_el_lote(catalogo):
+    writer = _writer(tamano_lote=3)
+    writer.iniciar()
+    try:
+        for _ in range(2):
+            writer.registrar(_fila())
+        await asyncio.sleep(0.05)
+        assert writer.escritas == 0
+        writer.registrar(_fila())
+        await asyncio.sleep(0.05)
+        assert (writer.escritas, writer.lotes) == (3, 1)
+        assert await _en_bd(catalogo) == 3
+    finally:
+        await writer.detener()
+
+async def test_escribe_al_vencer_el_intervalo(catalogo):
+    writer = _writer(intervalo_segundos=0.05)
+    writer.iniciar()
+    try:
+        writer.registrar(_fila())
+        await asyncio.sleep(0.2)
+        assert writer.metricas()["pendientes"] == 0
+        assert writer.escritas == 1
+    finally:
+        await writer.detener()
+
+async def test_descarta_con_el_buffer_lleno(catalogo):
+    writer = _writer(max_pendientes=2)
+    assert [writer.registrar(_fila()) for _ in range(3)] == [True, True, False]
+    assert writer.descartadas == 1
+    await writer.detener()
+    assert writer.escritas == 2
+
+async def test_detener_escribe_lo_pendiente_y_luego_descarta(catalogo):
+    writer = _writer()
+    writer.iniciar()
+    writer.registrar(_fila(1))
+    writer.registrar(_fila(2))
+    await writer.detener()
+    assert writer.escritas == 2
+    assert await _en_bd(catalogo) == 2
+
+    # Después de detener nadie la escribiría: se rechaza y se cuenta
+    assert writer.registrar(_fila(3)) is False
+    assert writer.metricas()["descartadas"] == 1
+    assert writer.metricas()["pendientes"] == 0
@@ -0,0 +1,83 @@
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+import models
+import services
+from conftest import a_las, proximo_dia
+from services import actualizar_ocupacion_diaria, transicionar_reservas
+
+pytestmark = pytest.mark.anyio
+
+TURNO = a_las(proximo_dia(2), 19)
+
+@pytest.fixture(params=[True, False], ids=["upsert", "sqlserver"])
+def upsert_nativo(request, monkeypatch):
+    if not request.param:
+        # Camino de SQL Server: UPDATE y, si no había fila, INSERT
+        monkeypatch.setattr(services, "_UPSERT_OCUPACION", None)
+    return request.param
+
+async def _resumen(db) -> list:
+    db.expire_all()
+    tabla = models.OcupacionDiaria
+    result = await db.execute(select(tabla.HoraTurno, tabla.Comensales, tabla.Reservas).order_by(tabla.HoraTurno))
+    return [(f.HoraTurno.strftime("%H:%M"), f.Comensales, f.Reservas) for f in result]
+
+async def _reserva_anterior_al_resumen(db, fecha_hora, comensales) -> int:
+    reserva = models.Reserva(
+        UsuarioId=1, NombreReserva="Ana", NumComensales=comensales, ExperienciaId=3,
+        FechaHora=fecha_hora, Estado="pendiente"
+    )
+    db.add(reserva)
+    await db.commit()
+    return reserva.Id
+
+async def test_suma_y_resta_por_turno(catalogo, upsert_nativo):
+    await actualizar_ocupacion_diaria(catalogo, [(TURNO, 3, 4), (TURNO + timedelta(minutes=10), 3, 2)], signo=1)
+    await actualizar_ocupacion_diaria(catalogo, [(TURNO, 3, 3)], signo=1)
+    await actualizar_ocupacion_diaria(catalogo, [(TURNO, 3, 4)], signo=-1)
+    await catalogo.commit()
+    assert await _resumen(catalogo) == [("19:00", 5, 2)]
+
+async def test_cancelar_una_reserva_anterior_al_resumen_no_crea_filas_negativas(catalogo, upsert_nativo):
+    reserva_id = await _reserva_anterior_al_resumen(catalogo, TURNO, 4)
+    await transicionar_reservas(catalogo, "cancelar", [reserva_id])
+    await catalogo.commit()
+    assert await _resumen(catalogo) == []
+
+async def test_cancelar_una_reserva_no_contada_deja_el_turno_en_cero(catalogo, upsert_nativo):
+    reserva_id = await _reserva_anterior_al_resumen(catalogo, TURNO, 6)
+    # Una reserva nueva del mismo turno ya creó la fila del resumen
+    await actualizar_ocupacion_diaria(catalogo, [(TURNO, 3, 2)], signo=1)
+    await catalogo.commit()
+    await transicionar_reservas(catalogo, "cancelar", [reserva_id])
+    await catalogo.commit()
+    assert await _resumen(catalogo) == [("19:00", 0, 0)]
+
+class _CarreraEnElTurno:
+    """Sesión que simula otra transacción creando la fila del turno justo después del UPDATE."""
+
+    def __init__(self, db):
+        self.db = db
+        self.pendiente = True
+
+    async def execute(self, stmt, parametros=None):
+        if stmt is services._UPDATE_OCUPACION and self.pendiente:
+            self.pendiente = False
+            await self.db.execute(services._INSERT_OCUPACION, {
+                "Fecha": TURNO.date(), "HoraTurno": TURNO.time(), "ExperienciaId": 3, "Comensales": 5, "Reservas": 1
+            })
+            return SimpleNamespace(rowcount=0)
+        return await self.db.execute(stmt, parametros)
+
+    def begin_nested(self):
+        return self.db.begin_nested()
+
+async def test_sqlserver_reintenta_si_otro_crea_la_fila_del_turno(catalogo, monkeypatch):
+    monkeypatch.setattr(services, "_UPSERT_OCUPACION", None)
+    await actualizar_ocupacion_diaria(_CarreraEnElTurno(catalogo), [(TURNO, 3, 4)], signo=1)
+    await catalogo.commit()
+    assert await _resumen(catalogo) == [("19:00", 9, 2)]
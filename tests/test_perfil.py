@@ -0,0 +1,87 @@
+import pytest
+from sqlalchemy import select
+
+import models
+import services
+from services import DBService, aplicar_patch_perfil, etiquetas_de_perfil
+
+async def _version(db) -> int:
+    db.expire_all()
+    return (await db.execute(select(models.Preferencia.Version).where(models.Preferencia.UsuarioId == 1))).scalar_one()
+
+def test_agregar_ignora_mayusculas_tildes_y_espacios():
+    perfil = {"alergias": ["maní"]}
+    nuevo = aplicar_patch_perfil(perfil, {"alergias": ["Mani", "  Nueces ", "nueces", "   "]}, {})
+    assert nuevo == {"alergias": ["maní", "Nueces"]}
+
+def test_quitar_ignora_mayusculas_y_tildes():
+    perfil = {"alergias": ["mani", "gluten"], "gustos": ["Café"]}
+    nuevo = aplicar_patch_perfil(perfil, {}, {"alergias": ["Maní"], "gustos": ["cafe"]})
+    assert nuevo == {"alergias": ["gluten"], "gustos": []}
+
+def test_no_modifica_el_perfil_original():
+    perfil = {"alergias": ["mani"]}
+    aplicar_patch_perfil(perfil, {"alergias": ["nueces"]}, {"alergias": ["mani"]})
+    assert perfil == {"alergias": ["mani"]}
+
+def test_conserva_otras_claves_y_no_crea_listas_vacias():
+    perfil = {"alergias": ["mani"], "notas": "mesa junto a la ventana"}
+    nuevo = aplicar_patch_perfil(perfil, {"gustos": ["cacao"]}, {"disgustos": ["cilantro"]})
+    assert nuevo == {"alergias": ["mani"], "notas": "mesa junto a la ventana", "gustos": ["cacao"]}
+
+def test_quitar_y_volver_a_agregar_en_el_mismo_patch_deja_el_valor_nuevo():
+    nuevo = aplicar_patch_perfil({"restricciones": ["Vegano"]}, {"restricciones": ["vegano"]}, {"restricciones": ["VEGANO"]})
+    assert nuevo == {"restricciones": ["vegano"]}
+
+def test_descarta_valores_que_no_son_texto():
+    nuevo = aplicar_patch_perfil({"alergias": ["mani", None, 3]}, {"alergias": ["soya"]}, {})
+    assert nuevo == {"alergias": ["mani", "soya"]}
+
+def test_patch_sin_cambios_devuelve_un_perfil_igual():
+    perfil = {"alergias": ["mani"], "gustos": []}
+    assert aplicar_patch_perfil(perfil, {"alergias": ["MANÍ"]}, {"gustos": ["cacao"]}) == perfil
+
+def test_etiquetas_con_codigo_canonico_y_sin_duplicados():
+    filas = etiquetas_de_perfil(7, {
+        "alergias": ["Maní", "mani ", "nueces y almendras"],
+        "gustos": ["ceviche", "Ceviche"],
+        "notas": ["no es una lista del perfil"]
+    })
+    assert filas == [
+        {"UsuarioId": 7, "Tipo": "alergia", "Valor": "maní", "Codigo": "mani"},
+        {"UsuarioId": 7, "Tipo": "alergia", "Valor": "mani", "Codigo": "mani"},
+        {"UsuarioId": 7, "Tipo": "alergia", "Valor": "nueces y almendras", "Codigo": "frutos_secos"},
+        {"UsuarioId": 7, "Tipo": "gusto", "Valor": "ceviche", "Codigo": None},
+    ]
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("upsert_nativo", [True, False])
+async def test_cada_escritura_del_perfil_incrementa_la_version(catalogo, monkeypatch, upsert_nativo):
+    if not upsert_nativo:
+        # Camino de SQL Server: SELECT + UPDATE/INSERT con el ORM
+        monkeypatch.setattr(services, "_UPSERT_PREFERENCIA", None)
+    servicio = DBService()
+
+    await servicio.handle_guardar_perfil(catalogo, 1, {"alergias": ["maní"]})
+    assert await _version(catalogo) == 1
+    await servicio.handle_guardar_perfil(catalogo, 1, {"alergias": ["maní", "nueces"]})
+    assert await _version(catalogo) == 2
+    respuesta = await servicio.handle_actualizar_perfil(catalogo, 1, {"quitar": {"alergias": ["nueces"]}})
+    assert respuesta["perfil"] == {"alergias": ["maní"]}
+    assert await _version(catalogo) == 3
+
+@pytest.mark.anyio
+async def test_el_update_versionado_no_pisa_una_escritura_posterior(catalogo):
+    servicio = DBService()
+    await servicio.handle_guardar_perfil(catalogo, 1, {"alergias": ["maní"]})
+    fila = (await catalogo.execute(services._SELECT_PERFIL_VERSIONADO, {"user_id": 1})).first()
+    # Otro cambio llega entre la lectura y la escritura
+    await servicio.handle_guardar_perfil(catalogo, 1, {"alergias": ["gluten"]})
+
+    result = await catalogo.execute(
+        services._UPDATE_PERFIL_VERSIONADO,
+        {"preferencia_id": fila.Id, "datos_json": "{}", "version_leida": fila.Version}
+    )
+    assert result.rowcount == 0
+    await catalogo.rollback()
+    assert await _version(catalogo) == 2
@@ -0,0 +1,72 @@
+import pytest
+
+import models
+from conftest import a_las, proximo_dia
+from recomendador import rasgos_de_entrada
+from services import DBService
+
+def _acompanantes(motivo, acompanantes, estilo) -> list:
+    return [r for r in rasgos_de_entrada(motivo, acompanantes, estilo) if r.startswith("acompanantes:")]
+
+@pytest.mark.parametrize("motivo, acompanantes, estilo, esperado", [
+    ("Turismo", "Solo", "Gourmet", ["acompanantes:solo"]),
+    ("Turismo", " sola ", "Gourmet", ["acompanantes:solo"]),
+    ("Turismo", "voy sola esta vez", "Gourmet", ["acompanantes:solo"]),
+    # "solo" como adverbio no dice nada de los acompañantes
+    ("Solo quiero celebrar", "Pareja", "Gourmet", ["acompanantes:pareja"]),
+    ("Turismo", "Amigos", "solo algo vegano", ["acompanantes:amigos"]),
+    ("Turismo", "solo con mi familia", "Tradicional", ["acompanantes:familia"]),
+])
+def test_solo_como_acompanante_y_como_adverbio(motivo, acompanantes, estilo, esperado):
+    assert _acompanantes(motivo, acompanantes, estilo) == esperado
+
+ARGS = {"motivo_visita": "Turismo", "acompanantes": "Pareja", "estilo_cocina": "Gourmet", "num_comensales": 2}
+
+@pytest.mark.anyio
+async def test_dos_sesiones_comparten_la_cache_de_recomendaciones(catalogo):
+    servicio = DBService()
+    # Cada sesión de chat nueva recarga el catálogo antes de recomendar
+    await servicio.get_all_experiences(catalogo)
+    version = servicio.recomendador.version
+    primera = await servicio.handle_recomendar_experiencia(catalogo, 1, dict(ARGS))
+    await servicio.get_all_experiences(catalogo)
+    segunda = await servicio.handle_recomendar_experiencia(catalogo, 1, dict(ARGS))
+
+    assert primera["status"] == "exito"
+    assert segunda == primera
+    assert servicio.recomendador.version == version
+    assert servicio.recomendacion_cache.aciertos == 1
+
+@pytest.mark.anyio
+async def test_un_cambio_en_el_catalogo_reconstruye_la_matriz(catalogo):
+    servicio = DBService()
+    await servicio.get_all_experiences(catalogo)
+    version = servicio.recomendador.version
+    experiencia = await catalogo.get(models.Experiencia, 2)
+    experiencia.Descripcion = "Degustación de cafés de especialidad"
+    await catalogo.commit()
+
+    await servicio.get_all_experiences(catalogo)
+    assert servicio.recomendador.version == version + 1
+
+@pytest.mark.anyio
+async def test_la_recomendacion_incluye_lo_que_reservaron_clientes_parecidos(catalogo):
+    catalogo.add(models.Usuario(Id=2, Nombre="Bruno", Email="bruno@example.com"))
+    catalogo.add_all(
+        models.PerfilEtiqueta(UsuarioId=u, Tipo="gusto", Valor="cacao", Codigo=None) for u in (1, 2)
+    )
+    catalogo.add(models.Reserva(
+        UsuarioId=2, NombreReserva="Bruno", NumComensales=2, ExperienciaId=3,
+        FechaHora=a_las(proximo_dia(2), 16), Estado="confirmada"
+    ))
+    await catalogo.commit()
+    servicio = DBService()
+    await servicio.clientes_similares.cargar()
+
+    respuesta = await servicio.handle_recomendar_experiencia(catalogo, 1, dict(ARGS))
+    assert respuesta["clientes_como_tu"] == [
+        {"id": 3, "nombre": "Theobromas Lab", "clientes": 1, "ya_reservada": False}
+    ]
+    # Otro usuario con las mismas respuestas recibe la entrada de caché sin los datos de Ana
+    otro = await servicio.handle_recomendar_experiencia(catalogo, None, dict(ARGS))
+    assert "clientes_como_tu" not in otro
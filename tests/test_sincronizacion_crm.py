@@ -0,0 +1,43 @@
+import json
+
+import pytest
+from sqlalchemy import func, select
+
+import models
+import sincronizacion_crm
+from services import DBService
+from sincronizacion_crm import SincronizacionCRMService
+
+pytestmark = pytest.mark.anyio
+
+async def _ndjson(*lineas):
+    # En dos trozos para ejercitar el corte de líneas entre chunks
+    datos = "\n".join(json.dumps(linea) for linea in lineas).encode()
+    yield datos[:10]
+    yield datos[10:]
+
+async def _usuarios(db) -> list:
+    db.expire_all()
+    return (await db.execute(select(models.Usuario.Email, models.Usuario.Nombre).order_by(models.Usuario.Id))).all()
+
+@pytest.mark.parametrize("upsert_nativo", [True, False])
+async def test_el_email_se_compara_sin_mayusculas(catalogo, monkeypatch, upsert_nativo):
+    if not upsert_nativo:
+        monkeypatch.setattr(sincronizacion_crm, "_UPSERT_PREFERENCIAS", None)
+    sincronizacion = SincronizacionCRMService(DBService())
+
+    resultado = await sincronizacion.importar_usuarios(catalogo, _ndjson(
+        {"nombre": "Ana María", "email": "ANA@Example.com", "perfil": {"alergias": ["maní"]}},
+        {"nombre": "Luis", "email": "Luis@example.com"},
+    ))
+    assert (resultado.insertadas, resultado.actualizadas, resultado.invalidas) == (1, 1, 0)
+
+    # Otra vez, con otras mayúsculas: todo son actualizaciones
+    resultado = await sincronizacion.importar_usuarios(catalogo, _ndjson(
+        {"nombre": "Luis Pérez", "email": "luis@EXAMPLE.com", "perfil": {"alergias": ["gluten"]}},
+    ))
+    assert (resultado.insertadas, resultado.actualizadas) == (0, 1)
+    assert await _usuarios(catalogo) == [("ana@example.com", "Ana María"), ("Luis@example.com", "Luis Pérez")]
+
+    perfiles = (await catalogo.execute(select(func.count()).select_from(models.Preferencia))).scalar_one()
+    assert perfiles == 2
@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+import pytest
+
+from recomendador import Recomendador
+from tfidf import IndiceTfidf, raiz, terminos
+
+@pytest.mark.parametrize("palabras", [
+    ("ninos", "nino", "nina", "ninas"),
+    ("celebraciones", "celebracion", "celebrar"),
+    ("postres", "postre"),
+    ("flores", "flor"),
+])
+def test_plural_y_genero_comparten_raiz(palabras):
+    assert len({raiz(p) for p in palabras}) == 1
+
+def test_palabras_cortas_no_se_recortan():
+    assert raiz("mes") == "mes"
+    assert raiz("vino") == "vin"
+
+def _indice() -> IndiceTfidf:
+    indice = IndiceTfidf()
+    indice.construir([(1, "Cena de aniversario con maridaje"), (3, "Taller de cacao para niños y familias")])
+    return indice
+
+def test_el_singular_encuentra_el_plural_del_documento():
+    similitudes = _indice().similitudes("algo para mi niño")
+    assert similitudes[1] > 0 and similitudes[0] == 0
+
+def test_la_explicacion_usa_las_palabras_del_documento():
+    indice = _indice()
+    # Misma raíz, otra forma de escribirla: misma explicación (la caché las comparte)
+    assert indice.coincidencias("CACAO para la NIÑA", 3) == ["cacao", "niños"]
+    assert indice.coincidencias("cacao para el niño", 3) == ["cacao", "niños"]
+    assert [r for r, _ in terminos("CACAO para la NIÑA")] == [r for r, _ in terminos("cacao para el niño")]
+
+def test_las_palabras_clave_salen_del_catalogo():
+    experiencia = SimpleNamespace(Id=1, Activa=True, Nombre="Menú", Descripcion="Platos de estación", PalabrasClave=None)
+    otra = SimpleNamespace(Id=2, Activa=True, Nombre="Taller", Descripcion="Cacao", PalabrasClave=None)
+    motor = Recomendador()
+    motor.construir([experiencia, otra])
+    assert not motor.similitudes_texto("aniversario").any()
+
+    experiencia.PalabrasClave = "aniversario romantica"
+    assert motor.construir([experiencia, otra])
+    assert motor.similitudes_texto("aniversario")[0] > 0
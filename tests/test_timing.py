@@ -0,0 +1,54 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+import timing
+
+pytestmark = pytest.mark.anyio
+
+def _app(habilitado: bool) -> FastAPI:
+    """Como main.py: el middleware solo se instala con SERVER_TIMING_HABILITADO."""
+    app = FastAPI()
+
+    @app.get("/experiencias/{experiencia_id}")
+    async def experiencia(experiencia_id: int):
+        with timing.medir("catalogo"):
+            await asyncio.sleep(0.01)
+        with timing.medir("herramienta", "crear_reserva"):
+            pass
+        return {"id": experiencia_id}
+
+    if habilitado:
+        app.add_middleware(timing.MiddlewareServerTiming)
+    return app
+
+async def _get(app: FastAPI, url: str) -> httpx.Response:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://pruebas") as cliente:
+        return await cliente.get(url)
+
+@pytest.fixture(autouse=True)
+def histogramas(monkeypatch):
+    monkeypatch.setattr(timing, "_histogramas", {})
+
+async def test_cabecera_y_histogramas_con_el_middleware():
+    respuesta = await _get(_app(habilitado=True), "/experiencias/3")
+    assert respuesta.status_code == 200
+
+    tramos = [t.strip() for t in respuesta.headers["server-timing"].split(",")]
+    assert [t.split(";")[0] for t in tramos] == ["catalogo", "herramienta", "total"]
+    assert tramos[1].startswith('herramienta;desc="crear_reserva";dur=')
+    assert float(tramos[0].split("dur=")[1]) >= 10
+
+    metricas = timing.metricas()
+    # El total va por plantilla de ruta, no por URL
+    assert set(metricas) == {"catalogo", "herramienta.crear_reserva", "total GET /experiencias/{experiencia_id}"}
+    assert metricas["catalogo"]["n"] == 1
+    assert metricas["catalogo"]["max_ms"] >= 10
+
+async def test_sin_middleware_no_hay_cabecera_ni_tramos():
+    respuesta = await _get(_app(habilitado=False), "/experiencias/3")
+    assert respuesta.status_code == 200
+    assert "server-timing" not in respuesta.headers
+    assert timing.metricas() == {}
@@ -0,0 +1,82 @@
+from datetime import datetime, time, timedelta
+
+import pytest
+from sqlalchemy import select
+
+import models
+import services
+from conftest import a_las, proximo_dia
+from jobs import completar_reservas_pasadas
+from services import DBService
+
+pytestmark = pytest.mark.anyio
+
+TURNO = a_las(proximo_dia(3), 16)
+
+@pytest.fixture(params=[True, False], ids=["returning", "select"])
+def update_returning(request, monkeypatch):
+    if not request.param:
+        # Sin UPDATE ... RETURNING: SELECT de las filas aplicables y UPDATE por Id
+        monkeypatch.setattr(services, "soporta_update_returning", lambda: False)
+    return request.param
+
+async def _reservas(db, *estados, fecha_hora=TURNO) -> list:
+    reservas = [
+        models.Reserva(
+            UsuarioId=1, NombreReserva="Ana", NumComensales=2, ExperienciaId=3, FechaHora=fecha_hora, Estado=estado
+        )
+        for estado in estados
+    ]
+    db.add_all(reservas)
+    await db.commit()
+    return [r.Id for r in reservas]
+
+async def _estados(db) -> dict:
+    db.expire_all()
+    return dict((await db.execute(select(models.Reserva.Id, models.Reserva.Estado))).all())
+
+async def test_los_estados_de_origen_invalidos_quedan_como_no_aplicables(catalogo, update_returning):
+    pendiente, cancelada, confirmada = await _reservas(catalogo, "pendiente", "cancelada", "confirmada")
+
+    resultado = await DBService().cambiar_estado_reservas(catalogo, "confirmar", [pendiente, cancelada, confirmada, 9999])
+    assert resultado["estado"] == "confirmada"
+    assert resultado["actualizadas"] == 1
+    assert resultado["reserva_ids"] == [pendiente]
+    assert resultado["no_aplicables"] == [cancelada, confirmada, 9999]
+    assert await _estados(catalogo) == {pendiente: "confirmada", cancelada: "cancelada", confirmada: "confirmada"}
+
+async def test_cancelar_libera_el_cupo_y_descuenta_la_ocupacion(catalogo, update_returning):
+    catalogo.add(models.HorarioExperiencia(
+        ExperienciaId=3, HoraApertura=time(15), HoraCierre=time(21), CapacidadComensales=10
+    ))
+    await catalogo.commit()
+    servicio = DBService()
+    await servicio.disponibilidad.cargar()
+    args = {"experiencia_id": 3, "fecha_hora": TURNO.isoformat(), "num_comensales": 4, "nombre_reserva": "Ana"}
+    reservas = [(await servicio.handle_crear_reserva(catalogo, 1, args))["reserva_id"] for _ in range(2)]
+    assert servicio.disponibilidad.cupo_libre(3, TURNO) == 2
+
+    resultado = await servicio.cambiar_estado_reservas(catalogo, "cancelar", [reservas[0]])
+    assert resultado["actualizadas"] == 1
+    assert servicio.disponibilidad.cupo_libre(3, TURNO) == 6
+    catalogo.expire_all()
+    tabla = models.OcupacionDiaria
+    fila = (await catalogo.execute(select(tabla.Comensales, tabla.Reservas).where(tabla.ExperienciaId == 3))).one()
+    assert tuple(fila) == (4, 1)
+
+    # Volver a cancelarla no descuenta dos veces
+    resultado = await servicio.cambiar_estado_reservas(catalogo, "cancelar", [reservas[0]])
+    assert resultado["no_aplicables"] == [reservas[0]]
+    assert servicio.disponibilidad.cupo_libre(3, TURNO) == 6
+
+@pytest.mark.parametrize("tamano_lote", [1, 1000])
+async def test_el_cierre_diario_solo_completa_pendientes_y_confirmadas_pasadas(catalogo, update_returning, tamano_lote):
+    hasta = datetime(2026, 3, 2)
+    pasadas = await _reservas(catalogo, "pendiente", "confirmada", "cancelada", "no_show", fecha_hora=hasta - timedelta(hours=3))
+    futura, = await _reservas(catalogo, "pendiente", fecha_hora=hasta + timedelta(hours=20))
+
+    resultado = await completar_reservas_pasadas(tamano_lote=tamano_lote, hasta=hasta)
+    assert resultado["reservas_completadas"] == 2
+    estados = await _estados(catalogo)
+    assert [estados[i] for i in pasadas] == ["completada", "completada", "cancelada", "no_show"]
+    assert estados[futura] == "pendiente"
@@ -0,0 +1,134 @@
+"""
+Búsqueda por texto libre contra el catálogo de experiencias con TF-IDF.
+
+Las respuestas abiertas ("algo de cacao para los niños", "una cena de aniversario
+larga") se comparan con un documento por experiencia (Nombre, Descripcion y las
+palabras clave curadas en Experiencias.PalabrasClave). Los documentos se vectorizan
+al cargar el catálogo en una matriz (experiencias x términos) con filas de norma 1,
+así que la similitud coseno con todas las experiencias es un producto
+matriz-vector. Todo en proceso, sin servicios externos.
+
+Los términos son raíces de las palabras normalizadas (sin tildes ni mayúsculas,
+como en alergenos.py): sin la "s" del plural ni la vocal final y recortadas a sus
+primeras letras. Un lematizado burdo pero suficiente para que "niños"/"niño"/"niña"
+o "celebraciones"/"celebración"/"celebrar" coincidan.
+"""
+import math
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from alergenos import normalizar_texto
+
+LARGO_RAIZ = 6
+_PALABRA = re.compile(r"\w+")
+
+PALABRAS_VACIAS = set(
+    "a al algo ante como con de del el ella ellos en es esta este la las le lo los mas me mi mis muy "
+    "nos o para pero por que se ser si sin su sus te tu un una uno unos unas y ya yo quiero queremos "
+    "busco buscamos gustaria".split()
+)
+
+def raiz(palabra: str) -> str:
+    """Raíz de una palabra normalizada: sin la "s" final (plural) ni la vocal final
+       (género, y la "e" de los plurales en -es), recortada a LARGO_RAIZ letras."""
+    if len(palabra) > 3 and palabra.endswith("s"):
+        palabra = palabra[:-1]
+    if len(palabra) > 3 and palabra[-1] in "aeo":
+        palabra = palabra[:-1]
+    return palabra[:LARGO_RAIZ]
+
+@lru_cache(maxsize=4096)
+def terminos(texto: Optional[str]) -> Tuple[Tuple[str, str], ...]:
+    """(raíz, palabra original en minúsculas) de cada palabra con contenido del texto, en orden.
+       Se memoriza: las respuestas se repiten mucho y se tokenizan varias veces por petición."""
+    if not texto:
+        return ()
+    resultado = []
+    for original in _PALABRA.findall(texto.lower()):
+        for palabra in normalizar_texto(original).split():
+            if len(palabra) > 2 and palabra not in PALABRAS_VACIAS:
+                resultado.append((raiz(palabra), original))
+    return tuple(resultado)
+
+class IndiceTfidf:
+
+    def __init__(self):
+        self._ids: List[int] = []
+        self._vocabulario: Dict[str, int] = {}
+        self._idf = np.zeros(0, dtype=np.float32)
+        self._matriz = np.zeros((0, 0), dtype=np.float32)
+        # Por experiencia: raíz -> primera palabra del documento con esa raíz
+        self._palabras: List[Dict[str, str]] = []
+
+    @property
+    def ids(self) -> List[int]:
+        return self._ids
+
+    def construir(self, documentos: Iterable[Tuple[int, str]]):
+        """Vectoriza un documento por experiencia: [(experiencia_id, texto)]."""
+        ids, conteos, palabras = [], [], []
+        for experiencia_id, texto in documentos:
+            ids.append(experiencia_id)
+            conteo: Dict[str, int] = {}
+            palabras_doc: Dict[str, str] = {}
+            for r, original in terminos(texto):
+                conteo[r] = conteo.get(r, 0) + 1
+                palabras_doc.setdefault(r, original)
+            conteos.append(conteo)
+            palabras.append(palabras_doc)
+
+        vocabulario = {raiz: i for i, raiz in enumerate(sorted({r for c in conteos for r in c}))}
+        frecuencia_doc = np.zeros(len(vocabulario), dtype=np.float32)
+        matriz = np.zeros((len(ids), len(vocabulario)), dtype=np.float32)
+        for fila, conteo in enumerate(conteos):
+            for r, n in conteo.items():
+                matriz[fila, vocabulario[r]] = 1.0 + math.log(n)
+                frecuencia_doc[vocabulario[r]] += 1
+        # IDF suavizado: un término que está en todas las experiencias aún pesa algo
+        idf = np.log((1.0 + len(ids)) / (1.0 + frecuencia_doc)) + 1.0
+        matriz *= idf
+        normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+        matriz /= np.where(normas > 0, normas, 1.0)
+
+        self._ids, self._vocabulario, self._idf, self._matriz, self._palabras = (
+            ids, vocabulario, idf.astype(np.float32), matriz, palabras
+        )
+
+    def vector(self, texto: Optional[str]) -> Optional[np.ndarray]:
+        """Vector TF-IDF normalizado del texto, o None si no comparte términos con el catálogo."""
+        conteo: Dict[int, int] = {}
+        for r, _ in terminos(texto):
+            columna = self._vocabulario.get(r)
+            if columna is not None:
+                conteo[columna] = conteo.get(columna, 0) + 1
+        if not conteo:
+            return None
+        q = np.zeros(len(self._vocabulario), dtype=np.float32)
+        for columna, n in conteo.items():
+            q[columna] = (1.0 + math.log(n)) * self._idf[columna]
+        return q / np.linalg.norm(q)
+
+    def similitudes(self, texto: Optional[str]) -> Optional[np.ndarray]:
+        """Similitud coseno del texto con cada experiencia (en el orden de `ids`)."""
+        q = self.vector(texto)
+        return None if q is None else self._matriz @ q
+
+    def coincidencias(self, texto: Optional[str], experiencia_id: int, maximo: int = 3) -> List[str]:
+        """
+        Términos del texto que aparecen en el documento de la experiencia (para explicar),
+        con la palabra del documento: depende solo de las raíces del texto, que es lo que
+        entra en la clave de la caché de recomendaciones, y no de cómo las escribió el usuario.
+        """
+        if experiencia_id not in self._ids:
+            return []
+        fila = self._ids.index(experiencia_id)
+        pesos, palabras_doc = self._matriz[fila], self._palabras[fila]
+        palabras = []
+        for r, _ in terminos(texto):
+            columna = self._vocabulario.get(r)
+            if columna is not None and pesos[columna] > 0 and palabras_doc[r] not in palabras:
+                palabras.append(palabras_doc[r])
+        return palabras[:maximo]
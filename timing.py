@@ -0,0 +1,151 @@
+"""
+Tiempos por etapa de cada petición (cabecera Server-Timing) e histogramas de latencia.
+
+    with timing.medir("contexto"):
+        contexto = await db_service.get_user_context(db, user_id)
+
+Los tramos se guardan en una lista propia de la petición (ContextVar), que abre
+MiddlewareServerTiming. Al enviar la respuesta se añaden como cabecera
+`Server-Timing: contexto;dur=3.1, gemini;dur=2150.4, total;dur=2160.0` (visible en
+las herramientas de desarrollo del navegador) y cada duración se acumula en un
+histograma para /metricas.
+
+Sin el middleware (SERVER_TIMING_HABILITADO=false), `medir` solo lee la ContextVar
+y devuelve un contexto vacío.
+"""
+import bisect
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+# Límites superiores (ms) de los cubos de los histogramas
+LIMITES_MS: Tuple[float, ...] = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+# Tramos de la petición en curso: (nombre, descripción, ms); None = sin medición
+_tramos: ContextVar[Optional[List[Tuple[str, Optional[str], float]]]] = ContextVar("tramos_server_timing", default=None)
+
+class Histograma:
+    """Conteo por cubos de duración, con suma y máximo; los percentiles salen del cubo."""
+
+    def __init__(self):
+        self.conteos = [0] * (len(LIMITES_MS) + 1)
+        self.total = 0
+        self.suma_ms = 0.0
+        self.max_ms = 0.0
+
+    def observar(self, ms: float):
+        self.conteos[bisect.bisect_left(LIMITES_MS, ms)] += 1
+        self.total += 1
+        self.suma_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentil(self, p: float) -> Optional[float]:
+        """Límite superior del cubo donde cae el percentil p (0-100), sin pasar del máximo visto."""
+        if not self.total:
+            return None
+        objetivo = self.total * p / 100
+        acumulado = 0
+        for i, n in enumerate(self.conteos):
+            acumulado += n
+            if acumulado >= objetivo:
+                return min(LIMITES_MS[i], round(self.max_ms, 1)) if i < len(LIMITES_MS) else round(self.max_ms, 1)
+        return round(self.max_ms, 1)
+
+    def metricas(self) -> dict:
+        return {
+            "n": self.total,
+            "media_ms": round(self.suma_ms / self.total, 1) if self.total else None,
+            "max_ms": round(self.max_ms, 1),
+            "p50_ms": self.percentil(50),
+            "p95_ms": self.percentil(95),
+            "p99_ms": self.percentil(99)
+        }
+
+_histogramas: Dict[str, Histograma] = {}
+
+def observar(nombre: str, ms: float):
+    histograma = _histogramas.get(nombre)
+    if histograma is None:
+        histograma = _histogramas[nombre] = Histograma()
+    histograma.observar(ms)
+
+def metricas() -> dict:
+    return {nombre: h.metricas() for nombre, h in sorted(_histogramas.items())}
+
+class _Tramo:
+    __slots__ = ("nombre", "descripcion", "tramos", "inicio")
+
+    def __init__(self, nombre: str, descripcion: Optional[str], tramos: list):
+        self.nombre = nombre
+        self.descripcion = descripcion
+        self.tramos = tramos
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        ms = (time.perf_counter() - self.inicio) * 1000
+        self.tramos.append((self.nombre, self.descripcion, ms))
+        observar(f"{self.nombre}.{self.descripcion}" if self.descripcion else self.nombre, ms)
+        return False
+
+class _TramoNulo:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULO = _TramoNulo()
+
+def medir(nombre: str, descripcion: Optional[str] = None):
+    """Context manager que mide un tramo de la petición en curso (no hace nada fuera de una)."""
+    tramos = _tramos.get()
+    if tramos is None:
+        return _NULO
+    return _Tramo(nombre, descripcion, tramos)
+
+def _cabecera(tramos: List[Tuple[str, Optional[str], float]]) -> bytes:
+    partes = []
+    for nombre, descripcion, ms in tramos:
+        desc = f';desc="{descripcion}"' if descripcion else ""
+        partes.append(f"{nombre}{desc};dur={ms:.1f}")
+    return ", ".join(partes).encode("latin-1", errors="replace")
+
+class MiddlewareServerTiming:
+    """
+    Middleware ASGI: abre la lista de tramos de cada petición HTTP y, al empezar la
+    respuesta, añade la cabecera Server-Timing con los tramos medidos hasta ese
+    momento más el total. El total se acumula por método y ruta (plantilla, no la URL).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        tramos: List[Tuple[str, Optional[str], float]] = []
+        token = _tramos.set(tramos)
+        inicio = time.perf_counter()
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                total = (time.perf_counter() - inicio) * 1000
+                mensaje = {
+                    **mensaje,
+                    "headers": [*mensaje.get("headers", []), (b"server-timing", _cabecera([*tramos, ("total", None, total)]))]
+                }
+                ruta = getattr(scope.get("route"), "path", None)
+                if ruta:
+                    observar(f"total {scope['method']} {ruta}", total)
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            _tramos.reset(token)
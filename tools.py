@@ -31,6 +31,36 @@ guardar_perfil_alimentario = FunctionDeclaration(
     }
 )
 
+# Listas del perfil, reutilizadas por la herramienta de actualización parcial
+_listas_perfil = {
+    "type": "OBJECT",
+    "properties": {
+        "alergias": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "restricciones": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "disgustos": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "gustos": {"type": "ARRAY", "items": {"type": "STRING"}}
+    }
+}
+
+# 1b. Herramienta para cambios puntuales del perfil (sin reenviarlo completo)
+actualizar_perfil_alimentario = FunctionDeclaration(
+    name="actualizar_perfil_alimentario",
+    description="Aplica cambios puntuales al perfil alimentario ya guardado del usuario logueado: agrega o quita elementos de sus listas. Envía SOLO lo que cambia, no el perfil completo.",
+    parameters={
+        "type": "OBJECT",
+        "properties": {
+            "agregar": {
+                **_listas_perfil,
+                "description": "Elementos a agregar por lista (ej: {'alergias': ['mariscos']})."
+            },
+            "quitar": {
+                **_listas_perfil,
+                "description": "Elementos a quitar por lista (ej: {'restricciones': ['vegano']})."
+            }
+        }
+    }
+)
+
 # 2. Herramienta para crear la reserva
 crear_reserva = FunctionDeclaration(
     name="crear_reserva",
@@ -63,6 +93,92 @@ crear_reserva = FunctionDeclaration(
     }
 )
 
+# 2b. Herramienta para consultar horarios libres antes de proponer una fecha
+consultar_disponibilidad = FunctionDeclaration(
+    name="consultar_disponibilidad",
+    description="Devuelve los próximos horarios disponibles de una experiencia para un número de comensales dentro de un rango de fechas. Úsala ANTES de proponer o confirmar una fecha y hora.",
+    parameters={
+        "type": "OBJECT",
+        "properties": {
+            "experiencia_id": {
+                "type": "INTEGER",
+                "description": "El ID de la experiencia (1, 2 o 3)."
+            },
+            "num_comensales": {
+                "type": "INTEGER",
+                "description": "Número total de personas."
+            },
+            "fecha_desde": {
+                "type": "STRING",
+                "description": "Inicio del rango en formato ISO 8601 (YYYY-MM-DD o YYYY-MM-DDTHH:MM:SS)."
+            },
+            "fecha_hasta": {
+                "type": "STRING",
+                "description": "Fin del rango en formato ISO 8601 (opcional; por defecto una semana después de fecha_desde)."
+            },
+            "max_resultados": {
+                "type": "INTEGER",
+                "description": "Cuántos horarios devolver como máximo (opcional; por defecto 5)."
+            }
+        },
+        "required": ["experiencia_id", "num_comensales", "fecha_desde"]
+    }
+)
+
+# 2c. Herramienta para anotarse en la lista de espera de un turno lleno
+unirse_lista_espera = FunctionDeclaration(
+    name="unirse_lista_espera",
+    description="Anota al usuario logueado en la lista de espera de un horario sin cupo. Si se libera sitio, la reserva se crea automáticamente. Úsala solo si el usuario acepta esperar tras un 'sin_cupo'.",
+    parameters={
+        "type": "OBJECT",
+        "properties": {
+            "nombre_reserva": {
+                "type": "STRING",
+                "description": "Nombre a quien quedará la reserva (puede ser el nombre del usuario)."
+            },
+            "num_comensales": {
+                "type": "INTEGER",
+                "description": "Número total de personas."
+            },
+            "experiencia_id": {
+                "type": "INTEGER",
+                "description": "El ID de la experiencia (1, 2 o 3)."
+            },
+            "fecha_hora": {
+                "type": "STRING",
+                "description": "Fecha y hora deseadas en formato ISO 8601 (YYYY-MM-DDTHH:MM:SS)."
+            },
+            "restricciones_adicionales": {
+                "type": "STRING",
+                "description": "Observaciones o restricciones específicas para esta reserva."
+            }
+        },
+        "required": ["nombre_reserva", "num_comensales", "experiencia_id", "fecha_hora"]
+    }
+)
+
+cancelar_lista_espera = FunctionDeclaration(
+    name="cancelar_lista_espera",
+    description="Retira al usuario logueado de la lista de espera cuando ya no quiere esperar. Indica el ID de la solicitud (lista_espera_id) o la experiencia y, si lo sabes, la fecha y hora.",
+    parameters={
+        "type": "OBJECT",
+        "properties": {
+            "lista_espera_id": {
+                "type": "INTEGER",
+                "description": "El ID de la solicitud devuelto por unirse_lista_espera, si se conoce."
+            },
+            "experiencia_id": {
+                "type": "INTEGER",
+                "description": "El ID de la experiencia (1, 2 o 3), si no se conoce el ID de la solicitud."
+            },
+            "fecha_hora": {
+                "type": "STRING",
+                "description": "Fecha y hora de la solicitud en formato ISO 8601 (YYYY-MM-DDTHH:MM:SS). Sin ella se retiran todas las de esa experiencia."
+            }
+        }
+    }
+)
+
 # 3. Herramienta para obtener una recomendación de experiencia
 recomendar_experiencia = FunctionDeclaration(
     name="recomendar_experiencia",
@@ -81,6 +197,10 @@ recomendar_experiencia = FunctionDeclaration(
             "estilo_cocina": {
                 "type": "STRING",
                 "description": "¿Qué estilo de cocina te atrae más? (Tradicional/Criolla, Moderna/Fusión, Vegana, Gourmet)"
+            },
+            "num_comensales": {
+                "type": "INTEGER",
+                "description": "Número de personas, si ya lo sabes (opcional)."
             }
         },
         "required": ["motivo_visita", "acompanantes", "estilo_cocina"]
@@ -88,4 +208,4 @@ recomendar_experiencia = FunctionDeclaration(
 )
 
 # Lista de herramientas para el modelo
-chatbot_tools = Tool(function_declarations=[guardar_perfil_alimentario, crear_reserva, recomendar_experiencia])
\ No newline at end of file
+chatbot_tools = Tool(function_declarations=[guardar_perfil_alimentario, actualizar_perfil_alimentario, consultar_disponibilidad, crear_reserva, unirse_lista_espera, cancelar_lista_espera, recomendar_experiencia])
\ No newline at end of file